@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""An index of the abbreviations a document defines, e.g. "body mass index (BMI)".
+
+Papers define an abbreviation once, inline in a cell or in the footnotes of a table, and then use the
+bare acronym throughout. Abbreviation_Index.build collects these definitions in a single pass over the
+text of every cell (and footnote) of the intermediate structure:
+  inline      "Body mass index (BMI), kg/m2"         BMI -> Body mass index
+  footnotes   "BMI, body mass index; SD, standard deviation."   (also "BMI = ..." and "BMI: ...")
+
+A definition is only accepted if the letters of the abbreviation can be found, in order, in its
+expansion, with the first letter starting a word (the algorithm of Schwartz and Hearst, "A simple
+algorithm for identifying abbreviation definitions in biomedical text", 2003). The first definition
+of an abbreviation in the document is kept.
+"""
+import re
+
+from .tree_traversal import preorder
+
+# a parenthesized candidate abbreviation (at most 2 words, 10 characters)
+INLINE_DEFINITION = re.compile(r'\(\s*([A-Za-z0-9][\w\-/&]*(?: [\w\-]+)?)\s*\)')
+# an abbreviation followed by its expansion, as in footnotes ("BMI, body mass index")
+LISTED_DEFINITION = re.compile(r'\s*(?:abbreviations?\s*:\s*)?([A-Za-z0-9][\w\-/&]*)\s*[,:=]\s*(.+?)[\s.]*', re.IGNORECASE)
+
+def long_form(short_form, text):
+    """Return the shortest end of text that defines short_form, or None if it does not define it.
+
+    Every letter and digit of short_form must be found in text, in the same order, and the first one must
+    start a word.
+
+    Parameters:
+      short_form (string): The abbreviation
+      text (string): The text before the abbreviation (or its listed expansion)
+
+    Returns:
+      string: The expansion (a suffix of text, starting at a word), or None
+    """
+    s = len(short_form) - 1
+    t = len(text) - 1
+    while s >= 0:
+        c = short_form[s].lower()
+        if not c.isalnum():
+            s -= 1
+            continue
+        # the first character of the abbreviation must be at the start of a word
+        while t >= 0 and (text[t].lower() != c or (s == 0 and t > 0 and text[t-1].isalnum())):
+            t -= 1
+        if t < 0:
+            return None
+        t -= 1
+        s -= 1
+    start = text.rfind(" ", 0, t+1) + 1
+    return text[start:].strip()
+
+class Abbreviation_Index:
+    """Abbreviations defined in a document, and their expansions (see module description).
+
+    Attributes:
+      definitions (dict): Abbreviation -> expansion
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty Abbreviation_Index."""
+        self.definitions = {}
+
+    def __contains__(self, abbreviation):
+        return abbreviation in self.definitions
+
+    def __len__(self):
+        return len(self.definitions)
+
+    def get(self, abbreviation):
+        """Return the expansion of abbreviation, or None if the document does not define it."""
+        return self.definitions.get(abbreviation)
+
+    def define(self, short_form, text):
+        """Record short_form as an abbreviation of the end of text, if that end defines it (see long_form)."""
+        if short_form in self.definitions or len(short_form) < 2 or len(short_form) > 10:
+            return
+        if not any(c.isupper() for c in short_form):
+            return
+        # look at most min(|SF| + 5, 2 |SF|) words back
+        words = text.split()
+        words = words[-min(len(short_form) + 5, 2 * len(short_form)):]
+        expansion = long_form(short_form, " ".join(words))
+        if expansion is not None and len(expansion) > len(short_form) and short_form not in expansion.split():
+            self.definitions[short_form] = expansion
+
+    def add_text(self, text):
+        """Collect the inline definitions of text ("body mass index (BMI)")."""
+        for m in INLINE_DEFINITION.finditer(text):
+            self.define(m.group(1), text[:m.start()])
+
+    def add_footnote(self, text):
+        """Collect the definitions of a footnote, both listed ("BMI, body mass index; ...") and inline."""
+        for part in text.split(";"):
+            m = LISTED_DEFINITION.fullmatch(part)
+            if m is not None:
+                # the expansion comes after the abbreviation here, so only a whole expansion is accepted
+                expansion = long_form(m.group(1), m.group(2))
+                if expansion == m.group(2):
+                    self.define(m.group(1), expansion)
+        self.add_text(text)
+
+    def add_table(self, table):
+        """Collect the definitions of the cells of table, and of its subtables."""
+        for subtable, depth in preorder(table):
+            for cell in subtable["fields"]:
+                self.add_text(cell["text"])
+
+    @classmethod
+    def build(cls, intermediate_structure):
+        """Build the index of a document.
+
+        Parameters:
+          intermediate_structure (dict): The tree table extraction (its "footnotes", cells or strings, are used too)
+
+        Returns:
+          Abbreviation_Index: The index
+        """
+        index = cls()
+        for footnote in intermediate_structure.get("footnotes", []):
+            index.add_footnote(footnote["text"] if isinstance(footnote, dict) else footnote)
+        for table in intermediate_structure["tables"]:
+            index.add_table(table)
+        return index
@@ -1,14 +1,34 @@
 import urllib.request, urllib.error, urllib.parse
 import json
 import os
+import copy
+import socket
+from bisect import bisect_right
 from pprint import pprint
 
-from time import sleep
+from .rate_limiter import Shared_Rate_Limiter
+from .annotation_cache import cache_key
 
 REST_URL = "http://data.bioontology.org"
 NCBO_API_KEY = ""
 API_KEY_FILE = "./api_keys.json"
 
+# used by annotate_batch to join texts into a single request
+# the annotator does not match across "|", and any match that does cross it is dropped anyway
+BATCH_SEPARATOR = " ||| "
+# keep the (GET) request url to a reasonable length
+MAX_BATCH_CHARS = 3000
+
+# shared by all processes on this host, see get_rate_limiter
+# replace with a configured Shared_Rate_Limiter to change the limits (or with None to use the default)
+RATE_LIMITER = None
+# how many times a request rejected with HTTP 429 (too many requests) is retried
+MAX_RETRIES = 5
+
+# if set, annotate and annotate_batch look up (and store) results here before sending a request
+# e.g. an annotation_cache.Annotation_Cache, or a Snapshot_Cache for read-mostly workers
+CACHE = None
+
 def get_json(url):
     global NCBO_API_KEY
         
@@ -17,7 +37,56 @@ def get_json(url):
     if NCBO_API_KEY is "":
         NCBO_API_KEY = load_api_key()
     opener.addheaders = [('Authorization', 'apikey token=' + NCBO_API_KEY)]
-    return json.loads(opener.open(url).read())
+    return json.loads(open_limited(opener, url))
+
+def get_rate_limiter():
+    ''' Returns the rate limiter used for all requests to the REST API (creating the default one if needed).'''
+    global RATE_LIMITER
+    
+    if RATE_LIMITER is None:
+        RATE_LIMITER = Shared_Rate_Limiter()
+    return RATE_LIMITER
+
+def failure_of(error):
+    ''' Returns the failure to report to the rate limiter for a request that raised error (see Shared_Rate_Limiter.release):
+        "overload" for server errors (5xx) and timeouts, "error" otherwise.
+    '''
+    if isinstance(error, urllib.error.HTTPError):
+        return "overload" if error.code >= 500 else "error"
+    if isinstance(error, urllib.error.URLError):
+        error = error.reason
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return "overload"
+    return "error"
+
+def open_limited(opener, req):
+    ''' Opens req (url or Request) with opener once the rate limiter allows it, and returns the response body.
+    
+        Requests rejected with HTTP 429 are retried up to MAX_RETRIES times. Other failures are reported to the
+        rate limiter (see failure_of), and raised.
+    '''
+    limiter = get_rate_limiter()
+    
+    for attempt in range(MAX_RETRIES+1):
+        ticket = limiter.acquire()
+        try:
+            body = opener.open(req).read()
+        except urllib.error.HTTPError as e:
+            if e.code != 429:
+                limiter.release(ticket, failure=failure_of(e))
+                raise
+            retry_after = None
+            if e.headers is not None and e.headers.get("Retry-After", "").isdigit():
+                retry_after = float(e.headers["Retry-After"])
+            limiter.release(ticket, throttled=True, retry_after=retry_after)
+            if attempt == MAX_RETRIES:
+                raise
+            continue
+        except BaseException as e:
+            limiter.release(ticket, failure=failure_of(e))
+            raise
+        limiter.release(ticket)
+        return body
 
 def load_api_key():
     
@@ -64,7 +133,23 @@ def print_annotations(annotations, get_class=True):
 
                           
 def annotate(text, ontologies):
-    ''' Returns the results of the NCBO annotator on text, when limited to the ontologies in ontologies (list of strings).'''
+    ''' Returns the results of the NCBO annotator on text, when limited to the ontologies in ontologies (list of strings).
+    
+        Results are taken from (and stored in) CACHE, if it is set.
+    '''
+    
+    if CACHE is None:
+        return request_annotations(text, ontologies)
+    
+    key = cache_key(text, ontologies)
+    results = CACHE.get(key)
+    if results is None:
+        results = request_annotations(text, ontologies)
+        CACHE.put(key, results)
+    return results
+
+def request_annotations(text, ontologies):
+    ''' Sends the request for annotate (bypassing the cache).'''
                           
     if ontologies is None:
         return  get_json(REST_URL + "/annotator?text=" + urllib.parse.quote(text))
@@ -72,10 +157,97 @@ def annotate(text, ontologies):
     o_ids = ""
     for o_id in ontologies:
         o_ids = o_ids+o_id+","
-    sleep(0.08)
     print("REQ: "+text)
     return  get_json(REST_URL + "/annotator?include=prefLabel&text=" + urllib.parse.quote(text) + "&ontologies=" + o_ids)
        
+def annotate_batch(texts, ontologies, max_chars=MAX_BATCH_CHARS):
+    ''' Returns the results of the NCBO annotator for each text in texts, using as few requests as possible.
+    
+        Texts are joined with BATCH_SEPARATOR into requests of at most max_chars characters. The returned
+        annotations are assigned back to their original text by their from/to offsets (which are rebased
+        to that text), and annotations that cross a separator are dropped.
+        
+        Returns a list with one element per text in texts, each a list of dicts as returned by annotate.
+    '''
+    
+    # only send each distinct text once
+    unique_texts = list(dict.fromkeys(texts))
+    text_to_results = {}
+    
+    # and only those that are not cached yet
+    if CACHE is not None:
+        uncached_texts = []
+        for text in unique_texts:
+            results = CACHE.get(cache_key(text, ontologies))
+            if results is None:
+                uncached_texts.append(text)
+            else:
+                text_to_results[text] = results
+        unique_texts = uncached_texts
+    
+    batch = []
+    batch_len = 0
+    for text in unique_texts:
+        if len(batch) > 0 and batch_len + len(BATCH_SEPARATOR) + len(text) > max_chars:
+            text_to_results.update(annotate_joined(batch, ontologies))
+            batch = []
+            batch_len = 0
+        if len(batch) > 0:
+            batch_len += len(BATCH_SEPARATOR)
+        batch.append(text)
+        batch_len += len(text)
+    if len(batch) > 0:
+        text_to_results.update(annotate_joined(batch, ontologies))
+    
+    if CACHE is not None:
+        for text in unique_texts:
+            CACHE.put(cache_key(text, ontologies), text_to_results[text])
+    
+    # results of repeated texts are copied, as callers may modify them
+    all_results = []
+    seen = set()
+    for text in texts:
+        if text in seen:
+            all_results.append(copy.deepcopy(text_to_results[text]))
+        else:
+            seen.add(text)
+            all_results.append(text_to_results[text])
+    return all_results
+
+def annotate_joined(texts, ontologies):
+    ''' Annotates the distinct texts in a single request. Returns a dict of text -> list of results (see annotate_batch).'''
+    
+    # 0-based start offset of each text within the joined text
+    starts = []
+    joined = ""
+    for text in texts:
+        if len(starts) > 0:
+            joined += BATCH_SEPARATOR
+        starts.append(len(joined))
+        joined += text
+    
+    # text index -> {result index -> result}, in order of appearance
+    demuxed = [{} for text in texts]
+    
+    for r_idx,r in enumerate(request_annotations(joined, ontologies)):
+        for annotation in r["annotations"]:
+            # the annotator uses 1-based, inclusive offsets
+            begin = annotation["from"] - 1
+            idx = bisect_right(starts, begin) - 1
+            if idx < 0 or annotation["to"] > starts[idx] + len(texts[idx]):
+                continue # crosses a separator
+            
+            if r_idx not in demuxed[idx]:
+                res = dict(r)
+                res["annotations"] = []
+                demuxed[idx][r_idx] = res
+            annotation = dict(annotation)
+            annotation["from"] -= starts[idx]
+            annotation["to"] -= starts[idx]
+            demuxed[idx][r_idx]["annotations"].append(annotation)
+    
+    return {text:list(demuxed[i].values()) for i,text in enumerate(texts)}
+       
 def post(url,data):
     global NCBO_API_KEY
                           
@@ -87,7 +259,7 @@ def post(url,data):
     if NCBO_API_KEY is "":
         NCBO_API_KEY = load_api_key()
     opener.addheaders = [('Authorization', 'apikey token=' + NCBO_API_KEY),('Content-Type', 'application/json'),('Accept', 'application/json')]
-    return json.loads(opener.open(req).read())
+    return json.loads(open_limited(opener, req))
                           
 def get_semantic_types(results):
     
@@ -99,7 +271,6 @@ def get_semantic_types(results):
     data = {"http://www.w3.org/2002/07/owl#Class": {"collection":collection,"display": "semanticTypes"}}
                           
     # use batch endpoint
-    sleep(0.08)
     print("BATCH REQ")
     post(REST_URL+"/batch",data)
                           
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Caches for the results of the NCBO Annotator.
+
+   3 classes:
+     Annotation_Cache: a writable cache kept in an SQLite database
+     Annotation_Snapshot: an immutable, memory-mapped snapshot exported from an Annotation_Cache
+     Snapshot_Cache: reads from a snapshot first, and falls back to a live cache on a miss
+
+A typical setup is to fill an Annotation_Cache during a corpus run, export it once the run is
+complete, and have every worker (on every host) read from the snapshot:
+
+  python -m extraction.annotation_cache annotations.sqlite annotations.snapshot
+
+  annotate_text.CACHE = Snapshot_Cache(Annotation_Snapshot("annotations.snapshot"), Annotation_Cache("annotations.sqlite"))
+
+Snapshot file layout (all integers little-endian):
+  header: magic (8 bytes), version (uint32), number of records (uint64)
+  index: one (key hash (uint64), record offset (uint64), record length (uint32)) entry per record, sorted by key hash
+  records: key length (uint32), key (utf-8), zlib-compressed json of the annotator results
+"""
+import argparse
+import hashlib
+import json
+import mmap
+import sqlite3
+import struct
+import threading
+import zlib
+
+def cache_key(text, ontologies):
+    """Return the cache key for annotating text, limited to ontologies (list of strings, or None)."""
+    if ontologies is None:
+        return "|"+text
+    return ",".join(ontologies)+"|"+text
+
+def key_hash(key):
+    """Return the 64-bit hash of key that the snapshot index is sorted by."""
+    return int.from_bytes(hashlib.blake2b(key.encode("utf-8"), digest_size=8).digest(), "little")
+
+class Annotation_Cache:
+    """A writable cache of annotator results, kept in an SQLite database.
+
+    Safe to share between threads. Several processes may use the same database, although a
+    snapshot is a better fit for many mostly-reading workers (see Annotation_Snapshot).
+
+    Attributes:
+      path (string): Path of the database file
+
+    """
+
+    def __init__(self, path):
+        """Open (or create) an Annotation_Cache.
+
+        Parameters:
+          path (string): Path of the database file
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock:
+            self.db.execute("CREATE TABLE IF NOT EXISTS annotations (key TEXT PRIMARY KEY, results TEXT)")
+            self.db.commit()
+
+    def get(self, key):
+        """Return the cached results for key, or None if there are none.
+
+        Returns:
+          list: list of dicts (json-parsed) corresponding to the annotator results.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT results FROM annotations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key, results):
+        """Cache the results (list of json-parsed dicts) for key."""
+        data = json.dumps(results, separators=(",", ":"))
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO annotations (key, results) VALUES (?, ?)", (key, data))
+            self.db.commit()
+
+    def items(self):
+        """Iterate over all (key, results json string) pairs in the cache."""
+        with self.lock:
+            rows = self.db.execute("SELECT key, results FROM annotations").fetchall()
+        return iter(rows)
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            self.db.close()
+
+class Annotation_Snapshot:
+    """An immutable snapshot of an Annotation_Cache, read through a memory map.
+
+    Lookups binary-search the index directly in the mapped file, so no part of the snapshot is
+    loaded into (per-process) memory, and processes on the same host share the same pages.
+
+    Attributes:
+      path (string): Path of the snapshot file
+      count (int): Number of records in the snapshot
+
+    """
+
+    MAGIC = b"NCBOSNAP"
+    VERSION = 1
+    HEADER = struct.Struct("<8sIQ")
+    ENTRY = struct.Struct("<QQI")
+    KEY_LEN = struct.Struct("<I")
+
+    def __init__(self, path):
+        """Open an Annotation_Snapshot.
+
+        Parameters:
+          path (string): Path of the snapshot file (see export_snapshot)
+        """
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count = self.HEADER.unpack_from(self.mm, 0)
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(path+" is not a version "+str(self.VERSION)+" annotation snapshot")
+
+    def entry(self, i):
+        """Return the (hash, offset, length) index entry at position i."""
+        return self.ENTRY.unpack_from(self.mm, self.HEADER.size + i * self.ENTRY.size)
+
+    def get(self, key):
+        """Return the results for key, or None if the snapshot does not contain key.
+
+        Returns:
+          list: list of dicts (json-parsed) corresponding to the annotator results.
+        """
+        h = key_hash(key)
+        encoded_key = key.encode("utf-8")
+
+        # leftmost index entry with this hash
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.entry(mid)[0] < h:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # compare keys, in case of hash collisions
+        while lo < self.count:
+            entry_hash, offset, length = self.entry(lo)
+            if entry_hash != h:
+                break
+            (key_len,) = self.KEY_LEN.unpack_from(self.mm, offset)
+            key_start = offset + self.KEY_LEN.size
+            if self.mm[key_start:key_start + key_len] == encoded_key:
+                return json.loads(zlib.decompress(self.mm[key_start + key_len:offset + length]))
+            lo += 1
+        return None
+
+    def put(self, key, results):
+        """Snapshots are immutable."""
+        raise TypeError("Annotation_Snapshot is immutable, use Snapshot_Cache to add results")
+
+    def close(self):
+        """Close the memory map."""
+        self.mm.close()
+
+class Snapshot_Cache:
+    """A cache that reads from an Annotation_Snapshot, and only falls back to a live cache on a miss.
+
+    Attributes:
+      snapshot (Annotation_Snapshot): The snapshot to read from first
+      live_cache (Annotation_Cache): The cache to read from on a miss, and to put new results in. May be None.
+
+    """
+
+    def __init__(self, snapshot, live_cache=None):
+        """Instantiate a Snapshot_Cache.
+
+        Parameters:
+          snapshot (Annotation_Snapshot): The snapshot to read from first
+          live_cache (Annotation_Cache, optional): The cache used on a miss. None by default.
+        """
+        self.snapshot = snapshot
+        self.live_cache = live_cache
+
+    def get(self, key):
+        """Return the cached results for key, or None if there are none."""
+        results = self.snapshot.get(key)
+        if results is None and self.live_cache is not None:
+            results = self.live_cache.get(key)
+        return results
+
+    def put(self, key, results):
+        """Cache the results for key in the live cache (if any)."""
+        if self.live_cache is not None:
+            self.live_cache.put(key, results)
+
+def export_snapshot(cache, snapshot_path):
+    """Export an Annotation_Cache (e.g. after a completed corpus run) to an immutable snapshot file.
+
+    Parameters:
+      cache (Annotation_Cache): The cache to export
+      snapshot_path (string): Path of the snapshot file to write
+
+    Returns:
+      int: Number of records in the snapshot
+    """
+    records = []
+    for key, results in cache.items():
+        encoded_key = key.encode("utf-8")
+        # re-encode compactly, regardless of how the cache stored it
+        data = zlib.compress(json.dumps(json.loads(results), separators=(",", ":")).encode("utf-8"), 9)
+        records.append((key_hash(key), Annotation_Snapshot.KEY_LEN.pack(len(encoded_key)) + encoded_key + data))
+    records.sort(key=lambda r: r[0])
+
+    with open(snapshot_path, "wb") as f:
+        f.write(Annotation_Snapshot.HEADER.pack(Annotation_Snapshot.MAGIC, Annotation_Snapshot.VERSION, len(records)))
+        offset = Annotation_Snapshot.HEADER.size + len(records) * Annotation_Snapshot.ENTRY.size
+        for h, record in records:
+            f.write(Annotation_Snapshot.ENTRY.pack(h, offset, len(record)))
+            offset += len(record)
+        for h, record in records:
+            f.write(record)
+
+    return len(records)
+
+def main():
+    """Export the annotation cache given in sys.argv to a snapshot."""
+    parser = argparse.ArgumentParser(description="Exports an annotation cache (SQLite) to an immutable, memory-mappable snapshot.")
+
+    parser.add_argument('cache_file', help='SQLite annotation cache filled during a corpus run')
+    parser.add_argument('snapshot_file', help='Name of the snapshot file to create')
+
+    args = parser.parse_args()
+
+    cache = Annotation_Cache(args.cache_file)
+    count = export_snapshot(cache, args.snapshot_file)
+    cache.close()
+
+    print("Saved snapshot of "+str(count)+" annotation results to "+args.snapshot_file+"\n")
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A compact, persisted record of annotator queries that are known to return nothing useful.
+
+   2 classes:
+     Bloom_Filter: a plain Bloom filter over strings, which can be saved to and loaded from a file
+     Known_Empty_Filter: a Bloom_Filter that is shared between workers through files, and rebuilt periodically and as it fills up
+"""
+import hashlib
+import math
+import os
+import struct
+import threading
+
+class Bloom_Filter:
+    """A Bloom filter over strings.
+
+    Membership tests may return false positives (at about error_rate once capacity strings have been
+    added), but never false negatives.
+
+    Attributes:
+      capacity (int): Number of strings the filter is sized for
+      error_rate (float): False positive rate at capacity
+      num_bits (int): Size of the bit array
+      num_hashes (int): Number of bits set per string
+      count (int): Number of strings added so far
+
+    """
+
+    MAGIC = b"BLMF"
+    HEADER = struct.Struct("<4sQdQIQ")
+
+    def __init__(self, capacity, error_rate=0.001):
+        """Instantiate an empty Bloom_Filter.
+
+        Parameters:
+          capacity (int): Number of strings the filter is sized for
+          error_rate (float, optional): False positive rate at capacity. 0.001 by default.
+        """
+        self.capacity = max(int(capacity), 1)
+        self.error_rate = error_rate
+        self.num_bits = max(int(math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))), 8)
+        self.num_hashes = max(int(round(self.num_bits / self.capacity * math.log(2))), 1)
+        self.count = 0
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def positions(self, key):
+        """Return the bit positions for key (via double hashing)."""
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key):
+        """Add key to the filter.
+
+        Returns:
+          bool: True if key was (probably) not in the filter yet
+        """
+        added = False
+        for p in self.positions(key):
+            mask = 1 << (p & 7)
+            if not self.bits[p >> 3] & mask:
+                self.bits[p >> 3] |= mask
+                added = True
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, key):
+        for p in self.positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+
+    def save(self, path):
+        """Save the filter to path (atomically replacing any existing file)."""
+        # a temporary file per process and thread, so that concurrent saves do not write to the same file
+        tmp = path+".tmp"+str(os.getpid())+"-"+str(threading.get_ident())
+        with open(tmp, "wb") as f:
+            f.write(self.HEADER.pack(self.MAGIC, self.capacity, self.error_rate, self.num_bits, self.num_hashes, self.count))
+            f.write(self.bits)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a filter saved with save().
+
+        Returns:
+          Bloom_Filter: The loaded filter
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, capacity, error_rate, num_bits, num_hashes, count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(path+" is not a saved Bloom_Filter")
+        bf = cls.__new__(cls)
+        bf.capacity = capacity
+        bf.error_rate = error_rate
+        bf.num_bits = num_bits
+        bf.num_hashes = num_hashes
+        bf.count = count
+        bf.bits = bytearray(data[cls.HEADER.size:])
+        return bf
+
+class Known_Empty_Filter:
+    """A Bloom filter of query keys that returned no ranked results, shared between workers through files.
+
+    The filter itself is kept in 'path', and every key ever added is appended (one per line) to
+    'path'.keys. Workers load the filter at startup, append their own new keys to the key log, and
+    save their filter every save_every new keys. Since Bloom filters cannot be resized, the filter
+    is rebuilt from the key log (at twice the size) once it holds more keys than it was sized for.
+    It is also rebuilt every rebuild_every new keys, which picks up the keys added by other workers,
+    even those that saved a filter of another size.
+
+    A Known_Empty_Filter can be shared between threads: adding, saving and rebuilding hold its lock.
+
+    Attributes:
+      path (string): File the filter is saved to
+      error_rate (float): False positive rate of the filter at capacity
+      save_every (int): Number of new keys after which the filter is saved
+      rebuild_every (int): Number of new keys after which the filter is rebuilt from the key log (None for never)
+      bloom (Bloom_Filter): The current filter
+      lock (threading.RLock): Held while the filter or its files are updated
+
+    """
+
+    def __init__(self, path, error_rate=0.001, capacity=100000, save_every=100, rebuild_every=10000):
+        """Instantiate a Known_Empty_Filter, loading it from path if it has been saved before.
+
+        Parameters:
+          path (string): File the filter is saved to (the key log is kept in path+".keys")
+          error_rate (float, optional): False positive rate at capacity. 0.001 by default.
+          capacity (int, optional): Initial number of keys the filter is sized for. 100000 by default.
+          save_every (int, optional): Number of new keys after which the filter is saved. 100 by default.
+          rebuild_every (int, optional): Number of new keys after which the filter is rebuilt from the key log.
+            10000 by default. None to rebuild only when the filter is full.
+        """
+        self.path = path
+        self.error_rate = error_rate
+        self.save_every = save_every
+        self.rebuild_every = rebuild_every
+        self.key_log = path+".keys"
+        self.unsaved = 0
+        self.unrebuilt = 0
+        self.lock = threading.RLock()
+
+        if os.path.exists(path):
+            self.bloom = Bloom_Filter.load(path)
+        elif os.path.exists(self.key_log):
+            self.bloom = Bloom_Filter(capacity, error_rate)
+            self.rebuild()
+        else:
+            self.bloom = Bloom_Filter(capacity, error_rate)
+
+    def __contains__(self, key):
+        return key in self.bloom
+
+    def add(self, key):
+        """Record key as returning no ranked results."""
+        with self.lock:
+            if not self.bloom.add(key):
+                return
+            with open(self.key_log, "a", encoding="utf-8") as f:
+                f.write(key.replace("\n", " ")+"\n")
+            self.unsaved += 1
+            self.unrebuilt += 1
+            if self.bloom.count > self.bloom.capacity or \
+               (self.rebuild_every is not None and self.unrebuilt >= self.rebuild_every):
+                self.rebuild()
+            elif self.unsaved >= self.save_every:
+                self.save()
+
+    def rebuild(self):
+        """Rebuild the filter from the key log (sized for at least twice as many keys), and save it."""
+        with self.lock:
+            keys = set()
+            if os.path.exists(self.key_log):
+                with open(self.key_log, encoding="utf-8") as f:
+                    keys = set(line.rstrip("\n") for line in f)
+
+            bloom = Bloom_Filter(max(self.bloom.capacity, 2 * len(keys)), self.error_rate)
+            for key in keys:
+                bloom.add(key)
+            self.bloom = bloom
+            self.unrebuilt = 0
+            self.save()
+
+    def save(self):
+        """Save the filter, so that workers started later can load it.
+        
+        If another worker has saved a filter of the same size in the meantime, its keys are merged in.
+        """
+        with self.lock:
+            self.merge_saved()
+            self.bloom.save(self.path)
+            self.unsaved = 0
+
+    def merge_saved(self):
+        """Merge in the keys of the saved filter, if it has the same size. Returns False if it has not."""
+        with self.lock:
+            if not os.path.exists(self.path):
+                return True
+            saved = Bloom_Filter.load(self.path)
+            if saved.num_bits != self.bloom.num_bits or saved.num_hashes != self.bloom.num_hashes:
+                return False
+            merged = int.from_bytes(saved.bits, "little") | int.from_bytes(self.bloom.bits, "little")
+            self.bloom.bits = bytearray(merged.to_bytes(len(self.bloom.bits), "little"))
+            self.bloom.count = max(self.bloom.count, saved.count)
+            return True
+
+    def refresh(self):
+        """Take in the keys other workers have saved (e.g. worker processes of the KG_Builder), rebuilding the filter
+        from the key log if they saved a filter of another size."""
+        with self.lock:
+            if not self.merge_saved():
+                self.rebuild()
+
+    def __getstate__(self):
+        # locks cannot be pickled (e.g. to send the filter to a worker process)
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.RLock()
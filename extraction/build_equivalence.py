@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A regression check that the faster ways of building a KG give the same KG as a plain sequential build.
+
+KG_Builder can build the tables of a document one after another, in threads or in worker processes
+(parallel), and can rebuild only the columns an edited cell touches (incremental, update_cell). All
+of them must give the KG of a sequential build from scratch. This module checks, on a synthetic
+document of baseline characteristics tables:
+  parallel      the KGs of the sequential, "threads" and "processes" builds are equal
+  incremental   for every cell, update_cell with the cell's text unchanged leaves the KG as it was,
+                and update_cell with an edited text gives the KG of a full build of the edited document
+
+The classifiers run offline (the NCBO annotator is not used), so the check needs no API key.
+KGs are compared as sets of triples, with their blank nodes named after the triples around
+them (see canonical_triples), since blank node ids differ from one build to the next.
+
+  python -m extraction.build_equivalence [--tables 2] [--workers 2]
+"""
+import argparse
+import contextlib
+import copy
+import hashlib
+import io
+
+import rdflib
+
+from .kg_builder import KG_Builder
+from .tree_traversal import preorder
+
+# offline classifiers: no NCBO annotator
+CONFIG = {"token_classifiers": ["free_value", "concept", "units"], "pattern_classifiers": []}
+
+# rows of the synthetic table: (texts, child rows)
+ROWS = [
+    (["Age, years", "45.2 ± 3.1", "46.0 ± 2.9"], []),
+    (["Sex, n (%)", "", ""], [(["Male", "20 (40)", "25 (48.1)"], []), (["Female", "30 (60)", "27 (51.9)"], [])]),
+    (["Body mass index (BMI), kg/m2", "27.1 ± 4.2", "26.8 ± 3.9"], []),
+    (["BMI > 30, n (%)", "12 (24)", "10 (19.2)"], []),
+    (["Systolic blood pressure, mmHg", "128 (120−135)", "131 (122-140)"], []),
+    (["Diabetes, Median [IQR]", "5 [3-7]", "6 [4-8]"], []),
+    (["Current smoker, No. (%)", "9 (18)", "11 (21.2)"], []),
+    (["Mean SD", "", ""], [(["Age", "50.1 (7.2)", "49.9 (6.8)"], [])]),
+]
+
+# edits made to cells by the incremental check (any other text gets " 12 (40)" appended)
+EDITS = {"Age, years": "Age, months", "45.2 ± 3.1": "50.1 ± 2.0", "Mean SD": "Median IQR", "": "n (%)"}
+
+def make_document(tables=2):
+    """Return the intermediate structure of a synthetic document of tables baseline characteristics tables."""
+    counter = [0]
+
+    def row(texts, children, table_num):
+        r = counter[0]
+        counter[0] += 1
+        fields = [{"text": text, "spans": [[r, c]], "bbox": [10.0, 0, 50, 10] if text else None, "type": "body",
+                   "table_num": table_num, "fonts": [[text, "Regular"]] if text else []} for c, text in enumerate(texts)]
+        return {"fields": fields, "records": [row(t, ch, table_num) for t, ch in children]}
+
+    data = {"_version": "0.0.2", "tables": [], "footnotes": [{"text": "BMI, body mass index; SD, standard deviation."}]}
+    for table_num in range(tables):
+        counter[0] = 0
+        data["tables"].append(row(["Characteristic", "Placebo (n=50)", "Drug (n=52)"], ROWS, table_num))
+    return data
+
+def edit(text):
+    """Return the edited text of a cell (see EDITS)."""
+    return EDITS.get(text, text + " 12 (40)")
+
+def cells_of(data):
+    """Return the cells of data, table by table, in preorder."""
+    return [cell for table in data["tables"] for row, depth in preorder(table) for cell in row["fields"]]
+
+def canonical_triples(data, rounds=4):
+    """Return the triples of the KG of data (after build_KG) as a sorted list of strings, blank nodes included.
+
+    Every blank node is named after a hash of the triples it is in, refined rounds times with the names
+    of its neighbours (the names of equal graphs are equal, whatever the ids of their blank nodes).
+    """
+    g = rdflib.Graph()
+    for table in data["tables"]:
+        for cell in table["fields"]:
+            for feature in cell.get("column", []):
+                feature.translate(g)
+
+    def name(term, names):
+        return names[term] if isinstance(term, rdflib.BNode) else term.n3()
+
+    names = {term: "_" for triple in g for term in triple if isinstance(term, rdflib.BNode)}
+    for i in range(rounds):
+        signatures = {node: [] for node in names}
+        for s, p, o in g:
+            line = name(s, names)+" "+name(p, names)+" "+name(o, names)
+            if s in signatures:
+                signatures[s].append("s "+line)
+            if o in signatures:
+                signatures[o].append("o "+line)
+        names = {node: "_:"+hashlib.sha1("\n".join(sorted(lines)).encode("utf-8")).hexdigest()[:16]
+                 for node, lines in signatures.items()}
+    return sorted(name(s, names)+" "+name(p, names)+" "+name(o, names) for s, p, o in g)
+
+def build(data, **options):
+    """Build the KG of data with a new KG_Builder (made with options), quietly. Returns the builder."""
+    kg = KG_Builder(copy.deepcopy(CONFIG), **options)
+    with contextlib.redirect_stdout(io.StringIO()):
+        kg.build_KG(data)
+    return kg
+
+def check_parallel(tables=2, workers=2):
+    """Check that the "threads" and "processes" builds give the KG of the sequential build.
+
+    Returns:
+      list: The modes whose KG differs (empty if all agree)
+    """
+    expected = make_document(tables)
+    build(expected)
+    expected = canonical_triples(expected)
+    differ = []
+    for parallel in ("threads", "processes"):
+        data = make_document(tables)
+        build(data, parallel=parallel, workers=workers)
+        if canonical_triples(data) != expected:
+            differ.append(parallel)
+    return differ
+
+def check_incremental(tables=2):
+    """Check update_cell against full builds, for every cell of the document (see module description).
+
+    Returns:
+      tuple: (number of cells, list of (cell number, text) whose unchanged update differs,
+        list of (cell number, text) whose edit differs)
+    """
+    data = make_document(tables)
+    kg = build(data, incremental=True)
+    expected = canonical_triples(data)
+    count = len(cells_of(data))
+
+    unchanged = []
+    for i in range(count):
+        cell = cells_of(data)[i]
+        with contextlib.redirect_stdout(io.StringIO()):
+            kg.update_cell(cell)
+        if canonical_triples(data) != expected:
+            unchanged.append((i, cell["text"]))
+
+    edited = []
+    for i in range(count):
+        full = make_document(tables)
+        cell = cells_of(full)[i]
+        cell["text"] = edit(cell["text"])
+        build(full)
+
+        data = make_document(tables)
+        kg = build(data, incremental=True)
+        cell = cells_of(data)[i]
+        with contextlib.redirect_stdout(io.StringIO()):
+            kg.update_cell(cell, edit(cell["text"]))
+        if canonical_triples(data) != canonical_triples(full):
+            edited.append((i, cell["text"]))
+    return count, unchanged, edited
+
+def main():
+    """Run the checks with the options given in sys.argv."""
+    parser = argparse.ArgumentParser(description="Checks that parallel and incremental KG builds give the KG of a sequential build.")
+
+    parser.add_argument('--tables', type=int, default=2, help='Number of tables of the synthetic document (default 2)')
+    parser.add_argument('--workers', type=int, default=2, help='Number of threads or processes (default 2)')
+
+    args = parser.parse_args()
+
+    differ = check_parallel(args.tables, args.workers)
+    print("Parallel builds:    "+("differ: "+", ".join(differ) if differ else "same as sequential"))
+
+    count, unchanged, edited = check_incremental(args.tables)
+    print("Unchanged updates:  "+str(len(unchanged))+" of "+str(count)+" differ from the full build")
+    print("Edited updates:     "+str(len(edited))+" of "+str(count)+" differ from the full build\n")
+    for i, text in unchanged + edited:
+        print("  cell "+str(i)+": "+repr(text))
+
+    if differ or unchanged or edited:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+
+    main()
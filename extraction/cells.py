@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact cells for the tree tables the KG_Builder works on, with their links held as integer ids.
+
+The tree table extraction gives every cell as a dict. KG_Builder.build_table replaces them with Cell
+objects, kept in one Cell_Arena per (top-level) table:
+  - a Cell keeps its data in __slots__ (text, spans, tokens...), and any other key in a small dict
+  - the links of a cell (its row, columnal parent and columnal children) are not stored in the cell:
+    the arena keeps, for every row, the id of its parent row, of its child rows and of its first cell,
+    and cells only know their own id, row id and index in the row
+
+So cells no longer refer to each other, or to their row. Cells refer to their arena weakly, and the
+arena refers to the rows, but no row refers to the arena: the arenas are owned by the document
+(KG_Builder.build_KG keeps them in intermediate_structure["arenas"]), and the cells of a table can
+only be used while its arena is kept. The links between cells, and between a cell and its row, no
+longer form cycles; the features of a cell still refer back to it (feature.cell).
+
+A Cell behaves like the dict it replaces (cell["text"], cell["col_parent"], "NCBO_results" in cell,
+cell.get("values", [])...), except that its links are read-only, and that cells compare by identity.
+"""
+import weakref
+from collections.abc import MutableMapping
+
+from .tree_traversal import traverse, nest_table
+
+# keys kept in slots: data of the tree table extraction, then features added by the KG_Builder
+FIELDS = ("text", "spans", "bbox", "type", "table_num", "fonts",
+          "tokens", "values", "patterns", "column", "NCBO_results", "NCBO_top_res", "fuzzy_results",
+          "normalized_text", "annotation", "depends_on", "graph", "text_backup")
+_FIELD_SET = frozenset(FIELDS)
+
+# keys computed from the arena
+LINKS = ("row", "index", "col_parent", "col_children")
+
+class Cell(MutableMapping):
+    """A cell of a tree table, in a Cell_Arena (see module description).
+
+    Attributes:
+      id (int): Id of the cell in its arena
+      row_id (int): Id of the row (table) of the cell in its arena
+      index (int): Index of the cell in the fields of its row
+      extra (dict): The keys that are not in FIELDS, or None if there are none
+
+    """
+
+    __slots__ = FIELDS + ("_arena", "id", "row_id", "index", "extra")
+
+    def __init__(self, data=()):
+        """Instantiate a Cell, not in any arena yet (see Cell_Arena.add_row).
+
+        Parameters:
+          data (dict, optional): The keys of the cell (e.g. a cell dict of the tree table extraction). Empty by default.
+        """
+        self._arena = None
+        self.id = -1
+        self.row_id = -1
+        self.index = -1
+        self.extra = None
+        for key, value in dict(data).items():
+            if key not in LINKS:
+                self[key] = value
+
+    @property
+    def arena(self):
+        """The Cell_Arena of this cell (None if it is in none, or if its arena was freed)."""
+        return self._arena() if self._arena is not None else None
+
+    def links(self):
+        """Return the arena of this cell, to look up its links. Raises ReferenceError if it is in none, or if its
+        arena was freed (e.g. the document was dropped, see module description)."""
+        arena = self.arena
+        if arena is None:
+            raise ReferenceError("the Cell_Arena of this cell is gone: keep the arenas of the document while its cells are in use")
+        return arena
+
+    def bind(self, arena, cell_id, row_id, index):
+        """Place this cell in arena, with the given ids (see Cell_Arena.add_row)."""
+        self._arena = weakref.ref(arena)
+        self.id = cell_id
+        self.row_id = row_id
+        self.index = index
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if key == "col_parent":
+            return self.links().parent(self)
+        if key == "col_children":
+            return self.links().children(self)
+        if key == "row":
+            return self.links().rows[self.row_id]
+        if key == "index":
+            return self.index
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            setattr(self, key, value)
+        elif key in LINKS:
+            raise TypeError("the '"+key+"' of a Cell is kept by its Cell_Arena")
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif key in LINKS:
+            raise TypeError("the '"+key+"' of a Cell is kept by its Cell_Arena")
+        elif self.extra is not None and key in self.extra:
+            del self.extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        if key == "index":
+            return self._arena is not None
+        if key in LINKS:
+            # the other links are looked up in the arena, which may have been freed
+            return self.arena is not None
+        return self.extra is not None and key in self.extra
+
+    def __iter__(self):
+        for key in FIELDS:
+            if hasattr(self, key):
+                yield key
+        for key in LINKS:
+            if key in self:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self):
+        return sum(1 for key in self)
+
+    # cells are compared by identity, like the features that refer to them (comparing links would never end)
+    __eq__ = object.__eq__
+    __ne__ = object.__ne__
+    __hash__ = object.__hash__
+
+    def __getstate__(self):
+        # the arena restores its cells' references to it (see Cell_Arena.__setstate__)
+        return {key: getattr(self, key) for key in self.__slots__ if key != "_arena" and hasattr(self, key)}
+
+    def __setstate__(self, state):
+        if not hasattr(self, "_arena"):
+            self._arena = None
+        for key, value in state.items():
+            setattr(self, key, value)
+
+    def __repr__(self):
+        return "Cell("+str(self.id)+", "+repr(getattr(self, "text", None))+")"
+
+    def to_dict(self):
+        """Return the data of this cell as a plain dict, with its links as cell ids (e.g. to save it as json).
+
+        Only the data of the tree table extraction (and any extra key) is kept, not the features.
+        """
+        data = {key: getattr(self, key) for key in FIELDS[:6] if hasattr(self, key)}
+        if self.extra is not None:
+            data.update(self.extra)
+        parent = self["col_parent"]
+        data["id"] = self.id
+        data["col_parent"] = parent.id if parent is not None else None
+        data["col_children"] = [child.id for child in self["col_children"]]
+        return data
+
+class Cell_Arena:
+    """The cells and rows of a tree table, and the links between them (see module description).
+
+    Attributes:
+      cells (list): Cell id -> Cell
+      rows (list): Row id -> row (table dict, with "fields" and "records")
+      row_parent (list): Row id -> id of its parent row, or -1
+      row_children (list): Row id -> list of the ids of its child rows
+      first_cell (list): Row id -> id of its first cell (the cells of a row have consecutive ids)
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty Cell_Arena."""
+        self.cells = []
+        self.rows = []
+        self.row_parent = []
+        self.row_children = []
+        self.first_cell = []
+
+    @classmethod
+    def build(cls, table):
+        """Make the arena of a table: replace the cells of table and its subtables with Cells (existing Cells are
+        kept). The caller keeps the arena, as the Cells only refer to it weakly.
+
+        Parameters:
+          table (dict): A top-level tree table
+
+        Returns:
+          Cell_Arena: The arena
+        """
+        arena = cls()
+        traverse(table, pre=lambda row, depth, parent: arena.add_row(row, parent), state=-1)
+        return arena
+
+    def add_row(self, row, parent=-1):
+        """Add a row, and its cells, to this arena.
+
+        Parameters:
+          row (dict): The row (table dict). Its cells are replaced with Cells.
+          parent (int, optional): Id of its parent row. -1 (none) by default.
+
+        Returns:
+          int: Id of the row
+        """
+        row_id = len(self.rows)
+        self.rows.append(row)
+        self.row_parent.append(parent)
+        self.row_children.append([])
+        self.first_cell.append(len(self.cells))
+        if parent >= 0:
+            self.row_children[parent].append(row_id)
+
+        fields = row["fields"]
+        for i, field in enumerate(fields):
+            cell = field if isinstance(field, Cell) else Cell(field)
+            cell.bind(self, len(self.cells), row_id, i)
+            fields[i] = cell
+            self.cells.append(cell)
+        return row_id
+
+    def width(self, row_id):
+        """Return the number of cells of a row."""
+        end = self.first_cell[row_id+1] if row_id+1 < len(self.first_cell) else len(self.cells)
+        return end - self.first_cell[row_id]
+
+    def parent(self, cell):
+        """Return the columnal parent of cell (the cell of the same index in the parent row), or None."""
+        parent_row = self.row_parent[cell.row_id]
+        if parent_row < 0 or cell.index >= self.width(parent_row):
+            return None
+        return self.cells[self.first_cell[parent_row] + cell.index]
+
+    def children(self, cell):
+        """Return the columnal children of cell (the cells of the same index in the child rows)."""
+        return [self.cells[self.first_cell[r] + cell.index] for r in self.row_children[cell.row_id] if cell.index < self.width(r)]
+
+    def __getstate__(self):
+        # the rows are pickled without their "records", which would make pickle recurse once per level
+        state = dict(self.__dict__)
+        state["rows"] = [{key: value for key, value in row.items() if key != "records"} for row in self.rows]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        nest_table(self.rows, self.row_parent)
+        for cell in self.cells:
+            cell._arena = weakref.ref(self)
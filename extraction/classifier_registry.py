@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A registry of the classifiers available to the KG_Builder, and timing statistics for them.
+
+Classifiers are registered by name, and a run can configure which classifiers to use, in which
+order (which is their order of precedence), and with which options, e.g. in a json file:
+
+  {
+    "token_classifiers": ["free_value", "concept", "units", {"name": "ncbo", "options": {"top_k": 1}},
+                          {"name": "fuzzy_labels", "options": {"index_file": "labels.json.gz"}}],
+    "pattern_classifiers": [{"name": "automaton_patterns",
+                             "options": {"patterns": [["value_per_cent", ["VALUE", "per", "cent"]]]}}]
+  }
+
+  kg = KG_Builder(load_classifier_config("classifiers.json"))
+
+Pattern classifiers only add patterns: the patterns the Study_Subject_Interpreter relies on
+(token_patterns.DEFAULT_PATTERNS) are always matched by the KG_Builder, and cannot be disabled.
+
+The KG_Builder records the time spent in every classify call, the number of features produced and
+the number of cache hits of each classifier in a Classifier_Profiler, per document and per corpus. The
+"tokens skipped" column counts the tokens a classifier did not classify because they were not worth it
+(for the NCBO classifier, the tokens rejected by its Token_Filter). This is not a count of annotator
+requests: a skipped token saves its WordNet expansion and the query of its WordNet terms, but the
+context query of its cell is shared by the other tokens of the cell, and is often prefetched:
+
+  print(kg.profiler.report())            # the last document
+  print(kg.profiler.report(corpus=True)) # every document since the KG_Builder was made
+
+Classifiers are reported under the name of their configuration entry (see make_classifiers), so that
+two configured instances of the same class are reported separately.
+"""
+import json
+import math
+
+from .classifiers import *
+
+# name -> classifier class
+REGISTRY = {
+    "free_value": Free_Value_Token_Classifier,
+    "concept": Concept_Token_Classifier,
+    "units": Unit_Token_Classifier,
+    "ncbo": NCBO_Token_Classifier,
+    "fuzzy_labels": Fuzzy_Label_Token_Classifier,
+    "automaton_patterns": Automaton_Pattern_Classifier,
+}
+
+DEFAULT_TOKEN_CLASSIFIERS = ["free_value", "concept", "units", "ncbo"]
+# the KG_Builder always matches the patterns the interpreter needs (see KG_Builder.interpreter_patterns)
+DEFAULT_PATTERN_CLASSIFIERS = []
+
+def register_classifier(name, classifier_class):
+    """Make a classifier class available to configurations under name."""
+    REGISTRY[name] = classifier_class
+
+def make_classifiers(config):
+    """Instantiate the classifiers of a configuration, in order.
+
+    Parameters:
+      config (list): Each element is either a registered name, or a dict with "name", and optionally
+        "enabled" (bool, True by default) and "options" (dict of keyword arguments for the classifier)
+
+    Every classifier gets a profile_name, under which the Classifier_Profiler reports it: the name of
+    its entry, followed by its position in config if an earlier entry has the same name.
+
+    Returns:
+      list: The enabled classifiers
+    """
+    classifiers = []
+    for profile_name, entry in configured_entries(config):
+        if entry["name"] not in REGISTRY:
+            raise ValueError("Unknown classifier '"+entry["name"]+"', registered: "+", ".join(REGISTRY))
+        classifier = REGISTRY[entry["name"]](**entry.get("options", {}))
+        classifier.profile_name = profile_name
+        classifiers.append(classifier)
+    return classifiers
+
+def configured_entries(config):
+    """Return the enabled entries of a configuration (see make_classifiers), as dicts.
+
+    Returns:
+      list: (profile name, entry) for each enabled entry, in order
+    """
+    entries = []
+    names = set()
+    for position, entry in enumerate(config):
+        if isinstance(entry, str):
+            entry = {"name": entry}
+        if not entry.get("enabled", True):
+            continue
+        entries.append((entry["name"] if entry["name"] not in names else entry["name"]+"#"+str(position), entry))
+        names.add(entry["name"])
+    return entries
+
+def load_classifier_config(path):
+    """Load a classifier configuration (see module description) from a json file.
+
+    Returns:
+      dict: The configuration, with the defaults filled in for missing lists
+    """
+    with open(path) as f:
+        config = json.load(f)
+    config.setdefault("token_classifiers", DEFAULT_TOKEN_CLASSIFIERS)
+    config.setdefault("pattern_classifiers", DEFAULT_PATTERN_CLASSIFIERS)
+    return config
+
+class Classifier_Stats:
+    """Counters for the classify calls of a single classifier.
+
+    Call times are kept in a histogram of logarithmic buckets (about 12% wide), so that percentiles
+    can be estimated without keeping every time, and so that statistics can be merged.
+
+    Attributes:
+      calls (int): Number of classify calls
+      total_time (float): Total time spent in classify calls (in seconds)
+      prefetch_time (float): Time spent preparing for documents (see Token_Classifier.prefetch)
+      features (int): Number of features (or pattern matches) produced
+      hits (int): Number of calls that produced at least one feature
+      cache_hits (int): Number of cache hits reported by the classifier (see Token_Classifier.cache_hits)
+      skipped (int): Number of tokens the classifier skipped as not worth classifying (see Token_Classifier.skipped)
+      histogram (dict): Bucket -> number of calls
+
+    """
+
+    BASE = 1.125
+
+    def __init__(self):
+        """Instantiate empty Classifier_Stats."""
+        self.calls = 0
+        self.total_time = 0.0
+        self.prefetch_time = 0.0
+        self.features = 0
+        self.hits = 0
+        self.cache_hits = 0
+        self.skipped = 0
+        self.histogram = {}
+
+    def record(self, seconds, num_features, cache_hits=0, skipped=0):
+        """Record a single classify call."""
+        self.calls += 1
+        self.total_time += seconds
+        self.features += num_features
+        if num_features > 0:
+            self.hits += 1
+        self.cache_hits += cache_hits
+        self.skipped += skipped
+        # bucket of the time in microseconds
+        bucket = int(math.log(seconds * 1e6 + 1, self.BASE))
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def merge(self, other):
+        """Add the counts of other to these."""
+        self.calls += other.calls
+        self.total_time += other.total_time
+        self.prefetch_time += other.prefetch_time
+        self.features += other.features
+        self.hits += other.hits
+        self.cache_hits += other.cache_hits
+        self.skipped += other.skipped
+        for bucket, count in other.histogram.items():
+            self.histogram[bucket] = self.histogram.get(bucket, 0) + count
+
+    def percentile(self, p):
+        """Estimate the p-th percentile (0-100) of the call times (in seconds)."""
+        if self.calls == 0:
+            return 0.0
+        rank = p / 100.0 * self.calls
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= rank:
+                # upper bound of the bucket
+                return (self.BASE ** (bucket + 1) - 1) / 1e6
+        return (self.BASE ** (max(self.histogram) + 1) - 1) / 1e6
+
+class Classifier_Profiler:
+    """Classifier_Stats for every classifier, for the current document and for the whole corpus.
+
+    Attributes:
+      document (dict): Classifier profile name -> Classifier_Stats, for the current (or last) document
+      corpus (dict): Classifier profile name -> Classifier_Stats, for every finished document
+      documents (int): Number of finished documents
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty Classifier_Profiler."""
+        self.document = {}
+        self.corpus = {}
+        self.documents = 0
+
+    def stats(self, classifier):
+        """Return the Classifier_Stats of classifier for the current document.
+
+        Classifiers are told apart by their profile_name (see make_classifiers), or by their class if they
+        were not made from a configuration.
+        """
+        name = getattr(classifier, "profile_name", type(classifier).__name__)
+        if name not in self.document:
+            self.document[name] = Classifier_Stats()
+        return self.document[name]
+
+    def start_document(self):
+        """Start counting for a new document."""
+        self.document = {}
+
+    def merge_document(self, other):
+        """Add the current document counts of other (e.g. the profiler of a worker) to the current document counts."""
+        for name, stats in other.document.items():
+            if name not in self.document:
+                self.document[name] = Classifier_Stats()
+            self.document[name].merge(stats)
+
+    def end_document(self):
+        """Add the counts of the current document to the corpus counts."""
+        for name, stats in self.document.items():
+            if name not in self.corpus:
+                self.corpus[name] = Classifier_Stats()
+            self.corpus[name].merge(stats)
+        self.documents += 1
+
+    def report(self, corpus=False):
+        """Return a table of the statistics of each classifier, slowest first.
+
+        Parameters:
+          corpus (bool, optional): If True, report on every finished document instead of the last one. False by default.
+
+        Returns:
+          string: The report
+        """
+        all_stats = self.corpus if corpus else self.document
+        total = sum(s.total_time + s.prefetch_time for s in all_stats.values())
+
+        lines = []
+        if corpus:
+            lines.append("Classifiers over "+str(self.documents)+" documents:")
+        else:
+            lines.append("Classifiers over the last document:")
+        lines.append("  {:<32} {:>9} {:>9} {:>6} {:>9} {:>9} {:>9} {:>9} {:>7} {:>9} {:>14}".format(
+            "classifier", "calls", "time (s)", "share", "p50 (ms)", "p95 (ms)", "p99 (ms)", "features", "hit %", "cache", "tokens skipped"))
+        for name, s in sorted(all_stats.items(), key=lambda i: -(i[1].total_time + i[1].prefetch_time)):
+            seconds = s.total_time + s.prefetch_time
+            lines.append("  {:<32} {:>9} {:>9.3f} {:>5.1f}% {:>9.3f} {:>9.3f} {:>9.3f} {:>9} {:>6.1f}% {:>9} {:>14}".format(
+                name, s.calls, seconds, 100.0 * seconds / total if total > 0 else 0.0,
+                1000 * s.percentile(50), 1000 * s.percentile(95), 1000 * s.percentile(99),
+                s.features, 100.0 * s.hits / s.calls if s.calls > 0 else 0.0, s.cache_hits, s.skipped))
+        return "\n".join(lines)
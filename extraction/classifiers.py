@@ -5,19 +5,36 @@
    2 base, informally abstract classes:
      Token_Classifier: classifies tokens
      Pattern_Classifier: classifies groups of tokens
-   3 Additional classes:
+   6 Additional classes:
      Free_Value_Token_Classifier
      Concept_Token_Classifier
+     Unit_Token_Classifier
      NCBO_Token_Classifier
+     Fuzzy_Label_Token_Classifier
+     Automaton_Pattern_Classifier
 """
+import copy
+import json
+import os
+import time
+from xml.sax.saxutils import unescape
 import nltk
 from nltk.tokenize import MWETokenizer
 from nltk.tokenize import WhitespaceTokenizer 
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.corpus import wordnet
 
 from .graph_framework import *
 from . import annotate_text
+from .ncbo_candidates import NCBO_Candidate, make_candidates
+from .ncbo_ranking import rank_results, match_length_score, RANKING_VERSION
+from .ontology_stats import Ontology_Stats
+from .wordnet_expansion import WordNet_Expander
+from .token_patterns import Token_Pattern_Automaton, Pattern_Match, DEFAULT_PATTERNS
+from .value_scanner import parse_number
+from .label_index import Label_Index
+from .unit_grammar import Unit_Grammar, DEFAULT_UNITS
+from .token_filter import Token_Filter
+from .abbreviations import Abbreviation_Index
+from .tree_traversal import traverse
 
 class Token_Classifier:
     """Contains rules for how to classify (assign feature(s) to) a single token (if at all).
@@ -25,23 +42,71 @@ class Token_Classifier:
     This class is informally abstract (not intended to be instantiated directly.)
     Instead, instantiate one of its subclasses.
     
+    Attributes:
+      cache_hits (int): Number of tokens classified from cached results (for profiling, see classifier_registry)
+      skipped (int): Number of tokens not classified because they were not worth it, saving the work of classifying
+        them (for profiling, see classifier_registry)
+      cell_independent (bool): True if the features of a token depend on the token alone (not on its cell, nor on
+        the context). The KG_Builder then classifies each distinct token of a document once (see token_vocabulary),
+        calling classify with cell None. False by default.
+    
     """
     
+    cache_hits = 0
+    skipped = 0
+    cell_independent = False
+    
     # a class that. you guessed it. classifies tokens.
     #specifically, given <token> in <cell>, classify returns [<feature1>, <feature2>, ...]
     # or empty array if no features identified via this classifier
     
-    def classify(self, token, cell):
+    def classify(self, token, cell, context=None):
         """Given a token from a cell, return a corresponding list of features.
         
         Parameters:
           token (string): The token to classify
           cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
           
         Returns:
           list : List of features. May have multiple features, or none at all.
         """
-        raise NotImplementedError(".classify(token, cell) not implemented")
+        raise NotImplementedError(".classify(token, cell, context) not implemented")
+    
+    def prefetch(self, intermediate_structure):
+        """Optionally prepare for classifying the tokens of a whole document, before any cell is parsed.
+        
+        Does nothing by default.
+        
+        Parameters:
+          intermediate_structure (dict): The tree table extraction about to be classified
+        """
+        pass
+    
+    def updates(self):
+        """Return what this classifier has learned since the last call (statistics, cache entries...), so that the
+        classifier it was copied from, in another process, can merge it (see merge_updates, and
+        KG_Builder.build_tables_in_processes). Must be picklable. None by default.
+        """
+        return None
+    
+    def merge_updates(self, updates):
+        """Merge what a copy of this classifier in another process has learned (see updates). Does nothing by default."""
+        pass
+    
+    def fork(self):
+        """Return a copy of this classifier for another thread (see KG_Builder.build_KG).
+        
+        By default, a shallow copy: configuration, caches and document state are shared, and per-cell state is
+        not, as long as the classifier replaces (rather than modifies) it when it moves on to a new cell.
+        """
+        return copy.copy(self)
+    
+    def forget_cell(self):
+        """Forget the per-cell state kept for the last cell classified, whose text may have changed since
+        (see KG_Builder.update_cell). Does nothing by default."""
+        pass
         
 class Pattern_Classifier:
     """Contains rules for how to classify (assign feature(s) to) groups of tokens (if at all).
@@ -51,91 +116,204 @@ class Pattern_Classifier:
     
     """
     
-    #given <cell> already annotated with tokens, returns [<feature1>, <feature2>, ...]
-    # or empty array if no features found
+    #given <cell> already annotated with tokens, returns [<match1>, <match2>, ...]
+    # or empty array if no patterns found
     
-    def classify(self, token, cell):
-        """Given a token from a cell, return a corresponding list of features.
+    def classify(self, cell):
+        """Given a cell whose tokens have been classified, return the patterns found among its tokens.
         
         Parameters:
-          token (string): The token to classify
-          cell (dict): The cell this token is found in
+          cell (dict): The cell, with cell["tokens"] set
           
         Returns:
-          list : List of features. May have multiple features, or none at all.
+          list : List of pattern matches. May have multiple matches, or none at all.
+        """
+        raise NotImplementedError(".classify(cell) not implemented")
+    
+class Automaton_Pattern_Classifier (Pattern_Classifier):
+    """The automaton pattern classifier finds declarative token patterns (e.g. "mean ± SD") in a cell.
+    
+    The patterns are compiled into a single automaton, which is run over the tokens of a cell in one pass.
+    
+    Attributes:
+      automaton (Token_Pattern_Automaton): The compiled patterns
+      
+    """
+    
+    def __init__(self, patterns=DEFAULT_PATTERNS):
+        """Instantiate an Automaton_Pattern_Classifier
+        
+        Parameters:
+          patterns (list, optional): List of (name, elements) tuples (see token_patterns). DEFAULT_PATTERNS by default.
         """
-        raise NotImplementedError(".classify(token, cell) not implemented")
+        self.automaton = Token_Pattern_Automaton(patterns)
     
+    def classify(self, cell):
+        """Given a cell whose tokens have been classified, return the patterns found among its tokens.
+        
+        Parameters:
+          cell (dict): The cell, with cell["tokens"] set
+          
+        Returns:
+          list : List of Pattern_Match, ordered by end, then longest first.
+        """
+        return self.automaton.match(cell["tokens"])
+        
 # specifically intended as a testing class
 # most classifiers should not have a rigid, pre-coded classifier specifically for them.
 class Free_Value_Token_Classifier (Token_Classifier):
-    """The free value token classifier parses numerical values to assign features."""
+    """The free value token classifier parses numerical values to assign features.
     
-    def classify(self, token, cell):
+    If the cell has been scanned for values (cell["values"], see value_scanner), the scanned Free_Value
+    features (which know their span in the cell's text) are used for the number tokens of the cell.
+    """
+    
+    def __init__(self):
+        """Instantiate a Free_Value_Token_Classifier"""
+        # the cell currently being classified, and its unused scanned values (token -> list of Free_Value)
+        self.values_cell = None
+        self.scanned = {}
+    
+    def classify(self, token, cell, context=None):
         """Given a token from a cell, return a corresponding list of features.
         
         Parameters:
           token (string): The token to classify
           cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
           
         Returns:
           list : List of features. May have multiple features, or none at all.
         """
-        try:
-            value = float(token)
-            return [Free_Value([token], cell, value)] # TODO: Change how matching works
-        except ValueError:
+        if cell is not self.values_cell:
+            self.values_cell = cell
+            self.scanned = {}
+            for match in cell.get("values", []):
+                for v in match.values:
+                    self.scanned.setdefault(v.matching[0], []).append(v)
+        
+        if token in self.scanned and len(self.scanned[token]) > 0:
+            return [self.scanned[token].pop(0)]
+        
+        value = parse_number(token)
+        if value is None:
             return []
+        return [Free_Value([token], cell, value)] # TODO: Change how matching works
+    
+    def forget_cell(self):
+        """Forget the scanned values of the last cell classified."""
+        self.values_cell = None
+        self.scanned = {}
         
+DEFAULT_VOCABULARY_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "concept_vocabulary.json")
+
+# words kept in lower case in the title case forms of multi-word expressions
+MWE_FUNCTION_WORDS = {"a", "an", "and", "at", "by", "for", "in", "of", "on", "or", "the", "to", "with"}
+
+# vocabulary file -> (keyword table, multi-word expressions), see load_concept_vocabulary
+_vocabularies = {}
+
+def load_concept_vocabulary(vocabulary_file=DEFAULT_VOCABULARY_FILE):
+    """Load the keywords of a concept vocabulary file (see concept_vocabulary.json for the format).
+    
+    Each file is only read once.
+    
+    Parameters:
+      vocabulary_file (string, optional): Path of the vocabulary file. The default vocabulary by default.
+      
+    Returns:
+      tuple: (dict of casefolded token -> concept entry, list of multi-word expressions (tuples of
+              tokens) for the MWETokenizer)
+    """
+    if vocabulary_file in _vocabularies:
+        return _vocabularies[vocabulary_file]
+    
+    with open(vocabulary_file, encoding="utf-8") as f:
+        concepts = json.load(f)["concepts"]
+    
+    # same split as the tokenizer in KG_Builder.annotate_features (punctuation is its own token)
+    splitter = nltk.tokenize.RegexpTokenizer(r'\w+|[^\w\s]')
+    
+    keywords = {}
+    mwes = []
+    for concept in concepts:
+        if "search_pattern" in concept:
+            concept["search_pattern"] = SearchPattern[concept["search_pattern"]]
+        for form in concept["forms"]:
+            parts = splitter.tokenize(form.lower())
+            
+            # multi-word tokens are joined by the MWETokenizer with "_"
+            key = "_".join(parts).casefold()
+            if key in keywords:
+                raise ValueError("Keyword '"+form+"' is defined twice in "+vocabulary_file)
+            keywords[key] = concept
+            
+            if len(parts) > 1:
+                # the MWETokenizer is case sensitive: lower case, sentence case, and title case with and without
+                # lower case function words ("Coefficient of Variation")
+                variants = [parts, [parts[0].capitalize()]+parts[1:], [p.capitalize() for p in parts],
+                            [parts[0].capitalize()]+[p if p in MWE_FUNCTION_WORDS else p.capitalize() for p in parts[1:]]]
+                for variant in variants:
+                    if tuple(variant) not in mwes:
+                        mwes.append(tuple(variant))
+    
+    _vocabularies[vocabulary_file] = (keywords, mwes)
+    return keywords, mwes
+
 # specifically intended as a testing class
 # most concepts should not have a rigid, pre-coded classifier specifically for them.
 class Concept_Token_Classifier (Token_Classifier):
     """The concept token classifier performs keyword matching to classify tokens as features.
     
-    At present, the concept token classifier uses hard-coded keywords. This should be changed
-    to have it read in keywords from a config file.
+    The keywords are read from a vocabulary file (see concept_vocabulary.json), and looked up by
+    their casefolded form.
     
+    Attributes:
+      keywords (dict): Casefolded token -> concept entry (IRI, node shape, search pattern, ...)
+      mwes (list): Multi-word expressions of the vocabulary, for use with an MWETokenizer
+      
     """
     
+    cell_independent = True
+    
+    def __init__(self, vocabulary_file=DEFAULT_VOCABULARY_FILE):
+        """Instantiate a Concept_Token_Classifier
+        
+        Parameters:
+          vocabulary_file (string, optional): Path of the vocabulary file. The default vocabulary by default.
+        """
+        self.keywords, self.mwes = load_concept_vocabulary(vocabulary_file)
+    
     # classifier returns ARRAY of features matching this token
-    # TODO: Change how matching works
-    def classify(self, token, cell):
+    def classify(self, token, cell, context=None):
         """Given a token from a cell, return a corresponding list of features.
         
         Parameters:
           token (string): The token to classify
           cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
           
         Returns:
           list : List of features. May have multiple features, or none at all.
         """
-        if token.upper() == "Mean".upper() or token.upper() == "Average".upper():
-            return [self.make_blank_node([token], cell, IRI_Node("sio:Mean",None))]
-        if token.upper() == "GM".upper() or token.upper() == "geometric_mean".upper():
-            return [self.make_blank_node([token], cell, IRI_Node("sco:GeometricMean",None))]
-        elif token.upper() == "Median".upper():
-            return [self.make_blank_node([token], cell, IRI_Node("sio:Median",None))]
-        elif token.upper() == "SD".upper() or token.upper() == 's_._d_.'.upper() or token.upper() == 'standard_deviation'.upper() or token.upper() == 'Std_._Dev_.'.upper() or token.upper() == 'St_._Dev_.'.upper():
-            return [self.make_blank_node([token], cell, IRI_Node("sio:StandardDeviation",None))]
-        elif token.upper() == "SE".upper() or token.upper() == 's_._e_.'.upper() or token.upper() == 'standard_error'.upper():
-            return [self.make_blank_node([token], cell, IRI_Node("sco:StandardError",None))]
-        elif token.upper() == "%".upper() or token.upper() == "Percent".upper():
-            #return [self.make_blank_node([token], cell, IRI_Node("sio:Percentage",None))]
-            n = self.make_simple_node_interpreter([token], cell, IRI_Node("sio:Percentage",None), SearchPattern.RIGHT_TO_LEFT)
-            n.incomplete_triples.append( (IRI_Node("sio:inRelationTo", None), Supertype_Constraint(IRI_Node("owl:Class",None))) )
-            return [n]
-        elif token.upper() == "IQR".upper() or token.upper() == 'interquartile_range'.upper():
-            return [self.make_double_blank_node([token], cell, IRI_Node("sco:InterquartileRange",None))]
-        elif token.upper() == "CI".upper() or token.upper() == 'confidence_interval'.upper():
-            return [self.make_double_blank_node([token], cell, IRI_Node("sco:ConfidenceInterval",None))]
-        elif token.upper() == "CV".upper() or token.upper() == 'coefficient_of_variation'.upper():
-            return [self.make_double_blank_node([token], cell, IRI_Node("sco:CoefficientOfVariation",None))]
-        elif token.upper() == "Range".upper():
-            return [self.make_double_blank_node([token], cell, IRI_Node("sco:Range",None))]
-        elif token.upper() == "N".upper() or token.upper() == "No".upper():
-            #return [self.make_blank_node([token], cell, IRI_Node("sco:PopulationSize",None))]
-            return [self.make_simple_node_interpreter([token], cell, IRI_Node("sco:PopulationSize",None), SearchPattern.LEFT_TO_RIGHT)]
-        else: return []
+        concept = self.keywords.get(token.casefold())
+        if concept is None:
+            return []
+        
+        parent_iri = IRI_Node(concept["iri"],None)
+        if concept["shape"] == "blank":
+            n = self.make_blank_node([token], cell, parent_iri)
+        elif concept["shape"] == "double_blank":
+            n = self.make_double_blank_node([token], cell, parent_iri)
+        else:
+            n = self.make_simple_node_interpreter([token], cell, parent_iri, concept["search_pattern"])
+        
+        for (predicate, supertype) in concept.get("constraints", []):
+            n.incomplete_triples.append( (IRI_Node(predicate, None), Supertype_Constraint(IRI_Node(supertype,None))) )
+        
+        return [n]
         
     # just return the correct blank node
     def make_blank_node(self, matching, cell, parent_iri):
@@ -190,6 +368,64 @@ class Concept_Token_Classifier (Token_Classifier):
         
         return n
     
+class Unit_Token_Classifier (Token_Classifier):
+    """The unit token classifier finds units of measurement (e.g. "mg", "mmHg", "kg/m2") with a unit grammar.
+    
+    The normalized text of a cell (cell["normalized_text"], which the KG_Builder tokenizes) is scanned once
+    (see unit_grammar), and each token of a unit is given the unit's feature: a node of type
+    sco:UnitOfMeasurement, labeled with the canonical symbol of the unit. All the tokens of a compound unit
+    ("mg", "/", "dL") share the same feature.
+    
+    Attributes:
+      grammar (Unit_Grammar): The compiled unit grammar
+      
+    """
+    
+    def __init__(self, units=None):
+        """Instantiate a Unit_Token_Classifier
+        
+        Parameters:
+          units (dict, optional): Canonical symbol -> (standalone spellings, compound-only spellings), see unit_grammar.
+            unit_grammar.DEFAULT_UNITS by default.
+        """
+        self.grammar = Unit_Grammar(units if units is not None else DEFAULT_UNITS)
+        # the cell currently being classified, and its unused unit features (token -> list of features)
+        self.units_cell = None
+        self.scanned = {}
+    
+    def classify(self, token, cell, context=None):
+        """Given a token from a cell, return a corresponding list of features.
+        
+        Parameters:
+          token (string): The token to classify
+          cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
+          
+        Returns:
+          list : List of features. May have multiple features, or none at all.
+        """
+        if cell is not self.units_cell:
+            self.units_cell = cell
+            self.scanned = {}
+            for match in self.grammar.scan(cell.get("normalized_text", unescape(cell["text"]))):
+                n = Node_Instance(match.matching, cell)
+                n.triples.append((IRI_Node("rdf:type", None), IRI_Node("sco:UnitOfMeasurement", None)))
+                n.triples.append((IRI_Node("rdfs:hasLabel", None), Free_Value(match.matching, cell, match.symbol)))
+                # only the word tokens are looked up ("/" is never a concept anyway)
+                for tok in match.matching:
+                    if tok.isalnum():
+                        self.scanned.setdefault(tok, []).append(n)
+        
+        if token in self.scanned and len(self.scanned[token]) > 0:
+            return [self.scanned[token].pop(0)]
+        return []
+    
+    def forget_cell(self):
+        """Forget the unit features of the last cell classified."""
+        self.units_cell = None
+        self.scanned = {}
+    
 # uses NCBO Annotator to classify tokens
 class NCBO_Token_Classifier (Token_Classifier):
     """The NCBO_Token_Classifier classifies a token based on results returned from the NCBO Annotator.
@@ -198,99 +434,238 @@ class NCBO_Token_Classifier (Token_Classifier):
     match that specific term.
     
     In addition, it will perform ranking of these concepts. The ranking information is stored as metadata
-    in cell["NCBO_results"], which is a ranked list of dicts.
+    in cell["NCBO_results"], which is a list of (token, candidates) tuples, where candidates is a ranked
+    list of at most top_k NCBO_Candidate records.
     
     Attributes:
       onto_list (list): List of strings (ontology prefixes) to use
       classifiers_to_exclude (list): List of classifiers to use to filter out unwanted tokens
+      top_k (int): Number of ranked candidates kept per token in cell["NCBO_results"]. None keeps all.
+      batch_chars (int): If set, prefetch annotates the context of every cell in a document using
+        batched requests of at most this many characters (see annotate_text.annotate_batch).
+      known_empty (Known_Empty_Filter): If set, tokens whose queries (the token and its WordNet terms, on
+        onto_list) are recorded in this filter as returning no ranked results are skipped entirely, in any
+        context, and new such tokens are added to it (see query_key).
+      onto_stats (Ontology_Stats): Statistics on which ontologies provide the top ranked results
+      expander (WordNet_Expander): Looks up the WordNet lemmas and synonyms of tokens, with caching
+      scorer (function): Scores a result (given the result and the set of uppercase words of its annotation text)
+        for ranking. Results are ranked by score, then by the priority of their ontology in onto_list.
+      outcome_cache (Token_Outcome_Cache): If set, the ranked candidates of each token (in its context) are
+        cached, and reused whenever the same token is met in the same context again.
+      token_filter (Token_Filter): If set, tokens the filter finds not worth annotating (stopwords, footnote
+        markers, ordinals, tokens that never yield a concept...) are skipped, and counted in skipped.
+      use_abbreviations (bool): If True, prefetch indexes the abbreviations the document defines (see abbreviations),
+        and each defined acronym is classified by querying its expansion, once per document.
+      adaptive_ontologies (bool): If True, tokens are first queried on the ontologies that provided
+        'coverage' of the top results so far, and only on the remaining ontologies if that yields nothing.
+        Every explore_every-th token is still queried on the full list, to keep the statistics current.
+      coverage (float): Share of the top results the adaptive ontology list must cover
+      min_samples (int): Number of recorded top results needed before the adaptive ontology list is used
+      explore_every (int): How often a token is queried on the full ontology list in adaptive mode
       
     """
     
-    def __init__(self, use_lemmas=True, use_synsets=True):
+    def __init__(self, use_lemmas=True, use_synsets=True, top_k=10, batch_chars=None, known_empty=None,
+                 adaptive_ontologies=False, onto_stats=None, expander=None, scorer=match_length_score,
+                 outcome_cache=None, token_filter=None, use_abbreviations=True, coverage=0.95, min_samples=50,
+                 explore_every=20):
         """Instantiate an NCBO_Token_Classifier
         
         Parameters:
           use_lemmas (bool, optional): True by default. Set to False to not use WordNet Lemmas
           use_synsets (bool, optional): True by default. Set to False to not use WordNet Synsets 
+          top_k (int, optional): 10 by default. Number of candidates to keep per token, None to keep all
+          batch_chars (int, optional): None by default. Set to use batched requests (e.g. annotate_text.MAX_BATCH_CHARS)
+          known_empty (Known_Empty_Filter, optional): None by default. Filter of queries known to return no results
+          adaptive_ontologies (bool, optional): False by default. Set to True to use adaptive ontology lists
+          onto_stats (Ontology_Stats, optional): Statistics to start from (e.g. from a previous run). Empty by default.
+          expander (WordNet_Expander, optional): Cached WordNet lookups (e.g. with a precomputed table). A new one by default.
+          scorer (function, optional): Scoring function for ranking results. ncbo_ranking.match_length_score by default.
+          outcome_cache (Token_Outcome_Cache, optional): None by default. Cache of ranked candidates, shared across documents
+          token_filter (Token_Filter, optional): A Token_Filter with default settings by default. May also be a dict of
+            Token_Filter options (with "stats_file" to load corpus statistics from, see Token_Filter.load), or False for no filter
+          use_abbreviations (bool, optional): True by default. Set to False to classify acronyms like any other token
+          coverage (float, optional): 0.95 by default. Share of the top results the adaptive ontology list must cover
+          min_samples (int, optional): 50 by default. Number of recorded top results before the adaptive ontology list is used
+          explore_every (int, optional): 20 by default. Every explore_every-th token is queried on the full ontology list
         """
         self.use_lemmas=use_lemmas
         self.use_synsets=use_synsets
+        self.top_k=top_k
+        self.batch_chars=batch_chars
+        self.known_empty=known_empty
+        
+        self.adaptive_ontologies=adaptive_ontologies
+        self.onto_stats=onto_stats if onto_stats is not None else Ontology_Stats()
+        self.coverage=coverage
+        self.min_samples=min_samples
+        self.explore_every=explore_every
+        self.num_queried=0
+        
+        # what onto_stats, token_filter and outcome_cache held at the last call of updates
+        self.update_marks = None
+        
+        # text -> annotator results, filled by prefetch (for the ontologies in prefetched_ontologies)
+        self.prefetched = {}
+        self.prefetched_ontologies = None
+        
+        # the cell currently being classified, its context and its annotator responses, see cell_context
+        self.context_cell = None
+        self.context = None
+        self.cell_responses = {}
         
         self.onto_list = ["SCO","CMO","HHEAR","DOID","LOINC","DRON","CHEBI","HP","MEDDRA","NCIT","IOBC"]
-        self.lmtzr = WordNetLemmatizer()
+        self.expander = expander if expander is not None else WordNet_Expander()
+        self.scorer = scorer
+        self.outcome_cache = outcome_cache
         
-        self.classifiers_to_exclude = [Free_Value_Token_Classifier(), Concept_Token_Classifier()]
+        if token_filter is None:
+            token_filter = Token_Filter()
+        elif isinstance(token_filter, dict):
+            options = dict(token_filter)
+            stats_file = options.pop("stats_file", None)
+            token_filter = Token_Filter.load(stats_file, **options) if stats_file is not None else Token_Filter(**options)
+        self.token_filter = token_filter if token_filter is not False else None
+        
+        # the abbreviations of the current document, and the candidates found for their expansions
+        self.use_abbreviations = use_abbreviations
+        self.abbreviations = Abbreviation_Index()
+        self.expansion_candidates = {}
+        
+        self.classifiers_to_exclude = [Free_Value_Token_Classifier(), Concept_Token_Classifier(), Unit_Token_Classifier()]
     
-    def api_call(self,text):
+    def api_call(self,text,ontologies=None):
         """Wrapper to make the API call to the NCBO annotator
         
         Parameters:
           text (string): Text to send to the annotator
+          ontologies (list, optional): Ontologies to limit the results to. onto_list by default.
+        
+        Prefetched results are used for any ontologies among the prefetched ones (keeping only the results of those
+        ontologies), so that the reduced and full lists of adaptive mode both use them.
         
         Returns:
           list: list of dicts (json-parsed) corresponding to the annotator results.
         """
+        if ontologies is None:
+            ontologies = self.onto_list
         
-        return annotate_text.annotate(text,self.onto_list)
+        if text in self.prefetched and set(ontologies) <= set(self.prefetched_ontologies):
+            self.cache_hits += 1
+            # classify modifies the results, so hand out a copy
+            results = self.prefetched[text]
+            if ontologies != self.prefetched_ontologies:
+                wanted = set(ontologies)
+                results = [r for r in results if r["annotatedClass"]["links"]["ontology"].rsplit('/', 1)[-1] in wanted]
+            return copy.deepcopy(results)
+        return annotate_text.annotate(text,ontologies)
     
-    def classify(self, token, cell):
-        """Given a token from a cell, return a corresponding list of features.
+    def prefetch(self, intermediate_structure):
+        """Index the abbreviations of the document (if use_abbreviations is set), and annotate the context of
+        every cell in the document in batched requests (if batch_chars is set).
         
         Parameters:
-          token (string): The token to classify
-          cell (dict): The cell this token is found in
-          
-        Returns:
-          list : List of features. May have multiple features, or none at all.
+          intermediate_structure (dict): The tree table extraction about to be classified
         """
-            
-        # Only send request if there is SOME alphabetical character in the text
-        skip = True
-        for c in token:
-            if c.isalpha():
-                skip = False
-                break
-        if skip:
-            return []
+        self.expansion_candidates = {}
+        if self.use_abbreviations:
+            self.abbreviations = Abbreviation_Index.build(intermediate_structure)
         
-        # Only send request if this token does not already have some feature attached to it
-        for c in self.classifiers_to_exclude:
-            if len(c.classify(token,cell)) > 0:
-                return []
-            
-        # Reserved terms (exclude):
-        if token.upper() in ["AND","OR","OF","NO"]:
-            return []
+        self.prefetched = {}
+        if not self.batch_chars:
+            return
         
-        # instead of just calling the API on the token
-        # call the API on the every word in the phrase, plus add'l context variables
-        # then check the annotations that were returned
-        # filter out those that do NOT include the token
-        # sort those that DO by priority
-        # most likely, frequency of words
+        texts = []
+        for table in intermediate_structure["tables"]:
+            self.collect_contexts(table, None, texts)
         
-        #results = self.api_call(token)
-        # should make this a pattern classifier instead
-        # but just for testing:
+        # on the full list, also in adaptive mode: any list of ontologies can then be answered from it (see api_call)
+        results = annotate_text.annotate_batch(texts, self.onto_list, self.batch_chars)
+        self.prefetched = dict(zip(texts, results))
+        self.prefetched_ontologies = self.onto_list
+    
+    def updates(self):
+        """Return the ontology statistics, token filter counts and cached outcomes recorded since the last call (see
+        Token_Classifier.updates), or None on the first call. The known-empty filter is saved instead, since other
+        processes take in its keys from its files (see Known_Empty_Filter.refresh).
+        """
+        marks = (self.onto_stats.copy(),
+                 self.token_filter.snapshot() if self.token_filter is not None else None,
+                 len(self.outcome_cache.memory) if self.outcome_cache is not None else None)
+        updates = None
+        if self.update_marks is not None:
+            onto_stats, counts, outcomes = self.update_marks
+            updates = (marks[0].difference(onto_stats),
+                       self.token_filter.counts_since(counts) if counts is not None else None,
+                       self.outcome_cache.entries_since(outcomes) if outcomes is not None else None)
+        self.update_marks = marks
+        
+        if self.known_empty is not None and self.known_empty.unsaved > 0:
+            self.known_empty.save()
+        return updates
+    
+    def merge_updates(self, updates):
+        """Merge the ontology statistics, token filter counts and cached outcomes of a copy of this classifier in another
+        process (see updates), and take in the keys it added to the known-empty filter."""
+        if updates is None:
+            return
+        onto_stats, counts, outcomes = updates
+        self.onto_stats.merge(onto_stats)
+        if counts is not None and self.token_filter is not None:
+            self.token_filter.merge_counts(counts)
+        if outcomes is not None and self.outcome_cache is not None:
+            self.outcome_cache.merge(outcomes)
+        if self.known_empty is not None:
+            self.known_empty.refresh()
+    
+    def fork(self):
+        """Return a copy of this classifier for another thread (see Token_Classifier.fork), with its own exclusion classifiers.
+        
+        The copies share known_empty, onto_stats, token_filter, expander and outcome_cache, which lock their own
+        updates, and the candidates of the document's abbreviations (see find_expansion_candidates).
+        """
+        forked = copy.copy(self)
+        forked.classifiers_to_exclude = [c.fork() for c in self.classifiers_to_exclude]
+        return forked
+    
+    def collect_contexts(self, table, parent_fields, texts):
+        """Append the annotator query for each cell in table (and its subtables) that may need one to texts.
         
+        parent_fields are the cells of the parent row of table (None for a top-level table), and are passed down
+        the traversal as its state.
+        """
+        
+        def collect(subtable, depth, parent_fields):
+            for i,cell in enumerate(subtable["fields"]):
+                # no query is ever sent for a cell without a single alphabetical character
+                if any(c.isalpha() for c in cell["text"]):
+                    parent_text = parent_fields[i]["text"] if parent_fields is not None else None
+                    texts.append(self.make_context(cell["text"], parent_text)[0])
+            return subtable["fields"]
+        
+        traverse(table, pre=collect, state=parent_fields)
+    
+    def make_context(self, text, parent_text=None):
+        """Build the annotator query for a cell from its text and the text of its columnal parent.
+        
+        Parameters:
+          text (string): The text of the cell
+          parent_text (string, optional): The text of the cell's columnal parent. None if it has none.
+          
+        Returns:
+          tuple: (query string, list of uppercase cell tokens, list of uppercase parent tokens)
+        """
         tokenizer = nltk.tokenize.RegexpTokenizer(r'\w+')
-        tokens = tokenizer.tokenize(cell["text"].upper())
+        tokens = tokenizer.tokenize(text.upper())
         
         stripped = ""
         for tok in tokens:
             stripped+=tok+" "
         
-        #print(stripped)
-        
-        #print(cell.keys())
-        
         # contextualizer
         ptokens = []
-        if cell["col_parent"] is not None:
-            #print(cell["col_parent"]["text"])
-            #print(cell["col_parent"]["tokens"])
-            
-            ptokens = tokenizer.tokenize(cell["col_parent"]["text"].upper())
+        if parent_text is not None:
+            ptokens = tokenizer.tokenize(parent_text.upper())
 
             parent=""
             for ptok in ptokens:
@@ -299,50 +674,130 @@ class NCBO_Token_Classifier (Token_Classifier):
                 parent = parent[0:-1] #strip last space
                 
             stripped = parent+" "+stripped+parent
-            #print(parent)
-            #print(stripped)
         
-        results = self.api_call(stripped)
+        return stripped, tokens, ptokens
+    
+    def cell_context(self, cell):
+        """Return the context of cell (see make_context), computing it only once per cell.
         
-        must_have = [token.upper()]
+        Moving on to a new cell also clears the annotator responses kept for the previous one.
+        """
+        if cell is not self.context_cell:
+            parent_text = None
+            if cell["col_parent"] is not None:
+                parent_text = cell["col_parent"]["text"]
+            self.context_cell = cell
+            self.context = self.make_context(cell["text"], parent_text)
+            self.cell_responses = {}
+        return self.context
+    
+    def forget_cell(self):
+        """Forget the context of the last cell classified, the annotator responses kept for it, and the
+        per-cell state of classifiers_to_exclude (which this classifier runs itself if they are not configured)."""
+        self.context_cell = None
+        self.cell_responses = {}
+        for c in self.classifiers_to_exclude:
+            c.forget_cell()
+    
+    def query_key(self, token):
+        """Return the key identifying the token-level queries for token (used by known_empty).
         
-        # and append synonyms, lemmas (via wordnet)
-        wordnet_terms = []
+        The key covers the token and its WordNet terms (see wordnet_terms), which are queried for the token in
+        every context, and the ontologies queried. It does not cover the context of the token's cell, so that
+        tokens which never yield anything (footnote markers, author abbreviations...) are skipped in every cell
+        and document once known, rather than only where the same cell text recurs.
+        """
+        settings = [str(self.use_lemmas), str(self.use_synsets)]
+        return token.upper()+"\t"+" ".join(self.wordnet_terms(token)[1]).upper()+"\t"+",".join(self.onto_list)+"\t"+",".join(settings)
+    
+    def outcome_key(self, token, stripped):
+        """Return the key identifying the ranked candidates of token in the context stripped (used by outcome_cache).
+        
+        Besides the query, the key covers every setting that changes the outcome: WordNet use, the ranking
+        (version and scoring function), and top_k.
+        """
+        settings = [str(RANKING_VERSION), self.scorer.__name__, str(self.top_k), str(self.use_lemmas), str(self.use_synsets)]
+        return token+"\t"+stripped+"\t"+",".join(self.onto_list)+"\t"+",".join(settings)
+    
+    def store_results(self, token, cell, candidates):
+        """Store the ranked candidates for token in cell["NCBO_results"] (see class description)."""
+        if "NCBO_results" not in cell:
+            cell["NCBO_results"] = []
+        cell["NCBO_results"].append( (token,candidates) )
+    
+    def wordnet_terms(self, token):
+        """Return the WordNet lemmas of token, and all of its WordNet terms (lemmas, then synonyms, without duplicates)."""
         
         # lemmas:
-        lmtzr = self.lmtzr
         if self.use_lemmas:
-            lemmas = [lmtzr.lemmatize(token, pos ="n"),lmtzr.lemmatize(token, pos ="v"),lmtzr.lemmatize(token, pos ="a")]
+            lemmas = self.expander.lemmas(token)
         else:
             lemmas = []
         wordnet_terms = lemmas[:]
         
         # synsets:
-        syns = wordnet.synsets(token)
-        if not self.use_synsets:
-            syns = []
-        for s in syns:
-            for lemma in s.lemmas():
-                wordnet_terms.append(lemma.name())
+        syns = []
+        if self.use_synsets:
+            syns = self.expander.synset_lemmas(token)
+        for names in syns:
+            for name in names:
+                wordnet_terms.append(name)
                 if len(wordnet_terms) > 8:
                     break
         
         #remove duplicates (check that it HASNT already included the same lemma in terms_to_check already (eg drugs = drug drug))
-        wordnet_terms = list(dict.fromkeys(wordnet_terms))
+        return lemmas, list(dict.fromkeys(wordnet_terms))
+    
+    def expand_terms(self, token, context_tokens):
+        """Expand token with its WordNet lemmas and synonyms.
+        
+        Parameters:
+          token (string): The token to expand
+          context_tokens (list): Uppercase tokens of the query context (terms already in it are not queried again)
+          
+        Returns:
+          tuple: (list of uppercase terms a matching annotation must have, list of lemmas,
+                  string of additional terms to query)
+        """
+        must_have = [token.upper()]
+        lemmas, wordnet_terms = self.wordnet_terms(token)
         
         terms_to_check = ""
         for l in wordnet_terms:
-            if l.upper() not in tokens+ptokens:
+            if l.upper() not in context_tokens:
                 must_have.append(l.upper())
                 terms_to_check+=l+" "
-                
-        for r in results:
-            r["match"] = r["annotations"][0]["text"]
-            r["annotations"][0]["matchType"] = "NCBO-"+r["annotations"][0]["matchType"]
+        
+        return must_have, lemmas, terms_to_check
+    
+    def query(self, token, stripped, lemmas, terms_to_check, ontologies):
+        """Query the annotator for token, in its context and with its WordNet terms.
+        
+        Parameters:
+          token (string): The token being classified
+          stripped (string): The context query of the token's cell (see make_context)
+          lemmas (list): The WordNet lemmas of token
+          terms_to_check (string): The WordNet terms of token to query (see expand_terms)
+          ontologies (list): The ontologies to limit the results to
+          
+        Returns:
+          list: list of annotator results, with result["match"] set to the matched term and the
+            matchType of the first annotation prefixed by its source (NCBO or WORDNET).
+        """
+        # the context query is the same for every token in a cell, so it is only sent once per cell
+        if (stripped, tuple(ontologies)) in self.cell_responses:
+            self.cache_hits += 1
+        else:
+            context_results = self.api_call(stripped, ontologies)
+            for r in context_results:
+                r["match"] = r["annotations"][0]["text"]
+                r["annotations"][0]["matchType"] = "NCBO-"+r["annotations"][0]["matchType"]
+            self.cell_responses[(stripped, tuple(ontologies))] = context_results
+        results = list(self.cell_responses[(stripped, tuple(ontologies))])
                 
         #print("Lemmas/Synset:" ,terms_to_check)
         if terms_to_check != "":
-            res_tcheck = self.api_call(terms_to_check)
+            res_tcheck = self.api_call(terms_to_check, ontologies)
             for r in res_tcheck:
                 r["match"] = token.upper()
                 if r["annotations"][0]["text"].lower() in lemmas:
@@ -350,67 +805,272 @@ class NCBO_Token_Classifier (Token_Classifier):
                 else:
                     r["annotations"][0]["matchType"] = "WORDNET-SYN,NCBO-"+r["annotations"][0]["matchType"]
             results += res_tcheck
-                           
-        # divide into dic based on number of terms
-        freq_to_res = {}
-        
-        for r in results:
-            term_found = False
-            for term in must_have:
-                if term.upper() in r["annotations"][0]["text"].upper().split():
-                    term_found = True
-                    break
-            if not term_found:
-                continue
-            # number of matched words
-            freq = len(r["annotations"][0]["text"].upper().split())
-            # wordnet has a frequency of 0 for synonyms, 0.5 for lemmas
-            if "WORDNET" in r["annotations"][0]["matchType"]:
-                if "LEMMA" in r["annotations"][0]["matchType"]:
-                    freq = 0.5
-                else:
-                    freq = 0
-            if freq not in freq_to_res.keys():
-                freq_to_res[freq] = []
-            freq_to_res[freq].append(r)
-            
-        # then sort by ontology priority list
-        results_sorted = []
-        
-        ontos_to_ids = {}
-        
-        for freq in sorted(freq_to_res, reverse=True):
-            res_arr = freq_to_res[freq]
-            for onto in self.onto_list:
-                for r in res_arr:
-                    if r["annotatedClass"]["links"]["ontology"].endswith(onto):
-                        
-                        concept_id=r["annotatedClass"]["@id"]
-                        if onto not in ontos_to_ids:
-                            ontos_to_ids[onto] = []
-                        if concept_id in ontos_to_ids[onto]:
-                            continue # a duplicate
-                        ontos_to_ids[onto].append(concept_id)
-                        
-                        #print(r["annotations"][0]["text"]+" FREQ:",freq," ONTO:", onto)
-                        results_sorted.append(r)        
+        
+        return results
+    
+    def rank(self, results, must_have):
+        """Rank the annotator results that match one of the must_have terms (see ncbo_ranking.rank_results).
+        
+        Results are scored with scorer (by default, the number of words they matched, with WordNet lemmas and
+        synonyms counting as 0.5 and 0), then ranked by the priority of their ontology in onto_list.
+        Duplicates are removed. If top_k is 1, only the top result is looked for.
+        
+        Parameters:
+          results (list): The annotator results (see query)
+          must_have (list): The uppercase terms a matching annotation must have (see expand_terms)
+          
+        Returns:
+          list: Ranked list of (score, result) tuples, best first
+        """
+        return rank_results(results, must_have, self.onto_list, self.scorer, self.top_k == 1)
+    
+    def find_candidates(self, token, stripped, context_tokens):
+        """Query the annotator for token in its context, and rank the results.
+        
+        Parameters:
+          token (string): The token being classified
+          stripped (string): The context query of the token's cell (see make_context)
+          context_tokens (list): Uppercase tokens of the query context
+          
+        Returns:
+          list: Ranked list of at most top_k NCBO_Candidate
+        """
+        # expand the token with its lemmas and synonyms (via wordnet)
+        must_have, lemmas, terms_to_check = self.expand_terms(token, context_tokens)
+        
+        # adaptive mode: start with the ontologies that usually provide the top result
+        ontologies = self.onto_list
+        if self.adaptive_ontologies:
+            self.num_queried += 1
+            if self.num_queried % self.explore_every != 0:
+                ontologies = self.onto_stats.high_yield(self.onto_list, self.coverage, self.min_samples)
+            start = time.perf_counter()
+        adaptive = len(ontologies) < len(self.onto_list)
+        
+        results = self.query(token, stripped, lemmas, terms_to_check, ontologies)
+        results_sorted = self.rank(results, must_have)
+        
+        # nothing usable: escalate to the remaining ontologies
+        escalated = adaptive and len(results_sorted) == 0
+        if escalated:
+            results += self.query(token, stripped, lemmas, terms_to_check, [o for o in self.onto_list if o not in ontologies])
+            results_sorted = self.rank(results, must_have)
+        
+        if self.adaptive_ontologies:
+            self.onto_stats.record_query(adaptive, len(json.dumps(results)), time.perf_counter()-start, escalated)
         
         # what this temporary list will do:
         # provide a list of matches for the human-in-the-loop to choose from
-        # eventually, a better format should be decided upon
+        # only the compact records of the top_k results are kept (see NCBO_Candidate.payload for the rest)
         
-        if "NCBO_results" not in cell:
-            cell["NCBO_results"] = []
-        cell["NCBO_results"].append( (token,results_sorted) )
+        return make_candidates(results_sorted, self.top_k)
+    
+    def find_expansion_candidates(self, expansion):
+        """Return the ranked candidates (list of NCBO_Candidate) of an abbreviation's expansion, querying it only once per document.
+        
+        The expansion is queried on its own, and a matching annotation must have one of its words (annotations
+        of the whole expansion rank first, as they match the most words).
+        """
+        if expansion in self.expansion_candidates:
+            self.cache_hits += 1
+            return self.expansion_candidates[expansion]
+        
+        words = nltk.tokenize.RegexpTokenizer(r'\w+').tokenize(expansion.upper())
+        stripped = " ".join(words)
+        
+        candidates = None
+        if self.outcome_cache is not None:
+            outcome_key = self.outcome_key(stripped, stripped)
+            candidates = self.outcome_cache.get(outcome_key)
+        if candidates is None:
+            results = self.query(stripped, stripped, [], "", self.onto_list)
+            candidates = make_candidates(self.rank(results, words), self.top_k)
+            if self.outcome_cache is not None:
+                self.outcome_cache.put(outcome_key, candidates)
+        
+        # forks share expansion_candidates: if another thread got there first, use its candidates
+        return self.expansion_candidates.setdefault(expansion, candidates)
+    
+    def classify(self, token, cell, context=None):
+        """Given a token from a cell, return a corresponding list of features.
+        
+        Parameters:
+          token (string): The token to classify
+          cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
+          
+        Returns:
+          list : List of features. May have multiple features, or none at all.
+        """
+            
+        # Only send request if there is SOME alphabetical character in the text
+        skip = True
+        for c in token:
+            if c.isalpha():
+                skip = False
+                break
+        if skip:
+            return []
+        
+        # Only send request if this token does not already have some feature attached to it
+        # (reuse the features of classifiers that already ran on this token, if any)
+        for c in self.classifiers_to_exclude:
+            if context is not None and type(c) in context:
+                features = context[type(c)]
+            else:
+                features = c.classify(token,cell)
+            if len(features) > 0:
+                return []
+            
+        # Reserved terms, and other tokens not worth a request (exclude):
+        if self.token_filter is not None:
+            if not self.token_filter.informative(token):
+                self.skipped += 1
+                return []
+        elif token.upper() in ["AND","OR","OF","NO"]:
+            return []
+        
+        # instead of just calling the API on the token
+        # call the API on the every word in the phrase, plus add'l context variables
+        # then check the annotations that were returned
+        # filter out those that do NOT include the token
+        # sort those that DO by priority
+        # most likely, frequency of words
+        
+        #results = self.api_call(token)
+        # should make this a pattern classifier instead
+        # but just for testing:
+        
+        # acronyms the document defines ("body mass index (BMI)") are classified by their expansion
+        expansion = self.abbreviations.get(token)
+        if expansion is not None:
+            candidates = self.find_expansion_candidates(expansion)
+            self.store_results(token, cell, candidates)
+            return self.top_feature(token, cell, candidates)
+        
+        stripped, tokens, ptokens = self.cell_context(cell)
+        
+        # skip tokens that are known to return nothing, in any context (no request)
+        if self.known_empty is not None:
+            key = self.query_key(token)
+            if key in self.known_empty:
+                self.cache_hits += 1
+                self.store_results(token, cell, [])
+                return []
+        
+        # tokens seen before in the same context (e.g. in another document) skip querying and ranking
+        if self.outcome_cache is not None:
+            outcome_key = self.outcome_key(token, stripped)
+            candidates = self.outcome_cache.get(outcome_key)
+            if candidates is not None:
+                self.cache_hits += 1
+            else:
+                candidates = self.find_candidates(token, stripped, tokens+ptokens)
+                self.outcome_cache.put(outcome_key, candidates)
+        else:
+            candidates = self.find_candidates(token, stripped, tokens+ptokens)
+        
+        self.store_results(token, cell, candidates)
+        
+        if self.token_filter is not None:
+            self.token_filter.record(token, len(candidates) > 0)
+        
+        if len(candidates) == 0 and self.known_empty is not None:
+            self.known_empty.add(key)
+        
+        return self.top_feature(token, cell, candidates)
+    
+    def top_feature(self, token, cell, candidates):
+        """Return the feature of the top ranked candidate of token (in a list), or an empty list if there are no candidates."""
         
         # return top choice for now
         # when HITL is implemented, this code should be replaced
         
-        if len(results_sorted) > 0:
-            r = results_sorted[0]
-            n = Concept_Feature(cell, [token], r["annotatedClass"]["@id"], None, [IRI_Node("sco:SubjectCharacteristic", None)])
+        if len(candidates) > 0:
+            r = candidates[0]
+            self.onto_stats.record_top(r.ontology)
+            n = Concept_Feature(cell, [token], r.class_id, None, [IRI_Node("sco:SubjectCharacteristic", None)])
             if "NCBO_top_res" not in cell:
-                cell["NCBO_top_res"] = IRI_Node(r["annotatedClass"]["@id"], None)
+                cell["NCBO_top_res"] = IRI_Node(r.class_id, None)
             return [n]
         
-        return []
\ No newline at end of file
+        return []
+
+# approximate matching against local ontology labels, as a fallback for tokens nothing else classified
+class Fuzzy_Label_Token_Classifier (Token_Classifier):
+    """The fuzzy label token classifier approximately matches tokens to ontology labels (see label_index).
+    
+    It is intended to come after the NCBO_Token_Classifier in the TokenClassifiers, and only classifies
+    tokens that no earlier classifier found a feature for (e.g. because PDF extraction mangled them).
+    The whole whitespace-delimited word of the cell text that contains the token is matched, so that
+    e.g. the token "HbA" in "HbA$_{1c}$" is matched as "HbA1c".
+    
+    The matches are stored as metadata in cell["fuzzy_results"], a list of (token, matches) tuples, where
+    matches is a list of (similarity, label, class IRI, ontology) tuples, most similar first.
+    
+    Attributes:
+      index (Label_Index): The label index to match against
+      top_k (int): Number of matches kept per token
+      min_similarity (float): Minimum similarity (0 to 1) of a match
+      
+    """
+    
+    def __init__(self, index_file=None, top_k=5, min_similarity=0.6, index=None):
+        """Instantiate a Fuzzy_Label_Token_Classifier
+        
+        Parameters:
+          index_file (string, optional): Path of a label index (see label_index). Either this or index must be given.
+          top_k (int, optional): 5 by default. Number of matches kept per token
+          min_similarity (float, optional): 0.6 by default. Minimum similarity of a match
+          index (Label_Index, optional): An already loaded label index
+        """
+        if index is None:
+            if index_file is None:
+                raise ValueError("Fuzzy_Label_Token_Classifier needs a label index (index_file or index)")
+            index = Label_Index.load(index_file)
+        self.index = index
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+    
+    def classify(self, token, cell, context=None):
+        """Given a token from a cell, return a corresponding list of features.
+        
+        Parameters:
+          token (string): The token to classify
+          cell (dict): The cell this token is found in
+          context (dict, optional): Features already assigned to this token by earlier classifiers, keyed by
+                                    classifier type (see KG_Builder.classify_token). None by default.
+          
+        Returns:
+          list : List of features. May have multiple features, or none at all.
+        """
+        if not any(c.isalpha() for c in token) or token.upper() in ["AND","OR","OF","NO"]:
+            return []
+        
+        # fallback only
+        if context is not None and any(len(features) > 0 for features in context.values()):
+            return []
+        
+        matches = self.index.query(self.containing_word(token, cell["text"]), self.top_k, self.min_similarity)
+        
+        if "fuzzy_results" not in cell:
+            cell["fuzzy_results"] = []
+        cell["fuzzy_results"].append( (token, matches) )
+        
+        if len(matches) == 0:
+            return []
+        
+        class_id = matches[0][2]
+        n = Concept_Feature(cell, [token], class_id, None, [IRI_Node("sco:SubjectCharacteristic", None)])
+        if "NCBO_top_res" not in cell:
+            cell["NCBO_top_res"] = IRI_Node(class_id, None)
+        return [n]
+    
+    def containing_word(self, token, text):
+        """Return the whitespace-delimited word of text that contains token (token itself if there is none)."""
+        folded = token.casefold()
+        for word in text.split():
+            if folded in word.casefold():
+                return word
+        return token
@@ -289,6 +289,7 @@ class Free_Value(Feature, Literal_Node):
       cell (dict): The cell this feature originates from.
       matching (list of strings): The list of tokens this feature matches.
       is_subsumed (bool): True if this Feature has been subsumed by another Feature, False otherwise.
+      span (tuple): (start, end) of the value in the cell's text, if known. None otherwise.
       
     """
     # anything which is a literal (e.g a number. could also be a string)
@@ -301,18 +302,20 @@ class Free_Value(Feature, Literal_Node):
     #   counter-- what if it can't? maybe just remember to set it
     #     counter-- if it can't, provide 'none.' Less things you need to remember to set, the better.
     
-    def __init__(self, matching, cell, value): 
+    def __init__(self, matching, cell, value, span = None): 
         """Instantiate a Literal_Node
         
         Parameters:
           cell (dict): The cell this feature originates from.
           matching (list of strings): The list of tokens this feature matches.
           value : Can be of any data type supported by RDFLib literals. None by default.
+          span (tuple, optional): (start, end) of the value in the cell's text. None by default.
         """
         self.value = value
         self.matching = matching
         self.cell = cell
         self.is_subsumed = False
+        self.span = span
         
     def get_type(self):
         """Get the type of this feature (one of blank, value, interpreter, or unknown).
@@ -9,12 +9,21 @@ import rdflib
 from rdflib.namespace import RDF
 from xml.sax.saxutils import unescape
 import copy
+import pickle
+import time
+import concurrent.futures
 import nltk
 from nltk.tokenize import MWETokenizer
 from nltk.tokenize import WhitespaceTokenizer 
      
 from .graph_framework import *
 from .classifiers import *
+from .classifier_registry import *
+from .value_scanner import Value_Scanner
+from .text_pipeline import Text_Pipeline
+from .token_vocabulary import Token_Vocabulary
+from .tree_traversal import preorder, flatten_table, nest_table
+from .cells import Cell_Arena
 from .study_subject_interpreter import *
         
 class KG_Builder:
@@ -22,17 +31,48 @@ class KG_Builder:
     
     Attributes:
       TokenClassifiers (list): List of classifiers to use
+      PatternClassifiers (list): List of additional pattern classifiers to use
+      interpreter_patterns (Automaton_Pattern_Classifier): The patterns the Study_Subject_Interpreter relies on
+        (token_patterns.DEFAULT_PATTERNS), always matched before the PatternClassifiers
+      profiler (Classifier_Profiler): Time spent in and results of each classifier, per document and per corpus
+      vocabulary (Token_Vocabulary): The distinct tokens of the current document, and their features from
+        cell-independent classifiers
+      parallel (string): None to build tables one after another, "threads" or "processes" to build them in parallel
+      workers (int): Maximum number of threads or processes. None for the executor's default.
+      incremental (bool): True to keep the features of every cell before the columns are interpreted, so that the KG
+        can be rebuilt after editing a cell (see update_cell)
       
     """
     
     # right now ordered as per left-to-right precendece
-    # TODO, should be revamped to be made much more powerful + adaptable
     
-    def __init__(self):
+    def __init__(self, config=None, parallel=None, workers=None, incremental=False):
         """Initialize the KG builder with initial parameters.
         
+        Parameters:
+          config (dict, optional): Classifier configuration, e.g. from classifier_registry.load_classifier_config.
+            The default classifiers are used by default.
+          parallel (string, optional): None by default (tables are built one after another). "threads" builds each table
+            in a thread (suits annotator-bound runs). "processes" builds each table in a process (suits CPU-bound runs);
+            the classifiers (with their caches and statistics) are sent to the processes, and must be picklable.
+          workers (int, optional): Maximum number of threads or processes. None (the executor's default) by default.
+          incremental (bool, optional): False by default. True keeps a copy of the features of every cell (in
+            cell["annotation"]) before the columns are interpreted, which update_cell starts from.
         """
-        self.TokenClassifiers = [Free_Value_Token_Classifier(), Concept_Token_Classifier(),NCBO_Token_Classifier()]
+        if config is None:
+            config = {}
+        self.config = config
+        self.parallel = parallel
+        self.workers = workers
+        self.incremental = incremental
+        self.TokenClassifiers = make_classifiers(config.get("token_classifiers", DEFAULT_TOKEN_CLASSIFIERS))
+        self.PatternClassifiers = make_classifiers(config.get("pattern_classifiers", DEFAULT_PATTERN_CLASSIFIERS))
+        self.interpreter_patterns = Automaton_Pattern_Classifier(DEFAULT_PATTERNS)
+        self.interpreter_patterns.profile_name = "interpreter_patterns"
+        self.profiler = Classifier_Profiler()
+        self.value_scanner = Value_Scanner()
+        self.text_pipeline = self.make_text_pipeline()
+        self.vocabulary = Token_Vocabulary()
         
         #self.row_interpreter = ...doesnt interpret along rows anymore
         
@@ -45,63 +85,170 @@ class KG_Builder:
         This function does not return anything, but modifies data such that
         it is in the form of a preliminary KG (using graph_framework classes)
         and can be serialized to a KG using cell["column"].translate(g) on
-        each top-level cell in the structure.
+        each top-level cell in the structure. The cells of each table are
+        replaced with Cells, whose arenas are kept in intermediate_structure["arenas"]
+        (one per table, in table order, see cells): keep the structure while
+        its cells are in use.
         
         Parameters:
           intermediate_structure (dict) : The tree table extraction
         """
         
         # any preliminary stuff, e.g. footnote scanning, fixing broken multipage tables, w/e
+        
+        # TokenClassifiers may have been changed since __init__
+        self.text_pipeline = self.make_text_pipeline()
+        self.vocabulary = Token_Vocabulary()
+        
+        self.profiler.start_document()
+        
+        # let classifiers look at the whole document first (e.g. to batch annotator requests)
+        for classifier in self.TokenClassifiers:
+            start = time.perf_counter()
+            classifier.prefetch(intermediate_structure)
+            self.profiler.stats(classifier).prefetch_time += time.perf_counter() - start
     
         # iterate thru tables
-        for t_num,table in enumerate(intermediate_structure["tables"]):
-            
-            #print(table["fields"][0].keys())
-            
-            # STEP 1
-            # given a table, parse its cells
-            
-            self.parse_table(table)
-            
-            
-            # divide into row header columns and non-row-header columns
-            # TODO: add an actual heuristic. for now we just assume row[0] = headers
+        if self.parallel is None:
+            arenas = [self.build_table(table) for table in intermediate_structure["tables"]]
+        elif self.parallel == "threads":
+            arenas = self.build_tables_in_threads(intermediate_structure)
+        elif self.parallel == "processes":
+            arenas = self.build_tables_in_processes(intermediate_structure)
+        else:
+            raise ValueError("Unknown parallel mode '"+str(self.parallel)+"', use 'threads' or 'processes'")
+        intermediate_structure["arenas"] = arenas
 
-            # remember, a cell now keeps tracks of its parent and children. so all we need is the column header (field)
-            rowhead_columns = [table["fields"][0]]
-            data_columns = table["fields"][1:]
+        self.profiler.end_document()
 
-            # empty for now
-            column_nodes = []
-                         
-            # STEP 2
-            # parse all row header columns
-            # (or rows, really. since we want to create 1 row interpreter per row, regardless of header columns)
+    def build_table(self, table):
+        """Build the preliminary KG of a single table (see build_KG).
+        
+        Tables never share cells, so tables can be built independently (see parallel in __init__).
+        
+        Parameters:
+          table (dict): A tree table of the intermediate structure
+        
+        Returns:
+          Cell_Arena: The arena of the cells of table, which must be kept while they are in use
+        """
+        
+        #print(table["fields"][0].keys())
+        
+        # STEP 1
+        # given a table, parse its cells
+        # the cells become Cells, linked to their row, columnal parent and children by the arena of the table
+        
+        arena = Cell_Arena.build(table)
+        self.parse_table(table)
+        
+        # keep the features of the cells before the columns use them (see update_cell)
+        if self.incremental:
+            memo = self.cell_memo(table)
+            for subtable, depth in preorder(table):
+                for cell in subtable["fields"]:
+                    cell["annotation"] = copy.deepcopy(cell["tokens"], memo)
+        
+        # divide into row header columns and non-row-header columns
+        # TODO: add an actual heuristic. for now we just assume row[0] = headers
 
-            # TODO: Deal with this
-            # self.parse_row(table, rowhead_columns)
+        # remember, a cell now keeps tracks of its parent and children. so all we need is the column header (field)
+        rowhead_columns = [table["fields"][0]]
+        data_columns = table["fields"][1:]
 
-            # STEP 3
-            # now, parse all non-row-header columns
+        # empty for now
+        column_nodes = []
+                     
+        # STEP 2
+        # parse all row header columns
+        # (or rows, really. since we want to create 1 row interpreter per row, regardless of header columns)
 
-            # this is actually done columnally
+        # TODO: Deal with this
+        # self.parse_row(table, rowhead_columns)
 
-            # 3.1 create column interpreter for each
-            # 3.2 apply col_interpreter.interpret(cell) to each col header
+        # STEP 3
+        # now, parse all non-row-header columns
 
-            # remember, column interpreters themselves will be applying the row interpreters, recursively.
-            for col in data_columns:
-                column_nodes.append(self.parse_col(table, col))
-            
-            # STEP 4
+        # this is actually done columnally
 
-            # Build the kg, via translate
-                         
-            # for each column_nodes... etc.
-                         
-            # Include some options for formal KG (e.g. conforms to SCO) or informal (includes references to the missing values)
-            # remember to deal with translate in the node_wrapper at this point
+        # 3.1 create column interpreter for each
+        # 3.2 apply col_interpreter.interpret(cell) to each col header
+
+        # remember, column interpreters themselves will be applying the row interpreters, recursively.
+        for col in data_columns:
+            column_nodes.append(self.parse_col(table, col))
+        
+        # STEP 4
+
+        # Build the kg, via translate
+                     
+        # for each column_nodes... etc.
+                     
+        # Include some options for formal KG (e.g. conforms to SCO) or informal (includes references to the missing values)
+        # remember to deal with translate in the node_wrapper at this point
+        
+        return arena
+
+    def fork(self):
+        """Return a copy of this KG_Builder for another thread, with forked classifiers (see Token_Classifier.fork)
+        and its own profiler."""
+        worker = copy.copy(self)
+        worker.TokenClassifiers = [c.fork() for c in self.TokenClassifiers]
+        worker.PatternClassifiers = [copy.copy(c) for c in self.PatternClassifiers]
+        worker.profiler = Classifier_Profiler()
+        return worker
+    
+    def build_tables_in_threads(self, intermediate_structure):
+        """Build every table of the document in a thread pool, one forked KG_Builder per table.
+        
+        Classifier counts are merged back in table order.
+        
+        Returns:
+          list: The arenas of the tables, in table order
+        """
+        tables = intermediate_structure["tables"]
+        workers = [self.fork() for table in tables]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(worker.build_table, table) for worker, table in zip(workers, tables)]
+            arenas = [future.result() for future in futures]
+        for worker in workers:
+            self.profiler.merge_document(worker.profiler)
+        return arenas
+    
+    def build_tables_in_processes(self, intermediate_structure):
+        """Build every table of the document in a process pool.
+        
+        Each process gets a copy of the classifiers as prefetch left them (with their configuration, caches, statistics
+        and document state). Tables are sent as flat lists of rows (see tree_traversal.flatten_table), and each built
+        table comes back with its arena (see Cell_Arena.__getstate__), so that deeply nested tables can be sent. Each
+        built table (with its features) replaces the original table in intermediate_structure, in table order. What the classifiers learned while building it (see
+        Token_Classifier.updates) is merged back in table order, like the classifier counts.
         
+        Raises ValueError if the classifiers cannot be sent to other processes (e.g. they hold a lambda).
+        
+        Returns:
+          list: The arenas of the tables, in table order
+        """
+        try:
+            classifiers = pickle.dumps((self.TokenClassifiers, self.PatternClassifiers))
+        except (pickle.PicklingError, TypeError, AttributeError) as e:
+            raise ValueError("The classifiers cannot be sent to worker processes: "+str(e)) from e
+        
+        tables = intermediate_structure["tables"]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=_start_worker,
+                                                    initargs=(classifiers, self.incremental)) as pool:
+            results = list(pool.map(_build_table_in_worker, [flatten_table(table) for table in tables]))
+        arenas = []
+        for t_num, (arena, document_stats, updates) in enumerate(results):
+            tables[t_num] = arena.rows[0]
+            arenas.append(arena)
+            profiler = Classifier_Profiler()
+            profiler.document = document_stats
+            self.profiler.merge_document(profiler)
+            for classifier, classifier_updates in zip(self.TokenClassifiers, updates):
+                classifier.merge_updates(classifier_updates)
+        return arenas
+
     def parse_row(self, table, rowhead_columns):
         
         # 1. Create a row interpreter for this current row
@@ -124,15 +271,72 @@ class KG_Builder:
         
         col_int = Study_Subject_Interpreter(self)
         col_int.interpret(col_header_cell)
+        # the cells this column depends on (see update_cell)
+        col_header_cell["depends_on"] = col_int.depends_on
         return col_int.base
+    
+    def cell_memo(self, table):
+        """Return a deepcopy memo that keeps the cells and tables of table (and this KG_Builder) as they are, so that
+        copies of features still refer to the original cells."""
+        memo = {id(self): self}
+        for subtable, depth in preorder(table):
+            memo[id(subtable)] = subtable
+            for cell in subtable["fields"]:
+                memo[id(cell)] = cell
+        return memo
+    
+    def update_cell(self, cell, text=None):
+        """Rebuild the preliminary KG after the text of a cell was edited (e.g. its "new_text" in gt_generator).
+        
+        Only the edited cell and its columnal children (whose annotator context includes its text, see
+        NCBO_Token_Classifier.make_context) are tokenized and classified again. The columns that depend on any of them
+        (see Study_Subject_Interpreter.depends_on) are interpreted again, each from the features its cells had before
+        any column was interpreted (see incremental in __init__). Other columns keep their preliminary KG.
+        
+        Parameters:
+          cell (dict): The edited cell, from a table built by build_KG
+          text (string, optional): The new text of the cell. By default, cell["text"] has already been edited.
+        
+        Returns:
+          list: The column header cells that were interpreted again (see serialize.patch_graph)
+        """
+        if not self.incremental:
+            raise ValueError("update_cell needs a KG_Builder made with incremental=True")
+        if text is not None:
+            cell["text"] = text
+        
+        # column headers have no columnal parent, and their row is the top-level table
+        header = cell
+        while header["col_parent"] is not None:
+            header = header["col_parent"]
+        table = header["row"]
+        memo = self.cell_memo(table)
+        
+        # classify the cell and its columnal children from scratch
+        edited = [cell] + cell["col_children"]
+        for c in edited:
+            for key in ("NCBO_results", "NCBO_top_res", "fuzzy_results"):
+                c.pop(key, None)
+            for classifier in self.TokenClassifiers:
+                classifier.forget_cell()
+            self.annotate_features(c)
+            c["annotation"] = copy.deepcopy(c["tokens"], memo)
+        
+        columns = [col for col in table["fields"][1:] if any(c is e for c in col.get("depends_on", []) for e in edited)]
+        for col in columns:
+            # cells read by other columns too (e.g. row headers) are restored as well, the columns never share features
+            for c in {id(c): c for c in col["depends_on"]}.values():
+                c["tokens"] = copy.deepcopy(c["annotation"], memo)
+            self.parse_col(table, col)
+        return columns
                          
     # should rename to "parse table cells," as thats all this does
     def parse_table(self, table):
         
-        for i, cell in enumerate(table["fields"]):
-            self.parse_cell(table,i)
-        for subtable in table["records"]:
-            self.parse_table(subtable)
+        # parents first, so that each cell knows its columnal parent (see parse_cell)
+        for subtable, depth in preorder(table):
+            for i, cell in enumerate(subtable["fields"]):
+                self.parse_cell(subtable,i)
     
     def parse_cell(self, table, i):
         
@@ -140,29 +344,8 @@ class KG_Builder:
         
         cell = table["fields"][i]
         
-        # first annotate with references to row parent, and column children
-        # also annotate column children with references to column parent
-        # if this cell is lacking a columnal parent, say so (via = none)
-        
-        # row parent:
-        cell["row"] = table
-        
-        # index:
-        cell["index"] = i
-        
-        # cell children:
-        cell["col_children"] = []
-        
-        # set children to know this cell as columnal parent
-        for subtable in table["records"]:
-            
-            child = subtable["fields"][i]
-            child["col_parent"] = cell
-            cell["col_children"].append(child)
-        
-        # does this cell have a parent?
-        if "col_parent" not in cell:
-            cell["col_parent"] = None
+        # the references to the row parent, index, column children and column parent (or none)
+        # come from the arena of the table (see cells, and build_table)
         
         
         # now, finally
@@ -203,8 +386,21 @@ class KG_Builder:
         
         features = []
         
+        # features found so far, per classifier type, so later classifiers don't have to recompute them
+        context = {}
+        
         for classifier in self.TokenClassifiers:
-            features += classifier.classify(token, cell)
+            stats = self.profiler.stats(classifier)
+            cache_hits = classifier.cache_hits
+            skipped = classifier.skipped
+            start = time.perf_counter()
+            if classifier.cell_independent:
+                found = self.vocabulary.classify(classifier, token, cell, context)
+            else:
+                found = classifier.classify(token, cell, context)
+            stats.record(time.perf_counter() - start, len(found), classifier.cache_hits - cache_hits, classifier.skipped - skipped)
+            context.setdefault(type(classifier), []).extend(found)
+            features += found
                 
         return features;
                 
@@ -213,37 +409,53 @@ class KG_Builder:
         # in this way, precendence issues are avoided
     
     def classify_pattern(self, cell):
-        return []
-        # given the initial feature identification in the cell
         
+        # given the initial feature identification in the cell
         # identify patterns based on PRESCENCE of tokens/features
+        # (e.g. "40.3 ± 2.1", "12 (40%)"), each pattern classifier in a single pass over the tokens
+        # the interpreter's own patterns (±, %, "(") are found whatever pattern classifiers are configured
         
-        # ...TODO
+        patterns = []
+        
+        for classifier in [self.interpreter_patterns] + self.PatternClassifiers:
+            start = time.perf_counter()
+            found = classifier.classify(cell)
+            self.profiler.stats(classifier).record(time.perf_counter() - start, len(found))
+            patterns += found
+        
+        return patterns
         
         # identify patterns based on ABSCENCE of tokens/features
         # (e.g. a number was not matched to something.. erego it is a free value)
         
         # ...TODO
-        
-        # return a LIST of tuples, such that each element follows (LIST_OF_TOKENS, FEATURE)
-        # so yes, some features may overlap in their corresponding tokens (again, avoids precedence issues)
     
+    def make_text_pipeline(self):
+        """Make the text pipeline that normalizes and tokenizes cells, and joins multi word keywords
+        (e.g. "standard deviation") into single tokens.
+        
+        The keywords are taken from every Concept_Token_Classifier in TokenClassifiers.
+        
+        Returns:
+          Text_Pipeline: The pipeline
+        """
+        mwes = []
+        for classifier in self.TokenClassifiers:
+            if isinstance(classifier, Concept_Token_Classifier):
+                mwes.extend(classifier.mwes)
+        return Text_Pipeline(mwes)
+        
     def annotate_features(self, cell):
         
-        # first, tokenize
+        # first, normalize and tokenize (see text_pipeline)
         
         #this one is better but doesnt handle some punct (e.g =) as well:
         #tokenizer = nltk.word_tokenize(cell["text"])
         
-        # this one separates each punct as its own thing, EXCEPT for numbers (eg 40.3, -.6)
-        # This one does not account for whitespace: r'-?\d*\.?\d+|\w+|[^\w\s]'
-        # Current one accounts for 1 whitespace on either side of dot 
-        tokenizer = nltk.tokenize.RegexpTokenizer(r'-?\s?\d*\s?\.\s?\d+|-?\s?\d*\.?\d+|\w+|[^\w\s]')
+        # the tokenizer separates each punct as its own thing, EXCEPT for numbers (eg 40.3, -.6)
+        # it accounts for 1 whitespace on either side of dot
+        # multi word tokens come from the keywords of the concept classifier(s), see make_text_pipeline
         
-        #TODO: Refactor multi word tokens to work with keywords directly
-        # Should be class-based (e.g. this array of keywords should be generated from the concept classifier, instead of included here)
-        mwe = MWETokenizer([("s",".","d","."),("S",".","D","."),("standard","deviation"),("Standard","Deviation"),("Standard","deviation"),("s",".","e","."),("S",".","E","."),("standard","error"),("Standard","Error"),("Standard","error"),("st",".","dev","."),("St",".","Dev","."),("std",".","dev","."),("Std",".","Dev","."),("interquartile","range"),("Interquartile","Range"),("Interquartile","range"),("confidence","interval"),("Confidence","Interval"),("Confidence","interval"),("geometric","mean"),("Geometric","Mean"),("Geometric","mean"),("Coefficient","of","Variation")])
-
         #TODO: Glyphs, superscript/subscript
         # It might not be possible to account for glyphs, subscript might be solvable however
         
@@ -255,30 +467,16 @@ class KG_Builder:
         
         
         #TODO: Test that this works, make ways to account for other encodings 
-        text = cell["text"] 
-        if len(text) is not 0:
-            # accounts for html wierdness
-            text = unescape(text)
-            # convert bullet (·) to decimal here
-            text = text.replace('·','.')
-            # convert minus sign (−) to - here
-            text = text.replace('−','-')
-            # TODO: Adjust such that minus sign is its own token/interpreter, that can create free values
-            # Instead we just replace with '−' if range might be an issue
-            lastnum = -10
-            s = list(text)
-            for i,c in enumerate(s):
-                if c >= '0' and c <= '9':
-                    lastnum = i
-                if c == '-' and (i - lastnum) == 1: #if immediately following number
-                    s[i] = '−'
-            text = "".join(s)
-                    
-            
-            tokens = tokenizer.tokenize(text)
-        else: tokens = [] # otherwise it fills with "missing data"
+        # html entities are unescaped, bullets (·) become decimals, and minus signs (−) become -, except
+        # '−' is used if range might be an issue (immediately following number)
+        # TODO: Adjust such that minus sign is its own token/interpreter, that can create free values
+        text, tokens = self.text_pipeline.process(cell["text"])
         
-        tokens = mwe.tokenize(tokens)
+        # find the numbers (and ranges, ±, percentages...) of the cell in one pass
+        # the Free_Value_Token_Classifier uses these for the number tokens
+        cell["values"] = self.value_scanner.scan(text, cell)
+        # the Unit_Token_Classifier scans the same text as the tokens come from
+        cell["normalized_text"] = text
         
         # Examine each token according to the various token_extracters (token_classifiers? )
         # Store in cell
@@ -286,13 +484,11 @@ class KG_Builder:
         cell["tokens"] = []
         
         for token in tokens:
-            # strip whitespace
-            token = token.replace(" ","")
+            token = self.vocabulary.intern(token)
             features = self.classify_token(token, cell)
             cell["tokens"].append((token, features))
         
         # next: redo but for patterns of tokens
-        # proposal: use multi word tokenizing?
         
         cell["patterns"] = self.classify_pattern(cell)
             
@@ -311,4 +507,25 @@ class KG_Builder:
         
         
         
-        
\ No newline at end of file
+        
+
+# the KG_Builder of a worker process (see KG_Builder.build_tables_in_processes)
+_worker_builder = None
+
+def _start_worker(classifiers, incremental):
+    """Make the KG_Builder of a worker process, with the (pickled) token and pattern classifiers of the main process."""
+    global _worker_builder
+    _worker_builder = KG_Builder({"token_classifiers": [], "pattern_classifiers": []}, incremental=incremental)
+    _worker_builder.TokenClassifiers, _worker_builder.PatternClassifiers = pickle.loads(classifiers)
+    _worker_builder.text_pipeline = _worker_builder.make_text_pipeline()
+    # only send back what the classifiers learn from here on
+    for classifier in _worker_builder.TokenClassifiers:
+        classifier.updates()
+
+def _build_table_in_worker(flat_table):
+    """Build a table, given as flattened by tree_traversal.flatten_table, in a worker process. Returns the arena of the
+    built table (its first row is the table), the classifier counts of building it, and what each token classifier
+    learned (see Token_Classifier.updates)."""
+    _worker_builder.profiler.start_document()
+    arena = _worker_builder.build_table(nest_table(*flat_table))
+    return arena, _worker_builder.profiler.document, [c.updates() for c in _worker_builder.TokenClassifiers]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A character-trigram index over ontology labels, for approximate concept matching.
+
+The NCBO Annotator only returns exact (or synonym) matches, so terms mangled by PDF extraction
+("HbA$_{1c}$", "hyper- tension", ligatures such as "ﬁ") get no concept at all. Label_Index matches
+such terms approximately against a local copy of the ontology labels: both are normalized (see
+normalize_label), split into character trigrams, and scored by the Dice coefficient of their
+trigram sets, using an inverted index from trigram to labels.
+
+The index is built offline from tab-separated label files (class IRI, ontology acronym, label):
+
+  python -m extraction.label_index labels.json.gz sco_labels.tsv doid_labels.tsv ...
+
+  Fuzzy_Label_Token_Classifier(Label_Index.load("labels.json.gz"))
+"""
+import argparse
+import gzip
+import heapq
+import json
+import re
+import unicodedata
+
+# LaTeX math markup left in the text by PDF extraction (e.g. HbA$_{1c}$)
+LATEX_MARKUP = re.compile(r'\$|\\[a-zA-Z]+|[_^{}]')
+# words broken across lines
+HYPHENATION = re.compile(r'(?<=\w)-\s+(?=\w)')
+NON_ALNUM = re.compile(r'[\W_]+')
+
+def normalize_label(text):
+    """Normalize a label or term for matching: unify ligatures and similar characters, remove
+    LaTeX markup, join hyphenated words, casefold, and reduce punctuation to single spaces."""
+    text = unicodedata.normalize("NFKC", text)
+    text = LATEX_MARKUP.sub("", text)
+    text = HYPHENATION.sub("", text)
+    return NON_ALNUM.sub(" ", text.casefold()).strip()
+
+def trigrams(text):
+    """Return the set of character trigrams of normalized text (padded, so short words have trigrams too)."""
+    padded = "  "+text+" "
+    return set(padded[i:i+3] for i in range(len(padded) - 2))
+
+class Label_Index:
+    """An inverted index from character trigrams to ontology labels.
+
+    Attributes:
+      labels (list): List of (label, class IRI, ontology acronym) tuples
+      sizes (list): Number of trigrams of each label
+      postings (dict): Trigram -> list of positions in labels
+
+    """
+
+    def __init__(self, labels=()):
+        """Instantiate a Label_Index.
+
+        Parameters:
+          labels (iterable, optional): (label, class IRI, ontology acronym) tuples to index. None by default.
+        """
+        self.labels = []
+        self.sizes = []
+        self.postings = {}
+        for label, class_id, ontology in labels:
+            self.add(label, class_id, ontology)
+
+    def add(self, label, class_id, ontology):
+        """Add a label to the index."""
+        grams = trigrams(normalize_label(label))
+        if len(grams) == 0:
+            return
+        i = len(self.labels)
+        self.labels.append((label, class_id, ontology))
+        self.sizes.append(len(grams))
+        for gram in grams:
+            self.postings.setdefault(gram, []).append(i)
+
+    def query(self, text, top_k=5, min_similarity=0.5):
+        """Return the labels most similar to text.
+
+        Parameters:
+          text (string): The term to match (normalized here)
+          top_k (int, optional): Maximum number of matches to return. 5 by default.
+          min_similarity (float, optional): Minimum Dice similarity (0 to 1) of a match. 0.5 by default.
+
+        Returns:
+          list: List of (similarity, label, class IRI, ontology acronym) tuples, most similar first
+        """
+        grams = trigrams(normalize_label(text))
+        if len(grams) == 0:
+            return []
+
+        overlaps = {}
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                overlaps[i] = overlaps.get(i, 0) + 1
+
+        # Dice coefficient: 2 |A & B| / (|A| + |B|)
+        size = len(grams)
+        scored = ((2.0 * overlap / (size + self.sizes[i]), i) for i, overlap in overlaps.items())
+        best = heapq.nlargest(top_k, (s for s in scored if s[0] >= min_similarity))
+        return [(similarity,)+self.labels[i] for similarity, i in best]
+
+    def save(self, path):
+        """Save the index to path (gzipped json)."""
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump({"labels": self.labels, "sizes": self.sizes, "postings": self.postings}, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        """Load an index saved with save().
+
+        Returns:
+          Label_Index: The loaded index
+        """
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        index = cls()
+        index.labels = [tuple(label) for label in data["labels"]]
+        index.sizes = data["sizes"]
+        index.postings = data["postings"]
+        return index
+
+def read_labels(path):
+    """Read (label, class IRI, ontology acronym) tuples from a tab-separated file of class IRI, ontology, label."""
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) >= 3:
+                yield (fields[2], fields[0], fields[1])
+
+def main():
+    """Build a label index from the label files given in sys.argv."""
+    parser = argparse.ArgumentParser(description="Builds a character-trigram index over ontology labels.")
+
+    parser.add_argument('index_file', help='Name of the index file to create (gzipped json)')
+    parser.add_argument('label_files', nargs='+', help='Tab-separated files of class IRI, ontology acronym, label')
+
+    args = parser.parse_args()
+
+    index = Label_Index()
+    for label_file in args.label_files:
+        for label, class_id, ontology in read_labels(label_file):
+            index.add(label, class_id, ontology)
+    index.save(args.index_file)
+
+    print("Saved index of "+str(len(index.labels))+" labels to "+args.index_file+"\n")
+
+if __name__ == "__main__":
+
+    main()
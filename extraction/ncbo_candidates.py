@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compact records for the ranked concept candidates returned by the NCBO Annotator.
+
+The annotator returns a large JSON dict for every match (links, hierarchy, mappings, ...).
+Only a handful of these fields are ever used after ranking, so NCBO_Token_Classifier stores
+NCBO_Candidate records in cell["NCBO_results"] instead of the raw dicts. The full class
+description can still be retrieved on demand (e.g. by a human-in-the-loop tool) via payload().
+"""
+import urllib.parse
+
+from . import annotate_text
+
+class NCBO_Candidate:
+    """A single ranked concept candidate for a token.
+
+    Attributes:
+      class_id (string): IRI of the annotated class
+      ontology (string): Acronym of the ontology the class belongs to (e.g. "SCO")
+      match (string): The (uppercase) term this candidate was matched on
+      text (string): The text the annotator actually matched (differs from match for WordNet terms)
+      match_type (string): The match type, prefixed by its source (e.g. "NCBO-PREF", "WORDNET-SYN,NCBO-SYN")
+      pref_label (string): The preferred label of the class. Empty string if not returned.
+      score (float): The ranking score this candidate was sorted by (higher is better)
+
+    """
+
+    __slots__ = ("class_id", "ontology", "match", "text", "match_type", "pref_label", "score")
+
+    def __init__(self, class_id, ontology, match, text, match_type, pref_label="", score=0):
+        """Instantiate an NCBO_Candidate.
+
+        Parameters:
+          class_id (string): IRI of the annotated class
+          ontology (string): Acronym of the ontology the class belongs to
+          match (string): The term this candidate was matched on
+          text (string): The text the annotator actually matched
+          match_type (string): The match type, prefixed by its source
+          pref_label (string, optional): The preferred label of the class. Empty string by default.
+          score (float, optional): The ranking score of this candidate. 0 by default.
+        """
+        self.class_id = class_id
+        self.ontology = ontology
+        self.match = match
+        self.text = text
+        self.match_type = match_type
+        self.pref_label = pref_label
+        self.score = score
+
+    @classmethod
+    def from_result(cls, result, score=0):
+        """Make a candidate from a single (json-parsed) annotator result.
+
+        Uses result["match"] as the matched term if it has been set by the classifier, and the
+        annotation text otherwise.
+
+        Parameters:
+          result (dict): A single element of the list returned by annotate_text.annotate
+          score (float, optional): The ranking score of this candidate. 0 by default.
+
+        Returns:
+          NCBO_Candidate: The compact record
+        """
+        annotated_class = result["annotatedClass"]
+        annotation = result["annotations"][0]
+        return cls(annotated_class["@id"],
+                   annotated_class["links"]["ontology"].rsplit('/', 1)[-1],
+                   result.get("match", annotation["text"]),
+                   annotation["text"],
+                   annotation["matchType"],
+                   annotated_class.get("prefLabel", "") or "",
+                   score)
+
+    def payload(self):
+        """Retrieve the full class description of this candidate from BioPortal.
+
+        This makes a request every time it is called, so it is only intended for tools that
+        need more than the compact record (e.g. for a human-in-the-loop to choose between candidates).
+
+        Returns:
+          dict: The json-parsed class description
+        """
+        return annotate_text.get_json(annotate_text.REST_URL + "/ontologies/" + self.ontology
+                                      + "/classes/" + urllib.parse.quote(self.class_id, safe=""))
+
+    def to_string(self):
+        """Return a string representing this candidate."""
+        return "("+self.ontology+") "+self.class_id+" : "+self.pref_label+" ["+self.match+", "+self.match_type+"]"
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __str__(self):
+        return self.to_string()
+
+def make_candidates(ranked_results, top_k=None):
+    """Convert a ranked list of (score, result) pairs to a list of at most top_k candidates.
+
+    Parameters:
+      ranked_results (list): List of (score, result dict) tuples, best first
+      top_k (int, optional): Maximum number of candidates to keep. Keeps all if None (default).
+
+    Returns:
+      list: List of NCBO_Candidate
+    """
+    if top_k is not None:
+        ranked_results = ranked_results[:top_k]
+    return [NCBO_Candidate.from_result(r, score) for (score, r) in ranked_results]
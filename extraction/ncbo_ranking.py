@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Ranking of the NCBO Annotator results for a token.
+
+Results are scored by a pluggable scoring function (match_length_score by default), and ranked by
+score, then by the priority of their ontology, then by the order the annotator returned them in.
+Each concept is only kept once per ontology, at its best rank. rank_results does this in a single
+pass over the results; with top_1=True it does not sort at all, and only returns the best result.
+"""
+
+# change whenever the ranking changes, so that cached outcomes (see outcome_cache) are not reused
+RANKING_VERSION = 1
+
+def match_length_score(result, words):
+    """The default scoring function: the number of words the annotation matched.
+
+    Annotations of WordNet terms score 0.5 for lemmas and 0 for synonyms (see NCBO_Token_Classifier.query).
+
+    Parameters:
+      result (dict): The annotator result to score
+      words (set): The uppercase words of the result's annotation text
+
+    Returns:
+      float: The score (higher is better)
+    """
+    match_type = result["annotations"][0]["matchType"]
+    if "WORDNET" in match_type:
+        if "LEMMA" in match_type:
+            return 0.5
+        return 0
+    return len(result["annotations"][0]["text"].split())
+
+def rank_results(results, must_have, onto_list, scorer=match_length_score, top_1=False):
+    """Rank the annotator results that match one of the must_have terms.
+
+    Results from ontologies that are not in onto_list are dropped.
+
+    Parameters:
+      results (list): The annotator results (see NCBO_Token_Classifier.query)
+      must_have (list): The uppercase terms a matching annotation must have (as a whole word)
+      onto_list (list): The ontologies, in order of priority
+      scorer (function, optional): Scoring function (result, set of uppercase words) -> float. match_length_score by default.
+      top_1 (bool, optional): If True, only the best result is returned. False by default.
+
+    Returns:
+      list: Ranked list of (score, result) tuples, best first
+    """
+    onto_priority = {onto: i for i, onto in enumerate(onto_list)}
+    must_have = set(term.upper() for term in must_have)
+
+    # (ontology, concept id) -> (sort key, score, result) of its best ranked result
+    best = {}
+    for i, r in enumerate(results):
+        words = set(r["annotations"][0]["text"].upper().split())
+        if must_have.isdisjoint(words):
+            continue
+
+        onto = r["annotatedClass"]["links"]["ontology"].rsplit('/', 1)[-1]
+        priority = onto_priority.get(onto)
+        if priority is None:
+            continue
+
+        score = scorer(r, words)
+        key = (-score, priority, i)
+        concept = (onto, r["annotatedClass"]["@id"])
+        if concept not in best or key < best[concept][0]:
+            best[concept] = (key, score, r)
+
+    if len(best) == 0:
+        return []
+    if top_1:
+        key, score, r = min(best.values(), key=lambda b: b[0])
+        return [(score, r)]
+    return [(score, r) for key, score, r in sorted(best.values(), key=lambda b: b[0])]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Per-ontology yield statistics for the NCBO_Token_Classifier.
+
+The classifier records which ontology the top ranked concept of each token comes from. In adaptive
+mode, it uses these counts to query only the ontologies that usually provide the top result, and
+only escalates to the remaining ontologies when that yields nothing usable.
+
+Request size and latency are recorded for queries on the full ontology list and on the reduced
+list, so that the savings of adaptive mode can be estimated (see Ontology_Stats.report).
+
+The statistics can be shared between threads (see KG_Builder.fork): they are updated under a lock.
+Worker processes send back what they recorded (see difference), which is merged into the statistics
+of the main process (see merge).
+"""
+import json
+import os
+import threading
+
+# the counters of Ontology_Stats, besides top_counts
+COUNTERS = ("full_queries", "full_bytes", "full_latency", "adaptive_queries", "adaptive_bytes", "adaptive_latency", "escalations")
+
+class Ontology_Stats:
+    """Statistics on how often each ontology provides the top ranked result, and on query costs.
+
+    Attributes:
+      top_counts (dict): Ontology acronym -> number of tokens whose top ranked concept came from it
+      full_queries (int): Number of tokens queried on the full ontology list
+      full_bytes (int): Total size (in bytes of json) of the results of those queries
+      full_latency (float): Total time (in seconds) spent on those queries
+      adaptive_queries (int): Number of tokens queried on a reduced ontology list
+      adaptive_bytes (int): Total size of the results of those queries (including escalations)
+      adaptive_latency (float): Total time spent on those queries (including escalations)
+      escalations (int): Number of adaptive queries that had to be repeated on the remaining ontologies
+      lock (threading.Lock): Held while the statistics are updated or read
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty Ontology_Stats."""
+        self.top_counts = {}
+        self.full_queries = 0
+        self.full_bytes = 0
+        self.full_latency = 0.0
+        self.adaptive_queries = 0
+        self.adaptive_bytes = 0
+        self.adaptive_latency = 0.0
+        self.escalations = 0
+        self.lock = threading.Lock()
+
+    def record_top(self, ontology):
+        """Record that the top ranked concept of a token came from ontology."""
+        with self.lock:
+            self.top_counts[ontology] = self.top_counts.get(ontology, 0) + 1
+
+    def record_query(self, adaptive, num_bytes, latency, escalated=False):
+        """Record the cost of querying a token.
+
+        Parameters:
+          adaptive (bool): True if the token was queried on a reduced ontology list
+          num_bytes (int): Size of the results (in bytes of json)
+          latency (float): Time spent querying (in seconds)
+          escalated (bool, optional): True if an adaptive query had to be escalated. False by default.
+        """
+        with self.lock:
+            if adaptive:
+                self.adaptive_queries += 1
+                self.adaptive_bytes += num_bytes
+                self.adaptive_latency += latency
+                if escalated:
+                    self.escalations += 1
+            else:
+                self.full_queries += 1
+                self.full_bytes += num_bytes
+                self.full_latency += latency
+
+    def copy(self):
+        """Return a copy of the statistics as they are now."""
+        stats = Ontology_Stats()
+        with self.lock:
+            stats.top_counts = dict(self.top_counts)
+            for counter in COUNTERS:
+                setattr(stats, counter, getattr(self, counter))
+        return stats
+
+    def difference(self, base):
+        """Return what was recorded in these statistics since they were base (an earlier copy)."""
+        stats = self.copy()
+        for onto, count in base.top_counts.items():
+            stats.top_counts[onto] = stats.top_counts.get(onto, 0) - count
+            if stats.top_counts[onto] == 0:
+                del stats.top_counts[onto]
+        for counter in COUNTERS:
+            setattr(stats, counter, getattr(stats, counter) - getattr(base, counter))
+        return stats
+
+    def merge(self, other):
+        """Add the counts of other to these."""
+        with self.lock:
+            for onto, count in other.top_counts.items():
+                self.top_counts[onto] = self.top_counts.get(onto, 0) + count
+            for counter in COUNTERS:
+                setattr(self, counter, getattr(self, counter) + getattr(other, counter))
+
+    def high_yield(self, onto_list, coverage=0.95, min_samples=50):
+        """Return the smallest set of ontologies that provided at least 'coverage' of all top results.
+
+        Parameters:
+          onto_list (list): The full, ordered list of ontologies
+          coverage (float, optional): Fraction of top results to cover. 0.95 by default.
+          min_samples (int, optional): Minimum number of recorded top results before reducing the list. 50 by default.
+
+        Returns:
+          list: Ontologies from onto_list, in the same (priority) order. The full list if there are too few samples.
+        """
+        with self.lock:
+            top_counts = dict(self.top_counts)
+        total = sum(top_counts.get(onto, 0) for onto in onto_list)
+        if total < min_samples:
+            return onto_list
+
+        selected = set()
+        covered = 0
+        for onto in sorted(onto_list, key=lambda o: -top_counts.get(o, 0)):
+            if covered >= coverage * total:
+                break
+            selected.add(onto)
+            covered += top_counts.get(onto, 0)
+
+        return [onto for onto in onto_list if onto in selected]
+
+    def report(self):
+        """Return a summary of the statistics, including the estimated savings of adaptive mode.
+
+        Savings are estimated against the average cost of a query on the full ontology list.
+
+        Returns:
+          string: The report
+        """
+        lines = ["Top ranked results per ontology:"]
+        total = sum(self.top_counts.values())
+        for onto, count in sorted(self.top_counts.items(), key=lambda i: -i[1]):
+            lines.append("  "+onto+": "+str(count)+" ("+format(100.0 * count / total, ".1f")+"%)")
+
+        lines.append("Queries on full ontology list: "+str(self.full_queries))
+        lines.append("Queries on reduced ontology list: "+str(self.adaptive_queries)+" ("+str(self.escalations)+" escalated)")
+
+        if self.full_queries > 0 and self.adaptive_queries > 0:
+            saved_bytes = self.adaptive_queries * self.full_bytes / self.full_queries - self.adaptive_bytes
+            saved_latency = self.adaptive_queries * self.full_latency / self.full_queries - self.adaptive_latency
+            lines.append("Estimated bytes saved: "+str(int(saved_bytes))
+                         +" ("+format(saved_bytes / self.adaptive_queries, ".0f")+" per query)")
+            lines.append("Estimated latency saved: "+format(saved_latency, ".2f")+"s"
+                         +" ("+format(1000.0 * saved_latency / self.adaptive_queries, ".1f")+"ms per query)")
+
+        return "\n".join(lines)
+
+    def save(self, path):
+        """Save the statistics to a json file."""
+        with self.lock, open(path, "w") as f:
+            json.dump(self.__getstate__(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        """Load statistics saved with save(). Returns empty statistics if path does not exist.
+
+        Returns:
+          Ontology_Stats: The loaded statistics
+        """
+        stats = cls()
+        if os.path.exists(path):
+            with open(path) as f:
+                stats.__dict__.update(json.load(f))
+        return stats
+
+    def __getstate__(self):
+        # locks cannot be pickled (e.g. to send the statistics to a worker process)
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
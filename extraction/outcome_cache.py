@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A cache of the final ranked candidates of the NCBO_Token_Classifier, shared across documents.
+
+Row headers such as "Age", "Sex" or "Body mass index" appear in nearly every paper. With a
+Token_Outcome_Cache, the classifier stores the ranked candidates it found for a token in its
+context, and skips the annotator queries, WordNet expansion and ranking the next time it meets the
+same token in the same context (in any document). Unlike the annotation cache (see
+annotation_cache), which holds raw annotator responses, this holds the outcome of classification.
+
+Keys include everything the outcome depends on (see NCBO_Token_Classifier.outcome_key), including
+ncbo_ranking.RANKING_VERSION, so that outcomes cached by an older ranking are not reused.
+
+  NCBO_Token_Classifier(outcome_cache=Token_Outcome_Cache("outcomes.sqlite"))
+
+A Token_Outcome_Cache can be sent to worker processes: the database is opened again there, from its path.
+"""
+import itertools
+import json
+import sqlite3
+import threading
+
+from .ncbo_candidates import NCBO_Candidate
+
+class Token_Outcome_Cache:
+    """Ranked candidates per classification key, kept in memory, and optionally in an SQLite database.
+
+    Attributes:
+      path (string): Path of the database file. None if the cache is only kept in memory.
+      hits (int): Number of lookups that found an outcome
+      misses (int): Number of lookups that did not
+
+    """
+
+    def __init__(self, path=None):
+        """Instantiate a Token_Outcome_Cache.
+
+        Parameters:
+          path (string, optional): Path of the database file (created if needed). None (memory only) by default.
+        """
+        self.path = path
+        self.memory = {}
+        self.hits = 0
+        self.misses = 0
+        self.db = None
+        if path is not None:
+            self.lock = threading.Lock()
+            self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+            with self.lock:
+                self.db.execute("CREATE TABLE IF NOT EXISTS outcomes (key TEXT PRIMARY KEY, candidates TEXT)")
+                self.db.commit()
+
+    def get(self, key):
+        """Return the cached candidates for key (a new list of NCBO_Candidate), or None if there are none."""
+        rows = self.memory.get(key)
+        if rows is None and self.db is not None:
+            with self.lock:
+                row = self.db.execute("SELECT candidates FROM outcomes WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                rows = json.loads(row[0])
+                self.memory[key] = rows
+
+        if rows is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [NCBO_Candidate(*row) for row in rows]
+
+    def put(self, key, candidates):
+        """Cache the candidates (list of NCBO_Candidate) for key."""
+        rows = [[getattr(c, slot) for slot in NCBO_Candidate.__slots__] for c in candidates]
+        self.memory[key] = rows
+        if self.db is not None:
+            with self.lock:
+                self.db.execute("INSERT OR REPLACE INTO outcomes (key, candidates) VALUES (?, ?)",
+                                (key, json.dumps(rows, separators=(",", ":"))))
+                self.db.commit()
+
+    def entries_since(self, mark):
+        """Return the outcomes (key -> rows) cached in memory since the cache held mark outcomes (see merge)."""
+        return dict(itertools.islice(self.memory.items(), mark, None))
+
+    def merge(self, entries):
+        """Keep entries (e.g. cached by a worker process, see entries_since) in memory. They are already in the
+        database, if there is one."""
+        self.memory.update(entries)
+
+    def __getstate__(self):
+        # the database connection cannot be pickled, the copy opens it again from path
+        state = dict(self.__dict__)
+        state.pop("lock", None)
+        state["db"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.path is not None:
+            self.lock = threading.Lock()
+            self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+
+    def close(self):
+        """Close the database (if any)."""
+        if self.db is not None:
+            with self.lock:
+                self.db.close()
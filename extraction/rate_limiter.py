@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A rate limiter for the BioPortal REST API that is shared by every process on a host.
+
+When the pipeline runs in a process pool, per-process pacing (e.g. sleeping between requests)
+does not stop the pool as a whole from exceeding the BioPortal rate limit. Shared_Rate_Limiter
+keeps its state in a small file, guarded by a file lock, so that all processes draw from the same
+token bucket and the same limit on in-flight requests.
+
+Both the request rate and the number of in-flight requests are adjusted AIMD-style: they are
+increased additively while requests succeed, and decreased multiplicatively whenever BioPortal
+answers with a 429 (too many requests) or a server error (5xx), a request times out, or a request
+takes far longer than usual. Other failed requests leave the limits as they are.
+"""
+import itertools
+import json
+import os
+import tempfile
+import time
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+    import msvcrt
+
+DEFAULT_STATE_FILE = os.path.join(tempfile.gettempdir(), "ncbo_rate_limiter.json")
+
+class File_Lock:
+    """An exclusive lock on a file, shared between processes. Use as a context manager.
+    
+    Make a new File_Lock for every use, so that threads within a process also exclude each other.
+    """
+
+    def __init__(self, lock_file):
+        """Instantiate a File_Lock.
+
+        Parameters:
+          lock_file (string): Path of the file to lock. Created if it does not exist.
+        """
+        self.lock_file = lock_file
+        self.f = None
+
+    def __enter__(self):
+        self.f = open(self.lock_file, "a+")
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_EX)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_LOCK, 1)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if fcntl is not None:
+            fcntl.flock(self.f.fileno(), fcntl.LOCK_UN)
+        else:
+            self.f.seek(0)
+            msvcrt.locking(self.f.fileno(), msvcrt.LK_UNLCK, 1)
+        self.f.close()
+        self.f = None
+
+class Shared_Rate_Limiter:
+    """A file-backed token bucket with AIMD rate and concurrency control.
+
+    Call acquire() before sending a request, and release() with the outcome once it is done.
+
+    Attributes:
+      state_file (string): Path of the file the shared state is kept in
+      max_rate (float): Ceiling on requests per second, across all processes
+      min_rate (float): Floor on requests per second
+      max_concurrency (int): Ceiling on in-flight requests, across all processes
+      rate_step (float): Additive increase of the rate after each successful request
+      decrease (float): Multiplicative decrease of rate and concurrency on a 429, an overload or a latency spike
+      spike_factor (float): A request counts as a latency spike if it takes spike_factor times the average
+      stale_after (float): Seconds after which an unreleased request (e.g. from a killed process) is forgotten
+
+    """
+
+    def __init__(self, state_file=DEFAULT_STATE_FILE, max_rate=15.0, min_rate=0.5, max_concurrency=8,
+                 rate_step=0.1, decrease=0.5, spike_factor=4.0, stale_after=60.0):
+        """Instantiate a Shared_Rate_Limiter.
+
+        Processes that use the same state_file share the same limits. The first process to use a
+        state file determines its initial state; the other parameters should match across processes.
+
+        Parameters:
+          state_file (string, optional): Path of the shared state file. A file in the temp directory by default.
+          max_rate (float, optional): Ceiling on requests per second. 15 by default.
+          min_rate (float, optional): Floor on requests per second. 0.5 by default.
+          max_concurrency (int, optional): Ceiling on in-flight requests. 8 by default.
+          rate_step (float, optional): Additive rate increase per successful request. 0.1 by default.
+          decrease (float, optional): Multiplicative decrease on throttling. 0.5 by default.
+          spike_factor (float, optional): Latency spike threshold, relative to the average latency. 4 by default.
+          stale_after (float, optional): Seconds before an unreleased request is forgotten. 60 by default.
+        """
+        self.state_file = state_file
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.max_concurrency = max_concurrency
+        self.rate_step = rate_step
+        self.decrease = decrease
+        self.spike_factor = spike_factor
+        self.stale_after = stale_after
+
+        self.lock_file = state_file+".lock"
+        self.tickets = itertools.count()
+
+    def new_state(self, now):
+        """Return the initial shared state."""
+        return {"rate": self.max_rate/2, "tokens": 1.0, "last_refill": now, "concurrency": 1.0,
+                "in_flight": {}, "latency": None, "paused_until": 0.0}
+
+    def load_state(self, now):
+        """Load the shared state. Must be called while holding the lock."""
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # missing, or left half-written by a killed process
+            return self.new_state(now)
+
+    def save_state(self, state):
+        """Save the shared state. Must be called while holding the lock."""
+        with open(self.state_file, "w") as f:
+            json.dump(state, f)
+
+    def acquire(self):
+        """Block until a request may be sent.
+
+        Returns:
+          string: A ticket to pass to release() once the request is done
+        """
+        while True:
+            with File_Lock(self.lock_file):
+                now = time.time()
+                state = self.load_state(now)
+
+                # refill the bucket (at most one second's worth of burst)
+                state["tokens"] = min(max(state["rate"], 1.0),
+                                      state["tokens"] + (now - state["last_refill"]) * state["rate"])
+                state["last_refill"] = now
+
+                # forget requests whose process never released them
+                for ticket, started in list(state["in_flight"].items()):
+                    if now - started > self.stale_after:
+                        del state["in_flight"][ticket]
+
+                if now < state["paused_until"]:
+                    wait = state["paused_until"] - now
+                elif len(state["in_flight"]) >= int(state["concurrency"]):
+                    wait = 0.05
+                elif state["tokens"] < 1.0:
+                    wait = (1.0 - state["tokens"]) / state["rate"]
+                else:
+                    state["tokens"] -= 1.0
+                    ticket = str(os.getpid())+"-"+str(next(self.tickets))+"-"+repr(now)
+                    state["in_flight"][ticket] = now
+                    self.save_state(state)
+                    return ticket
+
+                self.save_state(state)
+            time.sleep(min(max(wait, 0.01), 1.0))
+
+    def release(self, ticket, throttled=False, retry_after=None, failure=None):
+        """Report the outcome of a request sent after acquire(), and adjust the limits accordingly.
+
+        Only successful requests count towards the average latency, and only they increase the limits.
+
+        Parameters:
+          ticket (string): The ticket returned by acquire()
+          throttled (bool, optional): True if the request was rejected for exceeding the rate limit (HTTP 429)
+          retry_after (float, optional): Seconds to pause all requests for, if the service asked for it
+          failure (string, optional): None if the request succeeded (or was throttled). "overload" if it failed in a
+            way that suggests the service is overloaded (a server error or a timeout), which decreases the limits.
+            "error" if it failed otherwise, which leaves the limits as they are.
+        """
+        with File_Lock(self.lock_file):
+            now = time.time()
+            state = self.load_state(now)
+            started = state["in_flight"].pop(ticket, None)
+
+            spike = False
+            if started is not None and not throttled and failure is None:
+                latency = now - started
+                if state["latency"] is None:
+                    state["latency"] = latency
+                else:
+                    spike = latency > self.spike_factor * state["latency"]
+                    state["latency"] = 0.9 * state["latency"] + 0.1 * latency
+
+            if throttled or spike or failure == "overload":
+                # multiplicative decrease
+                state["rate"] = max(self.min_rate, state["rate"] * self.decrease)
+                state["concurrency"] = max(1.0, state["concurrency"] * self.decrease)
+                state["tokens"] = min(state["tokens"], 0.0)
+                if throttled:
+                    pause = retry_after if retry_after is not None else 1.0 / state["rate"]
+                    state["paused_until"] = max(state["paused_until"], now + pause)
+            elif failure is None:
+                # additive increase (concurrency grows by about 1 per window of requests)
+                state["rate"] = min(self.max_rate, state["rate"] + self.rate_step)
+                state["concurrency"] = min(float(self.max_concurrency),
+                                           state["concurrency"] + 1.0 / state["concurrency"])
+
+            self.save_state(state)
+
+    def reset(self):
+        """Reset the shared state (e.g. after changing the limits)."""
+        with File_Lock(self.lock_file):
+            self.save_state(self.new_state(time.time()))
@@ -9,8 +9,33 @@ def add_table_to_graph(table, g):
     
     for cell in table["fields"]:
         if "column" in cell:
-            for f in cell["column"]:
-                f.translate(g)
+            add_column_to_graph(cell, g)
+
+# translate the preliminary KG of a column (cell["column"] of its header cell) into g
+# the triples of the column are kept in cell["graph"], so that they can be replaced later (see patch_graph)
+def add_column_to_graph(cell, g):
+    
+    column_graph = Graph()
+    for f in cell["column"]:
+        f.translate(column_graph)
+    cell["graph"] = column_graph
+    g += column_graph
+
+def patch_graph(g, table, columns):
+    ''' Replace the triples of the columns of table in g, after KG_Builder.update_cell.
+    
+        columns are the column header cells returned by update_cell.
+        g must have been built with convert_to_rdflib (or add_table_to_graph).
+    '''
+    
+    for cell in columns:
+        # remove the old triples of the column, unless another column has them too
+        others = [c["graph"] for c in table["fields"] if c is not cell and "graph" in c]
+        if "graph" in cell:
+            for triple in cell["graph"]:
+                if not any(triple in other for other in others):
+                    g.remove(triple)
+        add_column_to_graph(cell, g)
 
 def convert_to_rdflib(data):
     
@@ -5,6 +5,31 @@
 Used to perform the recursive assembly within Step 4 of the pipeline (KG assembly)
 """
 from .graph_framework import *
+from .tree_traversal import traverse, column_children
+
+class Row_Interpretation:
+    """The interpretation of a data cell, kept while its columnal children are interpreted (see Study_Subject_Interpreter.rec_interpret).
+
+    Attributes:
+      att_orig (list): The attributes inherited by the children of the cell
+      has_char (bool): True if the cell has a characteristic to fill
+      n (Node_Instance): The characteristic, or None
+      good_tokens (list): The tokens of the row header labelling the characteristic
+      header_cell (dict): The row header cell
+      tok (string): The last token looked at while interpreting the cell
+      att_to_return (list): The top-level features of the cell (and of the children interpreted so far)
+
+    """
+
+    def __init__(self, att_orig, has_char=False, n=None, good_tokens=None, header_cell=None, tok=None, att_to_return=None):
+        """Instantiate a Row_Interpretation (see class description for the parameters)."""
+        self.att_orig = att_orig
+        self.has_char = has_char
+        self.n = n
+        self.good_tokens = good_tokens
+        self.header_cell = header_cell
+        self.tok = tok
+        self.att_to_return = att_to_return
 
 # This interpreter just tries to match to the study subject template,
 # TODO in future, make more general
@@ -22,6 +47,8 @@ class Study_Subject_Interpreter (Interpreter):
     Attributes:
       kg_builder (kg_builder): A pointer to the interpreter's kg_builder
       base (Individual_Instance): The instance being built by this Interpreter
+      depends_on (list): The cells read while interpreting the column: its header, data cells and their row
+        headers (see KG_Builder.update_cell)
       
     """
     # All other attributes are considered private and subject to change
@@ -53,6 +80,7 @@ class Study_Subject_Interpreter (Interpreter):
         n.incomplete_triples.append((IRI_Node("sio:hasAttribute", None), Supertype_Constraint(IRI_Node("sco:PopulationSize", None))  ))
         
         self.base = n
+        self.depends_on = [cell]
                                  
             
         self.age_found = False
@@ -116,10 +144,10 @@ class Study_Subject_Interpreter (Interpreter):
         # mark anyway though
         cell["column"] = [self.base]+cell["column"]
                                     
-    # recurse through columnal children, but with specific attributes to fill
+    # interpret data cells and their columnal children, but with specific attributes to fill
     # return top-level attribute(s) of this cell
     def rec_interpret(self, data_cell, attributes):
-        """Recursive helper function for interpret.
+        """Interpret data_cell and its columnal children, depth first (with an explicit stack, see tree_traversal).
 
             Parameters:
               data_cell (dict): Cell to interpret.
@@ -128,10 +156,32 @@ class Study_Subject_Interpreter (Interpreter):
             Returns:
               list : List of features within this cell that have /not/ been subsumed
         """
+        return traverse(data_cell, pre=self.interpret_row, combine=self.combine_child, post=self.top_level_features,
+                        children=column_children, state=Row_Interpretation(attributes))
+    
+    # interpret this cell, before its children
+    def interpret_row(self, data_cell, depth, parent):
+        """Interpret data_cell, before its columnal children (see rec_interpret).
+
+            Parameters:
+              data_cell (dict): Cell to interpret.
+              depth (int): Depth of the cell below the cell rec_interpret started from
+              parent (Row_Interpretation): The interpretation of the columnal parent of the cell (its attributes are inherited)
+
+            Returns:
+              Row_Interpretation : The interpretation of this cell, for its children
+        """
+        
+        attributes = parent.att_orig[:]
+        # the last token looked at (see combine_child), and the characteristic (if has_char)
+        tok = None
+        n = None
         
         # first, interpret row header (in future this should be a specific thing)
         # TODO: not good to use indexing like this
         header_cell = data_cell["row"]["fields"][0] 
+        self.depends_on.append(data_cell)
+        self.depends_on.append(header_cell)
         
         # see if any features in the header cell match these
         cont_supertypes = [ Supertype_Constraint(IRI_Node("sco:CentralTendencyMeasure", None)), Supertype_Constraint(IRI_Node("sco:DispersionMeasure", None)) ]
@@ -228,35 +278,25 @@ class Study_Subject_Interpreter (Interpreter):
                     if supertype.is_supertype_of(a):
                         cat_att[i] = a
             
+            # the patterns found in data_cell when it was classified (see token_patterns)
+            data_patterns = set(m.name for m in data_cell["patterns"])
+            
             # check for ± symbol in data_cell
-            plus_or_minus = False
-            for (tok,_) in data_cell["tokens"]:
-                if "±" in tok:
-                    plus_or_minus = True
-                    break
+            plus_or_minus = "plus_minus" in data_patterns
                     
             # check for % symbol in data_cell
-            percent_symbol = False
-            for (tok,_) in data_cell["tokens"]:
-                if "%" in tok:
-                    percent_symbol = True
-                    break
+            percent_symbol = "percent" in data_patterns
                     
             # check for ( symbol in data_cell
             # supply default cat att if using continuous characteristics AND format is x (y)
             open_paren = False
             if cat_att[1] is None and cat_att[0] is None and def_cont_att[0] is not None and def_cont_att[1] is not None and not plus_or_minus and self.use_open_paren:
-                for (tok,_) in data_cell["tokens"]:
-                    if "(" in tok:
-                        #treat as a weaker version of %
-                        new_percent_node = Node_Instance([tok],data_cell)
-                        new_percent_node.triples.append( (IRI_Node("rdf:type", None), IRI_Node("sio:Percentage", None)) )
-                        new_percent_node.incomplete_triples.append( (IRI_Node("sio:hasValue", None), Literal_Node() ) )
-                        att_orig = attributes[:]
-                        cat_att[1] = self.default_cat_types[1]
-                        cat_att[0] = self.default_cat_types[0]
-                        open_paren = True
-                        break
+                if "open_paren" in data_patterns:
+                    #treat as a weaker version of %
+                    att_orig = attributes[:]
+                    cat_att[1] = self.default_cat_types[1]
+                    cat_att[0] = self.default_cat_types[0]
+                    open_paren = True
             
             is_cat_char = False
             # is new_cat_attr non-empty or does attributes contain anything categorical?
@@ -342,8 +382,16 @@ class Study_Subject_Interpreter (Interpreter):
                 else:
                     n.incomplete_triples.append((IRI_Node("rdf:type", None), c ))
 
-                # TODO TODAY: unit work
+                # the unit comes from the row header (e.g. "Age, years"), or else from the data cell itself (e.g. "5.2 mg/dL")
                 n.incomplete_triples.append((IRI_Node("sio:hasUnit", None), Supertype_Constraint(IRI_Node("sco:UnitOfMeasurement", None)) ))
+                unit = self.find_unit(header_cell)
+                if unit is not None:
+                    # the row header is shared by every column, so each characteristic gets its own copy
+                    unit = unit.duplicate(header_cell)
+                else:
+                    unit = self.find_unit(data_cell)
+                if unit is not None:
+                    n.try_fill(unit, len(n.incomplete_triples) - 1)
 
                 # lets just say 1 central statistical measure and 1 dispersion measure
                 n.incomplete_triples.append((IRI_Node("sio:hasAttribute", None), Supertype_Constraint(IRI_Node("sco:CentralTendencyMeasure", None)) ))
@@ -465,60 +513,78 @@ class Study_Subject_Interpreter (Interpreter):
             att_to_return = [n]
         # else: just return the measures that are already in att_to_return
         
-        # iterate thru kids
-        # assemble their returned values like voltron      
-        for child_cell in data_cell["col_children"]:                       
-            child_features = self.rec_interpret(child_cell, att_orig[:])
-            
-            # if this cell has a cont char to fill: (TODO not great name for that variable)
-            if has_char:
-                # do the child's features help with the adult?
-                # note that n may have "type <a sco:SubjectCharacteristic>", which could also be a problem if the child features are that
-                for f in child_features:
-                    filled_adult = False
-                    if f.get_type() is FeatureType.VALUE and not f.is_subsumed:
+        return Row_Interpretation(att_orig, has_char, n, good_tokens, header_cell, tok, att_to_return)
+    
+    # assemble the returned values of the kids like voltron
+    def combine_child(self, data_cell, context, child_features):
+        """Combine the top-level features of a columnal child of data_cell into its interpretation (see rec_interpret).
+
+            Parameters:
+              data_cell (dict): The cell being interpreted
+              context (Row_Interpretation): Its interpretation
+              child_features (list): Top-level features of the child
+        """
+        has_char = context.has_char
+        n = context.n
+        good_tokens = context.good_tokens
+        header_cell = context.header_cell
+        tok = context.tok
+        att_to_return = context.att_to_return
+        
+        # if this cell has a cont char to fill: (TODO not great name for that variable)
+        if has_char:
+            # do the child's features help with the adult?
+            # note that n may have "type <a sco:SubjectCharacteristic>", which could also be a problem if the child features are that
+            for f in child_features:
+                filled_adult = False
+                if f.get_type() is FeatureType.VALUE and not f.is_subsumed:
 
-                        # TODO eval child return type
+                    # TODO eval child return type
 
-                        # try to fill each triple
-                        for i,t in enumerate(n.incomplete_triples):
-                            if n.try_fill(f, i):
-                                filled_adult = True
-                                # TODO: mark f as subsumed, somehow
+                    # try to fill each triple
+                    for i,t in enumerate(n.incomplete_triples):
+                        if n.try_fill(f, i):
+                            filled_adult = True
+                            # TODO: mark f as subsumed, somehow
 
-                                # here, tok that has f is marked with f
-                                for (original_tok, features) in f.cell["tokens"]:
-                                        if tok is original_tok:
-                                            features.append(n)
-                                break
-                        # now add metadata/label:
-                        if isinstance(f,Node_Instance):
-                            # check for pre-existing label:
-                            no_label_found = True
-                            lb = " ".join(good_tokens)
-                            for triple in f.triples:
-                                    if triple[0].IRI_String is "rdfs:hasLabel":
-                                        no_label_found = False
-                                        # remove the old triple
-                                        f.triples.remove(triple)
-                                        # make new label
-                                        triple[1].value += ", "+lb
-                                        triple[1].matching += good_tokens
-                                        # re-add triple, so as to keep old matching as well as have new
-                                        f.triples.append((IRI_Node("rdfs:hasLabel", None),  triple[1]))
-                                        # TODO: Update the tokens in this cell to have relevent matching/feature
-                                        break
-                            if no_label_found:
-                                f.triples.append((IRI_Node("rdfs:hasLabel", None), Free_Value(good_tokens,header_cell,lb)))
-                                    
-                                    
-                    # if this feature could not fill adult, just append it as an additional TLF (top-level-feature)
-                    if not filled_adult:
-                        att_to_return.append(f)
-                                    
-            # if this cell has nothing to fill:
-            else:
-                att_to_return += child_features
+                            # here, tok that has f is marked with f
+                            for (original_tok, features) in f.cell["tokens"]:
+                                    if tok is original_tok:
+                                        features.append(n)
+                            break
+                    # now add metadata/label:
+                    if isinstance(f,Node_Instance):
+                        # check for pre-existing label:
+                        no_label_found = True
+                        lb = " ".join(good_tokens)
+                        for triple in f.triples:
+                                if triple[0].IRI_String is "rdfs:hasLabel":
+                                    no_label_found = False
+                                    # remove the old triple
+                                    f.triples.remove(triple)
+                                    # make new label
+                                    triple[1].value += ", "+lb
+                                    triple[1].matching += good_tokens
+                                    # re-add triple, so as to keep old matching as well as have new
+                                    f.triples.append((IRI_Node("rdfs:hasLabel", None),  triple[1]))
+                                    # TODO: Update the tokens in this cell to have relevent matching/feature
+                                    break
+                        if no_label_found:
+                            f.triples.append((IRI_Node("rdfs:hasLabel", None), Free_Value(good_tokens,header_cell,lb)))
+                                
+                                
+                # if this feature could not fill adult, just append it as an additional TLF (top-level-feature)
+                if not filled_adult:
+                    att_to_return.append(f)
+                                
+        # if this cell has nothing to fill:
+        else:
+            att_to_return += child_features
+    
+    # return top-level features of this cell, after its children
+    def top_level_features(self, data_cell, context, results):
+        """Return the top-level features of data_cell and its columnal children (see rec_interpret)."""
+        att_to_return = context.att_to_return
         
         # return top-level (non-subsumed) features of this cell
         # this should be done with a dedicated data structure for tokens:
@@ -533,6 +599,15 @@ class Study_Subject_Interpreter (Interpreter):
         # now att_to_return should have top-level features from this cell and its children
         return att_to_return
     
+    def find_unit(self, cell):
+        """Return the first unit of measurement feature (see Unit_Token_Classifier) in cell that is not subsumed, or None."""
+        unit_type = Supertype_Constraint(IRI_Node("sco:UnitOfMeasurement", None))
+        for (tok, features) in cell["tokens"]:
+            for f in features:
+                if not f.is_subsumed and unit_type.is_supertype_of(f):
+                    return f
+        return None
+    
     def get_arm_name(self, cell):
         """Generate a name for the study arm based on this cell
 
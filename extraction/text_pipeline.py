@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""The text normalization and tokenization of cells (Step 3 of the pipeline), precompiled once.
+
+Text_Pipeline does what KG_Builder.annotate_features used to do for every cell, with everything
+compiled when the pipeline is made:
+  normalize   one str.translate (· to ., − to -), then one regex pass that unescapes the html
+              entities (&amp; &lt; &gt;) and marks ranges (a "-" directly following a digit becomes "−")
+  tokenize    one compiled regex (numbers may have one space on either side of the dot, every other
+              punctuation character is its own token)
+  merge       multi-word keywords ("standard deviation") are joined with "_", longest match first,
+              using a token trie built once (the same result as nltk's MWETokenizer)
+
+A micro-benchmark compares the pipeline with building the tokenizers for every cell:
+
+  python -m extraction.text_pipeline [--cells 20000] [--vocabulary concept_vocabulary.json]
+"""
+import argparse
+import re
+import time
+from xml.sax.saxutils import unescape
+
+import nltk
+from nltk.tokenize import MWETokenizer
+
+from .value_scanner import mark_ranges
+from .classifiers import load_concept_vocabulary, DEFAULT_VOCABULARY_FILE
+
+# single characters normalized before tokenizing
+NORMALIZED_CHARACTERS = str.maketrans({'·': '.', '−': '-'})
+
+# html entities (see xml.sax.saxutils.unescape) and range dashes (see value_scanner.mark_ranges)
+NORMALIZE_PATTERN = re.compile(r'&(amp|lt|gt);|(?<=[0-9])-')
+ENTITIES = {"amp": "&", "lt": "<", "gt": ">"}
+
+# numbers (one space allowed around the dot), words, single punctuation characters
+TOKEN_PATTERN = re.compile(r'-?\s?\d*\s?\.\s?\d+|-?\s?\d*\.?\d+|\w+|[^\w\s]')
+
+# marks the end of a multi-word expression in the trie
+_END = None
+
+# replacement of a NORMALIZE_PATTERN match
+def _normalize_match(m):
+    if m.group(1) is not None:
+        return ENTITIES[m.group(1)]
+    return '−'
+
+class Text_Pipeline:
+    """Normalizes and tokenizes the text of cells (see module description).
+
+    Attributes:
+      trie (dict): Token -> subtrie, for the multi-word expressions (a subtrie has the key None at the end of an expression)
+      separator (string): Joins the tokens of a multi-word expression
+
+    """
+
+    def __init__(self, mwes=(), separator="_"):
+        """Instantiate a Text_Pipeline.
+
+        Parameters:
+          mwes (iterable, optional): Multi-word expressions to merge, each a sequence of tokens. Empty by default.
+          separator (string, optional): Joins the tokens of a multi-word expression. "_" by default.
+        """
+        self.trie = {}
+        self.separator = separator
+        for mwe in mwes:
+            node = self.trie
+            for token in mwe:
+                node = node.setdefault(token, {})
+            node[_END] = True
+
+    def normalize(self, text):
+        """Return the normalized text of a cell."""
+        return NORMALIZE_PATTERN.sub(_normalize_match, text.translate(NORMALIZED_CHARACTERS))
+
+    def tokenize(self, text):
+        """Split normalized text into tokens (numbers keep their spaces, see module description)."""
+        return TOKEN_PATTERN.findall(text)
+
+    def merge(self, tokens):
+        """Join the multi-word expressions in tokens, longest match first."""
+        if len(self.trie) == 0:
+            return tokens
+        merged = []
+        i = 0
+        n = len(tokens)
+        while i < n:
+            node = self.trie.get(tokens[i])
+            end = -1
+            j = i
+            while node is not None:
+                j += 1
+                if _END in node:
+                    end = j
+                if j == n:
+                    break
+                node = node.get(tokens[j])
+            if end > -1:
+                merged.append(self.separator.join(tokens[i:end]))
+                i = end
+            else:
+                merged.append(tokens[i])
+                i += 1
+        return merged
+
+    def process(self, text):
+        """Normalize, tokenize and merge the text of a cell.
+
+        Returns:
+          tuple: (normalized text, list of tokens, without spaces)
+        """
+        text = self.normalize(text)
+        tokens = self.merge(self.tokenize(text))
+        return text, [token.replace(" ", "") for token in tokens]
+
+SAMPLE_CELLS = [
+    "Age, years", "45.2 ± 3.1", "Body mass index (BMI), kg/m2", "27.1 · 4.2", "Sex, n (%)", "20 (40)",
+    "Systolic blood pressure, mmHg", "128 (120-135)", "Diabetes, Median [IQR]", "5 [3−7]",
+    "HbA1c &lt; 7.0 %, n (%)", "Mean standard deviation", "-0 .6 to 1. 2", "Men &amp; women, 95% CI",
+]
+
+def per_cell(text, mwes):
+    """Normalize and tokenize text by building the tokenizers for the cell (as annotate_features used to)."""
+    tokenizer = nltk.tokenize.RegexpTokenizer(r'-?\s?\d*\s?\.\s?\d+|-?\s?\d*\.?\d+|\w+|[^\w\s]')
+    text = mark_ranges(unescape(text).replace('·', '.').replace('−', '-'))
+    tokens = MWETokenizer(mwes).tokenize(tokenizer.tokenize(text))
+    return text, [token.replace(" ", "") for token in tokens]
+
+def benchmark(texts, mwes):
+    """Time per_cell and a Text_Pipeline on texts, and check that they agree.
+
+    Returns:
+      tuple: (seconds for per_cell, seconds for the pipeline, including building it)
+    """
+    start = time.perf_counter()
+    expected = [per_cell(text, mwes) for text in texts]
+    per_cell_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    pipeline = Text_Pipeline(mwes)
+    found = [pipeline.process(text) for text in texts]
+    pipeline_time = time.perf_counter() - start
+
+    if found != expected:
+        raise AssertionError("Text_Pipeline and per-cell tokenization disagree")
+    return per_cell_time, pipeline_time
+
+def main():
+    """Run the micro-benchmark with the options given in sys.argv."""
+    parser = argparse.ArgumentParser(description="Benchmarks the precompiled text pipeline against per-cell tokenizers.")
+
+    parser.add_argument('--cells', type=int, default=20000, help='Number of cells to process (default 20000)')
+    parser.add_argument('--vocabulary', default=DEFAULT_VOCABULARY_FILE, help='Concept vocabulary to take the multi-word expressions from')
+
+    args = parser.parse_args()
+
+    keywords, mwes = load_concept_vocabulary(args.vocabulary)
+    texts = [SAMPLE_CELLS[i % len(SAMPLE_CELLS)] for i in range(args.cells)]
+    per_cell_time, pipeline_time = benchmark(texts, mwes)
+
+    print("Cells: "+str(args.cells)+", multi-word expressions: "+str(len(mwes)))
+    print("Per-cell tokenizers: "+format(per_cell_time, ".3f")+"s ("+format(1e6 * per_cell_time / args.cells, ".1f")+"us per cell)")
+    print("Text_Pipeline:       "+format(pipeline_time, ".3f")+"s ("+format(1e6 * pipeline_time / args.cells, ".1f")+"us per cell)")
+    print("Speedup: "+format(per_cell_time / pipeline_time, ".1f")+"x\n")
+
+if __name__ == "__main__":
+
+    main()
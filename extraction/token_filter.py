@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A filter deciding which tokens are worth sending to the NCBO Annotator.
+
+Every token the NCBO_Token_Classifier annotates costs a WordNet expansion, an annotator request for
+its WordNet terms, and a share of the request for its cell's context (one per cell, often prefetched,
+see NCBO_Token_Classifier.prefetch). Many tokens of a table can never yield a useful concept: connectives ("vs", "and"), footnote
+markers ("a", "†"), ordinals ("2nd", "third"), and words such as "total" or "value". Token_Filter
+rejects a token when:
+  - it is a stopword (DEFAULT_STOPWORDS, configurable)
+  - it is shorter than min_length
+  - less than min_alpha_fraction of its characters are letters
+  - it is an ordinal number ("1st", "third")
+  - corpus statistics show that it was annotated at least min_samples times before, and yielded a
+    concept less than min_yield of the time
+
+The statistics are kept per (uppercase) token and can be saved, so that they carry over between runs:
+
+  NCBO_Token_Classifier(token_filter=Token_Filter.load("token_stats.json"))
+"""
+import json
+import os
+import re
+import threading
+
+DEFAULT_STOPWORDS = frozenset([
+    "AN", "AND", "OR", "OF", "NO", "NOT", "THE", "IN", "ON", "AT", "BY", "FOR", "TO", "FROM", "WITH",
+    "WITHOUT", "VS", "VERSUS", "PER", "ALL", "OTHER", "OTHERS", "TOTAL", "VALUE", "VALUES", "NA",
+    "NR", "NS", "ND", "YES", "ONLY", "ANY", "NONE", "EACH", "AFTER", "BEFORE", "DURING", "AMONG", "BETWEEN",
+])
+
+ORDINAL = re.compile(r'\d+(ST|ND|RD|TH)|FIRST|SECOND|THIRD|FOURTH|FIFTH|SIXTH|SEVENTH|EIGHTH|NINTH|TENTH')
+
+class Token_Filter:
+    """Decides whether a token is worth annotating (see module description).
+
+    Attributes:
+      stopwords (set): Uppercase tokens that are never annotated
+      min_length (int): Minimum number of characters of an annotated token
+      min_alpha_fraction (float): Minimum fraction of letters among the characters of an annotated token
+      min_samples (int): Number of times a token must have been annotated before its yield is used
+      min_yield (float): Minimum fraction of annotations of a token that found a concept
+      counts (dict): Uppercase token -> [number of times annotated, number of times a concept was found]
+      lock (threading.Lock): Held while counts are updated (a filter can be shared between threads)
+
+    """
+
+    def __init__(self, stopwords=DEFAULT_STOPWORDS, min_length=2, min_alpha_fraction=0.5, min_samples=20, min_yield=0.05):
+        """Instantiate a Token_Filter (see class description for the parameters)."""
+        self.stopwords = set(word.upper() for word in stopwords)
+        self.min_length = min_length
+        self.min_alpha_fraction = min_alpha_fraction
+        self.min_samples = min_samples
+        self.min_yield = min_yield
+        self.counts = {}
+        self.lock = threading.Lock()
+
+    def informative(self, token):
+        """Return True if token is worth annotating, False otherwise."""
+        upper = token.upper()
+        if upper in self.stopwords or len(token) < self.min_length:
+            return False
+        if sum(1 for c in token if c.isalpha()) < self.min_alpha_fraction * len(token):
+            return False
+        if ORDINAL.fullmatch(upper):
+            return False
+
+        count = self.counts.get(upper)
+        if count is not None and count[0] >= self.min_samples and count[1] < self.min_yield * count[0]:
+            return False
+        return True
+
+    def record(self, token, found):
+        """Record that token was annotated, and whether a concept was found (bool)."""
+        with self.lock:
+            count = self.counts.setdefault(token.upper(), [0, 0])
+            count[0] += 1
+            if found:
+                count[1] += 1
+
+    def snapshot(self):
+        """Return a copy of the counts as they are now (see counts_since)."""
+        with self.lock:
+            return {token: tuple(count) for token, count in self.counts.items()}
+
+    def counts_since(self, snapshot):
+        """Return the counts recorded since snapshot, for the tokens recorded since (see merge_counts)."""
+        with self.lock:
+            return {token: [count[0] - snapshot.get(token, (0, 0))[0], count[1] - snapshot.get(token, (0, 0))[1]]
+                    for token, count in self.counts.items() if tuple(count) != snapshot.get(token)}
+
+    def merge_counts(self, counts):
+        """Add counts (e.g. recorded by a worker process, see counts_since) to these."""
+        with self.lock:
+            for token, (annotated, found) in counts.items():
+                count = self.counts.setdefault(token, [0, 0])
+                count[0] += annotated
+                count[1] += found
+
+    def save(self, path):
+        """Save the corpus statistics to a json file."""
+        with self.lock, open(path, "w") as f:
+            json.dump(self.counts, f)
+
+    @classmethod
+    def load(cls, path, **options):
+        """Load corpus statistics saved with save(). Starts without statistics if path does not exist.
+
+        Parameters:
+          path (string): The json file
+          options: Any other parameter of Token_Filter
+
+        Returns:
+          Token_Filter: The filter
+        """
+        token_filter = cls(**options)
+        if os.path.exists(path):
+            with open(path) as f:
+                token_filter.counts = json.load(f)
+        return token_filter
+
+    def __getstate__(self):
+        # locks cannot be pickled (e.g. to send the filter to a worker process)
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A pattern engine for multi-token constructs within a cell (e.g. "mean ± SD", "n (%)", "median [IQR]").
+
+Patterns are declared as a name and a list of elements, one element per token:
+  "VALUE"               a token with a Free_Value feature (a number)
+  "sio:Mean"            a token with a feature of this type (any element containing a ":" is an IRI)
+  "±"                   a token with this text (matched case-insensitively)
+  ["(", "["]            any one of the alternatives
+  "%?"                  an element followed by "?" is optional (a lone "?" is matched as text)
+
+All patterns are compiled together into one nondeterministic finite automaton (Token_Pattern_Automaton),
+which is run over the tokens of a cell in a single pass, and reports every match of every pattern.
+"""
+from .graph_framework import *
+
+# (name, elements), see above
+DEFAULT_PATTERNS = [
+    ("value_plus_minus", ["VALUE", "±", "VALUE"]),                                  # 40.3 ± 2.1
+    ("value_paren_percent", ["VALUE", "(", "VALUE", "%?", ")"]),                    # 12 (40%)
+    ("value_interval", ["VALUE", ["(", "["], "VALUE", ["-", "−", "–", ",", "to"], "VALUE", [")", "]"]]), # 31 [25-40]
+    ("value_range", ["VALUE", ["-", "−", "–", "to"], "VALUE"]),                    # 25−40
+    ("confidence_level", ["VALUE", "%", "sco:ConfidenceInterval"]),                 # 95% CI
+    # single token markers, used by the Study_Subject_Interpreter
+    ("plus_minus", ["±"]),
+    ("percent", ["%"]),
+    ("open_paren", ["("]),
+]
+
+class Pattern_Match:
+    """A match of a pattern over the tokens of a cell.
+
+    Attributes:
+      name (string): The name of the pattern
+      start (int): Index of the first matched token in cell["tokens"]
+      end (int): Index after the last matched token
+      matching (list of strings): The matched tokens
+
+    """
+
+    __slots__ = ("name", "start", "end", "matching")
+
+    def __init__(self, name, start, end, matching):
+        """Instantiate a Pattern_Match (see class description for the parameters)."""
+        self.name = name
+        self.start = start
+        self.end = end
+        self.matching = matching
+
+    def to_string(self):
+        """Return a string representing this match."""
+        return self.name+"["+str(self.start)+":"+str(self.end)+"] "+" ".join(self.matching)
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __str__(self):
+        return self.to_string()
+
+class Token_Pattern_Automaton:
+    """A set of token patterns, compiled into a nondeterministic finite automaton.
+
+    States are numbered; state 0 is the start state. Each state has transitions on symbols (the
+    strings of the pattern elements), and may accept one or more patterns.
+
+    Attributes:
+      transitions (list): State -> dict of symbol -> list of next states
+      accepts (list): State -> list of names of the patterns matched on reaching it
+
+    """
+
+    def __init__(self, patterns=DEFAULT_PATTERNS):
+        """Compile patterns into an automaton.
+
+        Parameters:
+          patterns (list, optional): List of (name, elements) tuples (see module description). DEFAULT_PATTERNS by default.
+        """
+        self.transitions = [{}]
+        self.accepts = [[]]
+
+        for name, elements in patterns:
+            if len(elements) == 0:
+                raise ValueError("Pattern "+name+" is empty")
+
+            # states from which the next element may be matched (more than one after optional elements,
+            # which are skipped by also adding the next element's transitions to the states before them)
+            current = [0]
+            for element in elements:
+                alternatives, optional = self.parse_element(element)
+
+                state = self.new_state()
+                for s in current:
+                    for symbol in alternatives:
+                        self.transitions[s].setdefault(symbol, []).append(state)
+
+                if optional:
+                    current = current + [state]
+                else:
+                    current = [state]
+
+            if 0 in current:
+                raise ValueError("Pattern "+name+" may match no tokens")
+            for s in current:
+                self.accepts[s].append(name)
+
+    def new_state(self):
+        """Add a new state, and return its number."""
+        self.transitions.append({})
+        self.accepts.append([])
+        return len(self.transitions) - 1
+
+    def parse_element(self, element):
+        """Return the (casefolded) symbols of a pattern element, and whether it is optional."""
+        optional = False
+        if isinstance(element, str):
+            if len(element) > 1 and element.endswith("?"):
+                optional = True
+                element = element[:-1]
+            element = [element]
+        return [symbol if symbol == "VALUE" or ":" in symbol else symbol.casefold() for symbol in element], optional
+
+    def token_symbols(self, token, features):
+        """Return the symbols a token (with its features) matches."""
+        symbols = [token.casefold()]
+        for f in features:
+            if isinstance(f, Free_Value):
+                symbols.append("VALUE")
+            elif isinstance(f, Node_Instance):
+                for (predicate, obj) in f.triples:
+                    if predicate.IRI_String == "rdf:type" and isinstance(obj, IRI_Node):
+                        symbols.append(obj.IRI_String)
+        return symbols
+
+    def match(self, tokens):
+        """Find every match of every pattern, in a single pass over tokens.
+
+        Parameters:
+          tokens (list): List of (token, features) tuples, as in cell["tokens"]
+
+        Returns:
+          list: List of Pattern_Match, ordered by end, then longest first
+        """
+        matches = []
+        # (state, index of the token the match started at)
+        active = []
+        for i, (token, features) in enumerate(tokens):
+            symbols = self.token_symbols(token, features)
+
+            next_active = []
+            seen = set()
+            # a new match may start at every token
+            for state, start in active + [(0, i)]:
+                transitions = self.transitions[state]
+                for symbol in symbols:
+                    for next_state in transitions.get(symbol, ()):
+                        if (next_state, start) not in seen:
+                            seen.add((next_state, start))
+                            next_active.append((next_state, start))
+
+            for state, start in sorted(next_active, key=lambda a: -a[1]):
+                for name in self.accepts[state]:
+                    matches.append(Pattern_Match(name, start, i + 1, [t for (t, f) in tokens[start:i + 1]]))
+            active = next_active
+
+        return matches
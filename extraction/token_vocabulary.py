@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A per-document vocabulary of tokens, and of the features of cell-independent classifiers.
+
+Tables repeat the same few tokens ("%", "n", "SD", "Mean"...) in nearly every cell. The KG_Builder
+keeps one Token_Vocabulary per document, which:
+  - interns token strings, so that each distinct token is kept once
+  - classifies each distinct token only once with every classifier whose features depend on the token
+    alone (Token_Classifier.cell_independent, e.g. the Concept_Token_Classifier), keeping the features
+    as templates
+
+Templates are never handed out (nor modified). Each occurrence of a token gets an instance of the
+templates (see instantiate): a shallow copy with the occurrence's cell and its own lists, so that
+interpreters can fill it, while the IRI nodes and constraints of the template are shared.
+
+Instances are made eagerly, when the token is classified, rather than on first modification: a
+feature is an individual of the KG, not just a description of its token. Its cell gives the row,
+column and table of its node, translate gives it its own blank node, the cell interpreters fill its
+triples and matching and mark it subsumed, and other features refer to it by identity (as the
+object of their triples). Every occurrence therefore needs an object of its own from the start;
+what the vocabulary saves is classifying the token again, and copying the shared parts.
+"""
+import copy
+
+def instantiate(template, cell):
+    """Return a new instance of a feature template, living in cell.
+
+    The instance has its own copies of the template's lists (matching, triples, incomplete triples...),
+    and shares everything else with it.
+    """
+    feature = copy.copy(template)
+    feature.cell = cell
+    for name, value in vars(template).items():
+        if isinstance(value, list):
+            setattr(feature, name, value[:])
+    return feature
+
+class Token_Vocabulary:
+    """The distinct tokens of a document, and the feature templates of each (see module description).
+
+    Attributes:
+      tokens (dict): Token -> its interned string
+      templates (dict): (classifier, token) -> tuple of feature templates
+
+    """
+
+    def __init__(self):
+        """Instantiate an empty Token_Vocabulary."""
+        self.tokens = {}
+        self.templates = {}
+
+    def intern(self, token):
+        """Return the interned string of token."""
+        return self.tokens.setdefault(token, token)
+
+    def classify(self, classifier, token, cell, context=None):
+        """Classify token with a cell-independent classifier, using the templates of earlier occurrences if any.
+
+        Parameters:
+          classifier (Token_Classifier): A classifier with cell_independent set
+          token (string): The token to classify
+          cell (dict): The cell this occurrence of the token is found in
+          context (dict, optional): Features already assigned to this token (see KG_Builder.classify_token). None by default.
+
+        Returns:
+          list : List of features (instances of the templates), living in cell
+        """
+        key = (classifier, token)
+        templates = self.templates.get(key)
+        if templates is None:
+            templates = tuple(classifier.classify(token, None, context))
+            self.templates[key] = templates
+        else:
+            classifier.cache_hits += 1
+        return [instantiate(template, cell) for template in templates]
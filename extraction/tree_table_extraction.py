@@ -16,6 +16,11 @@ import warnings
 import argparse
 import os
 
+try:
+    from .tree_traversal import traverse
+except ImportError: # run as a script (see batch_extract), or imported by gt_generator
+    from tree_traversal import traverse
+
 # follows x.y.z format
 # x refers to stage in process (e.g. stage 0 refers to tree table json)
 # y refers to overall structure version (should be incremented if structure is changed in a major way)
@@ -196,7 +201,7 @@ def make_tree_tables(extraction):
   return new_data
 
 def get_col_widths(table, tab_width=2, tab_level=0, col_padding=0):
-  """Recursively get the list of max number of characters of each column in table.
+  """Get the list of max number of characters of each column in table, and its nested tables.
 
   Parameters:
     table (dict): The table to check (has "fields" and "records" properties) 
@@ -207,21 +212,22 @@ def get_col_widths(table, tab_width=2, tab_level=0, col_padding=0):
   Returns:
     list: List of ints corresponding to the maximum number of characters per table column.
   """
-  col_widths = []
-  for cell in table["fields"]:
-      col_widths.append(len(cell["text"])+col_padding)
-  col_widths[0] += tab_width * tab_level
-  
-  # take max of this col_widths or col_widths returned by recursing on children
-  for row in table["records"]:
-      child_widths = get_col_widths(row, tab_width, tab_level + 1, col_padding)
+  def widths(table, depth, state):
+      col_widths = []
+      for cell in table["fields"]:
+          col_widths.append(len(cell["text"])+col_padding)
+      col_widths[0] += tab_width * (tab_level + depth)
+      return col_widths
+  
+  # take max of this col_widths or col_widths of the children
+  def max_widths(table, col_widths, child_widths):
       for i in range(0,len(col_widths)):
           col_widths[i] = max(col_widths[i],child_widths[i])
   
-  return col_widths
+  return traverse(table, pre=widths, combine=max_widths, post=lambda table, col_widths, results: col_widths)
 
 def print_table(table, col_widths, write_file, layer=0):
-  """Recursively print a single table to write_file.
+  """Print a single table, and its nested tables, to write_file.
   
   Parameters:
     table (dict): The table to print (has "fields" and "records" properties)
@@ -232,39 +238,47 @@ def print_table(table, col_widths, write_file, layer=0):
   # Not a parameter as tab_width is always 2 when " |" is used for tabs.
   tab_width = 2
   
-  # Subtract tab width from the first column of a table of any layer. Not multiplied as
-  # col_widths is provided as a parameter when recursing.
-  num_cols = len(col_widths)
-  col_widths = copy.copy(col_widths)
-  if layer > 0: col_widths[0] -= tab_width
-  
-  # horiz_line is reused several times when printing a line, with box drawing chars replaced
-  horiz_line = "│ "*layer+ "┌"
-  for i,col in enumerate(col_widths):
-      horiz_line+="─"*(col_widths[i])
-      if i < len(col_widths)-1:
-          if layer > 0: horiz_line+="┼"
-          else: horiz_line+="┬"
-      else:
-          if layer > 0: horiz_line+="┤\n"
-          else: horiz_line+="┐\n"
-  write_file.write(horiz_line)
-
-  # row_format is used whenever cells are printed
-  row_format = "│"+" │"*layer
-  for i in range(0,num_cols):
-      row_format += "{"+str(i)+"[text]:>"+str(col_widths[i])+"}│"
-  row_format = row_format.replace('>','<',1)
-
-  write_file.write(row_format.format(*table["fields"])+"\n")
-  
-  # recurse and print any children this table might have
-  if len(table["records"]) > 0:
-      write_file.write(horiz_line.replace('┐','┤').replace('┌','├').replace('┬','┼'))
-      for subtable in table["records"]:
-          print_table(subtable, col_widths, write_file, layer+1)
-
-  write_file.write(horiz_line.replace('┐','┘').replace('┌','└').replace('┬','┴'))
+  # print the top line and the cells of a table, returns (col_widths for its children, horiz_line)
+  def print_top(table, depth, state):
+      col_widths = state[0]
+      layer = state[1] + depth
+      
+      # Subtract tab width from the first column of a table of any layer. Not multiplied as
+      # col_widths is passed on to the children.
+      num_cols = len(col_widths)
+      col_widths = copy.copy(col_widths)
+      if layer > 0: col_widths[0] -= tab_width
+      
+      # horiz_line is reused several times when printing a line, with box drawing chars replaced
+      horiz_line = "│ "*layer+ "┌"
+      for i,col in enumerate(col_widths):
+          horiz_line+="─"*(col_widths[i])
+          if i < len(col_widths)-1:
+              if layer > 0: horiz_line+="┼"
+              else: horiz_line+="┬"
+          else:
+              if layer > 0: horiz_line+="┤\n"
+              else: horiz_line+="┐\n"
+      write_file.write(horiz_line)
+      
+      # row_format is used whenever cells are printed
+      row_format = "│"+" │"*layer
+      for i in range(0,num_cols):
+          row_format += "{"+str(i)+"[text]:>"+str(col_widths[i])+"}│"
+      row_format = row_format.replace('>','<',1)
+      
+      write_file.write(row_format.format(*table["fields"])+"\n")
+      
+      # the children this table might have are printed next
+      if len(table["records"]) > 0:
+          write_file.write(horiz_line.replace('┐','┤').replace('┌','├').replace('┬','┼'))
+      
+      return (col_widths, state[1], horiz_line)
+  
+  def print_bottom(table, context, results):
+      write_file.write(context[2].replace('┐','┘').replace('┌','└').replace('┬','┴'))
+  
+  traverse(table, pre=print_top, post=print_bottom, state=(col_widths, layer))
 
 def print_tree_tables(tree_tables, filename):
   """Print the tree tables in a plaintext visualization.
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Depth-first traversal of tree tables with an explicit stack instead of recursion.
+
+Tree tables nest a table (row) in the "records" of its parent, and a cell in the "col_children" of the
+cell above it. Passes over them used to recurse once per level, so a deeply nested table could exceed
+the recursion limit, and every level paid for a Python frame. Two traversals replace the recursion:
+  preorder    yields (node, depth) for every node, parents before children
+  traverse    calls hooks around every node, and accumulates the results of its children:
+                pre(node, depth, state)            before the children, returns the node's context,
+                                                   which its children receive as their state
+                combine(node, context, result)     after each child, with the child's result
+                post(node, context, results)       after the children, returns the node's result
+                                                   (results: the results of its children, in order)
+
+Both take the children of a node from children (the subtables of a table by default, column_children
+for the cells of a column).
+
+pickle also recurses once per level. flatten_table turns a table into a flat list of rows (and the
+index of the parent of each), which nest_table turns back into a table, e.g. to send a deeply nested
+table to another process.
+
+A micro-benchmark compares recursion with traverse on a nested table, and times the other passes that
+run on every document (abbreviations, annotator contexts):
+
+  python -m extraction.tree_traversal [--rows 10000] [--depth 2000]
+"""
+import argparse
+import io
+import sys
+import time
+
+def subtables(table):
+    """Return the children of a table (row) in the tree table structure."""
+    return table["records"]
+
+def column_children(cell):
+    """Return the children of a cell in its column (see KG_Builder.parse_cell)."""
+    return cell["col_children"]
+
+def preorder(root, children=subtables):
+    """Yield (node, depth) for root and every node under it, depth first, parents before children.
+
+    The children of a node are only looked up once the node has been yielded.
+
+    Parameters:
+      root: The node to start from (depth 0)
+      children (function, optional): Node -> list of its children. subtables by default.
+    """
+    stack = [(root, 0)]
+    while stack:
+        node, depth = stack.pop()
+        yield node, depth
+        depth += 1
+        for child in reversed(children(node)):
+            stack.append((child, depth))
+
+def traverse(root, pre=None, post=None, combine=None, children=subtables, state=None):
+    """Traverse root and every node under it, depth first, calling the hooks around each node (see module description).
+
+    Parameters:
+      root: The node to start from (depth 0)
+      pre (function, optional): (node, depth, state) -> context of the node. By default, the context is the state.
+      post (function, optional): (node, context, results) -> result of the node. By default, the result is None.
+      combine (function, optional): (node, context, result of a child), called as each child is done. None by default.
+      children (function, optional): Node -> list of its children, looked up after pre. subtables by default.
+      state (optional): The state of root. None by default.
+
+    Returns:
+      The result of root
+    """
+    context = state if pre is None else pre(root, 0, state)
+    # frame: [node, context, children, index of the next child, results of the children]
+    stack = [[root, context, children(root), 0, []]]
+    while True:
+        frame = stack[-1]
+        i = frame[3]
+        if i < len(frame[2]):
+            frame[3] = i + 1
+            child = frame[2][i]
+            context = frame[1] if pre is None else pre(child, len(stack), frame[1])
+            stack.append([child, context, children(child), 0, []])
+            continue
+
+        stack.pop()
+        result = None if post is None else post(frame[0], frame[1], frame[4])
+        if not stack:
+            return result
+        parent = stack[-1]
+        parent[4].append(result)
+        if combine is not None:
+            combine(parent[0], parent[1], result)
+
+def flatten_table(table):
+    """Return the rows of table and its subtables, in preorder, as copies without their "records", and the index of the
+    parent row of each (-1 for table) (see nest_table).
+
+    Returns:
+      tuple: (list of rows, list of parent indices)
+    """
+    rows = []
+    parents = []
+
+    def add(row, depth, parent):
+        rows.append({key: value for key, value in row.items() if key != "records"})
+        parents.append(parent)
+        return len(rows) - 1
+
+    traverse(table, pre=add, state=-1)
+    return rows, parents
+
+def nest_table(rows, parents):
+    """Give the rows flattened by flatten_table their "records" again (in place), and return the table (the first row)."""
+    for row in rows:
+        row["records"] = []
+    for row, parent in zip(rows, parents):
+        if parent >= 0:
+            rows[parent]["records"].append(row)
+    return rows[0]
+
+def nested_table(rows, depth, columns=4):
+    """Make a tree table of rows rows, nested in chains of depth rows (each row the only child of the previous one)."""
+    def row(r):
+        return {"fields": [{"text": "Row "+str(r)+" col "+str(c)} for c in range(columns)], "records": []}
+    root = row(0)
+    parent = root
+    for r in range(1, rows):
+        if r % depth == 0:
+            parent = root
+        child = row(r)
+        parent["records"].append(child)
+        parent = child
+    return root
+
+def recursive_col_widths(table, tab_width=2, tab_level=0):
+    """Get the column widths of table by recursion (as get_col_widths used to)."""
+    col_widths = [len(cell["text"]) for cell in table["fields"]]
+    col_widths[0] += tab_width * tab_level
+    for row in table["records"]:
+        child_widths = recursive_col_widths(row, tab_width, tab_level + 1)
+        for i in range(0, len(col_widths)):
+            col_widths[i] = max(col_widths[i], child_widths[i])
+    return col_widths
+
+def benchmark(table):
+    """Time recursive_col_widths, get_col_widths, print_table, Abbreviation_Index.build and
+    NCBO_Token_Classifier.collect_contexts on table, and check that the widths agree.
+
+    Returns:
+      tuple: (seconds for recursion or None if it exceeded the recursion limit, seconds for get_col_widths,
+        seconds for print_table, seconds for the abbreviations, seconds for the annotator contexts)
+    """
+    from .tree_table_extraction import get_col_widths, print_table
+    from .abbreviations import Abbreviation_Index
+    from .classifiers import NCBO_Token_Classifier
+
+    start = time.perf_counter()
+    try:
+        expected = recursive_col_widths(table)
+        recursive_time = time.perf_counter() - start
+    except RecursionError:
+        expected = None
+        recursive_time = None
+
+    start = time.perf_counter()
+    col_widths = get_col_widths(table)
+    traverse_time = time.perf_counter() - start
+    if expected is not None and col_widths != expected:
+        raise AssertionError("get_col_widths and recursion disagree")
+
+    start = time.perf_counter()
+    print_table(table, col_widths, io.StringIO())
+    print_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    Abbreviation_Index.build({"tables": [table]})
+    abbreviations_time = time.perf_counter() - start
+
+    classifier = NCBO_Token_Classifier()
+    start = time.perf_counter()
+    classifier.collect_contexts(table, None, [])
+    contexts_time = time.perf_counter() - start
+    return recursive_time, traverse_time, print_time, abbreviations_time, contexts_time
+
+def main():
+    """Run the micro-benchmark with the options given in sys.argv."""
+    parser = argparse.ArgumentParser(description="Benchmarks the iterative traversal of tree tables against recursion.")
+
+    parser.add_argument('--rows', type=int, default=10000, help='Number of rows of the table (default 10000)')
+    parser.add_argument('--depth', type=int, default=2000, help='Number of nested rows per chain (default 2000)')
+
+    args = parser.parse_args()
+
+    table = nested_table(args.rows, args.depth)
+    recursive_time, traverse_time, print_time, abbreviations_time, contexts_time = benchmark(table)
+
+    print("Rows: "+str(args.rows)+", depth: "+str(args.depth)+", recursion limit: "+str(sys.getrecursionlimit()))
+    if recursive_time is None:
+        print("Recursion:        RecursionError")
+    else:
+        print("Recursion:        "+format(recursive_time, ".3f")+"s")
+    print("get_col_widths:   "+format(traverse_time, ".3f")+"s")
+    print("print_table:      "+format(print_time, ".3f")+"s")
+    print("abbreviations:    "+format(abbreviations_time, ".3f")+"s")
+    print("collect_contexts: "+format(contexts_time, ".3f")+"s\n")
+
+if __name__ == "__main__":
+
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A grammar of units of measurement (mg, dL, mmHg, years, and compounds such as mg/dL or kg/m2).
+
+Units are declared as a canonical symbol with the ways it is written. Some symbols ("g", "L", "m",
+"d", "h"...) are far too ambiguous on their own, and are only recognized as part of a compound unit:
+  "mg"            standalone
+  "mg/dL"         compound of mg and dL
+  "g/L"           compound (neither g nor L would be recognized alone)
+  "mL/min/m2"     compounds may have any number of parts
+
+The whole grammar is compiled into one regular expression, and Unit_Grammar.scan finds every unit
+in a text in a single pass. The Unit_Token_Classifier (see classifiers) uses it to give unit tokens a
+unit feature, which fills the sio:hasUnit triple of characteristics (see Study_Subject_Interpreter).
+"""
+import re
+
+# canonical symbol -> (standalone spellings, spellings only recognized within a compound unit)
+# spellings of 4 or more lowercase letters are also matched in any case (e.g. "Years", "MMOL")
+DEFAULT_UNITS = {
+    # mass
+    "kg": (["kg", "Kg"], []),
+    "g": ([], ["g"]),
+    "mg": (["mg"], []),
+    "µg": (["µg", "μg", "ug", "mcg"], []),
+    "ng": (["ng"], []),
+    "pg": (["pg"], []),
+    # volume
+    "L": ([], ["L", "l"]),
+    "dL": (["dL", "dl"], []),
+    "mL": (["mL", "ml"], []),
+    "µL": (["µL", "μL", "uL"], []),
+    # amount of substance
+    "mol": ([], ["mol"]),
+    "mmol": (["mmol"], []),
+    "µmol": (["µmol", "μmol", "umol"], []),
+    "nmol": (["nmol"], []),
+    "pmol": (["pmol"], []),
+    # length and area
+    "m": ([], ["m"]),
+    "cm": (["cm"], []),
+    "mm": (["mm"], []),
+    "m2": (["m2", "m²"], []),
+    "cm2": (["cm2", "cm²"], []),
+    # pressure
+    "mmHg": (["mmHg", "mm Hg"], []),
+    "kPa": (["kPa"], []),
+    # energy, activity, rate
+    "kcal": (["kcal"], []),
+    "IU": (["IU"], []),
+    "mIU": (["mIU"], []),
+    "U": ([], ["U"]),
+    "bpm": (["bpm"], []),
+    # time
+    "year": (["years", "year", "yrs", "yr"], ["y"]),
+    "month": (["months", "month"], ["mo"]),
+    "week": (["weeks", "week", "wks", "wk"], ["w"]),
+    "day": (["days", "day"], ["d"]),
+    "hour": (["hours", "hour", "hrs", "hr"], ["h"]),
+    "min": (["minutes"], ["min"]),
+    "s": ([], ["s", "sec"]),
+}
+
+# the tokens of a unit, as the KG_Builder tokenizes them
+UNIT_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+class Unit_Match:
+    """A unit found by the Unit_Grammar.
+
+    Attributes:
+      symbol (string): The canonical symbol of the unit (e.g. "mg/dL")
+      start (int): Start of the unit in the text
+      end (int): End of the unit in the text
+      matching (list of strings): The tokens of the unit
+
+    """
+
+    __slots__ = ("symbol", "start", "end", "matching")
+
+    def __init__(self, symbol, start, end, matching):
+        """Instantiate a Unit_Match (see class description for the parameters)."""
+        self.symbol = symbol
+        self.start = start
+        self.end = end
+        self.matching = matching
+
+    def to_string(self):
+        """Return a string representing this match."""
+        return self.symbol+"["+str(self.start)+":"+str(self.end)+"]"
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __str__(self):
+        return self.to_string()
+
+class Unit_Grammar:
+    """The units of a unit table, compiled into a single regular expression.
+
+    Attributes:
+      symbols (dict): Spelling -> canonical symbol (casefolded spellings for those matched in any case)
+      pattern (re.Pattern): Matches a standalone or compound unit, delimited by anything but a word character or
+        a "/" (except a "/" followed by a number, as in "mL/min/1.73 m2")
+
+    """
+
+    def __init__(self, units=DEFAULT_UNITS):
+        """Instantiate a Unit_Grammar.
+
+        Parameters:
+          units (dict, optional): Canonical symbol -> (standalone spellings, compound-only spellings). DEFAULT_UNITS by default.
+        """
+        self.symbols = {}
+        standalone = []
+        every = []
+        for symbol, (alone, compound_only) in units.items():
+            for spelling in alone + compound_only:
+                if self.ignores_case(spelling):
+                    self.symbols[spelling.casefold()] = symbol
+                    expression = "(?i:"+re.escape(spelling)+")"
+                else:
+                    self.symbols[spelling] = symbol
+                    expression = re.escape(spelling)
+                every.append((spelling, expression))
+                if spelling in alone:
+                    standalone.append((spelling, expression))
+
+        # longest spellings first, so that e.g. "mmHg" is preferred over "mm"
+        any_unit = "|".join(e for s, e in sorted(every, key=lambda u: -len(u[0])))
+        alone_unit = "|".join(e for s, e in sorted(standalone, key=lambda u: -len(u[0])))
+        self.pattern = re.compile(
+            r'(?<![\w/])(?:(?:'+any_unit+r')(?:/(?:'+any_unit+r'))+|(?:'+alone_unit+r'))(?!\w|/\D)')
+
+    def ignores_case(self, spelling):
+        """Return True if spelling is matched in any case (a word of 4 or more lowercase letters)."""
+        return len(spelling) >= 4 and spelling.isalpha() and spelling.islower()
+
+    def symbol(self, spelling):
+        """Return the canonical symbol of a spelling of a (non-compound) unit."""
+        if spelling in self.symbols:
+            return self.symbols[spelling]
+        return self.symbols[spelling.casefold()]
+
+    def scan(self, text):
+        """Find the units in text.
+
+        Parameters:
+          text (string): The text to scan
+
+        Returns:
+          list: List of Unit_Match, in order of the text
+        """
+        matches = []
+        for m in self.pattern.finditer(text):
+            symbol = "/".join(self.symbol(part) for part in m.group().split("/"))
+            matches.append(Unit_Match(symbol, m.start(), m.end(), UNIT_TOKEN.findall(m.group())))
+        return matches
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""A scanner for the numerical values in the text of a cell.
+
+In one regex pass over a cell's (normalized) text, Value_Scanner finds every number, together with
+the construct it is part of:
+  number          40.3
+  percent         40 %
+  plus_minus      40.3 ± 2.1
+  range           25−40 (a "-" directly following a digit is normalized to "−", see mark_ranges)
+  paren           12 (3.5)
+  paren_percent   12 (40%)
+
+Each number is emitted as a Free_Value feature with its (start, end) character span in the text.
+Numbers are matched with the same expression the KG_Builder tokenizes them with, so the
+Free_Value_Token_Classifier can use the scanned features for the number tokens of the cell, instead
+of parsing every token with float().
+"""
+import re
+
+from .graph_framework import *
+
+# the number expression of the tokenizer in KG_Builder.annotate_features (one space around the dot allowed),
+# limited to spaces (the only whitespace removed from tokens)
+NUMBER = r'-? ?\d* ?\. ?\d+|-? ?\d*\.?\d+'
+
+# a number token, once the tokenizer's spaces have been removed
+NUMBER_TOKEN = re.compile(r'-?\d*\.?\d+')
+
+MINUS_AFTER_DIGIT = re.compile(r'(?<=[0-9])-')
+
+# a number starting with a digit must not follow a word character (the tokenizer keeps e.g. HbA1c whole)
+VALUE_PATTERN = re.compile(
+    r'(?P<first>(?:(?<!\w)|(?=[-.\s]))(?:'+NUMBER+r'))'
+    r'(?:\s*(?:(?P<plus_minus>±)|(?P<range>[−–]))\s*(?P<second>'+NUMBER+r')'
+    r'|\s*(?P<percent>%)'
+    r'|\s*\(\s*(?P<inner>'+NUMBER+r')\s*(?P<inner_percent>%)?\s*\))?')
+
+def parse_number(token):
+    """Return the value of a number token, or None if token is not a number (without raising)."""
+    if NUMBER_TOKEN.fullmatch(token):
+        return float(token)
+    return None
+
+def mark_ranges(text):
+    """Replace every "-" directly following a digit with "−", so that ranges (25-40) are not read as negative numbers."""
+    return MINUS_AFTER_DIGIT.sub('−', text)
+
+class Value_Match:
+    """A numerical construct found by the Value_Scanner.
+
+    Attributes:
+      kind (string): One of number, percent, plus_minus, range, paren, paren_percent
+      start (int): Start of the construct in the text
+      end (int): End of the construct in the text
+      values (list): The Free_Value of each number in the construct, in order
+
+    """
+
+    __slots__ = ("kind", "start", "end", "values")
+
+    def __init__(self, kind, start, end, values):
+        """Instantiate a Value_Match (see class description for the parameters)."""
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.values = values
+
+    def to_string(self):
+        """Return a string representing this match."""
+        return self.kind+"["+str(self.start)+":"+str(self.end)+"] "+" ".join(str(v.value) for v in self.values)
+
+    def __repr__(self):
+        return self.to_string()
+
+    def __str__(self):
+        return self.to_string()
+
+class Value_Scanner:
+    """Finds the numerical values of a cell in a single regex pass (see module description)."""
+
+    def scan(self, text, cell):
+        """Find the numerical constructs in text.
+
+        Parameters:
+          text (string): The normalized text of the cell (see mark_ranges)
+          cell (dict): The cell the Free_Value features originate from
+
+        Returns:
+          list: List of Value_Match, in order of the text
+        """
+        matches = []
+        for m in VALUE_PATTERN.finditer(text):
+            values = [self.make_value(m, "first", cell)]
+            if m.group("second") is not None:
+                values.append(self.make_value(m, "second", cell))
+                kind = "plus_minus" if m.group("plus_minus") is not None else "range"
+            elif m.group("percent") is not None:
+                kind = "percent"
+            elif m.group("inner") is not None:
+                values.append(self.make_value(m, "inner", cell))
+                kind = "paren_percent" if m.group("inner_percent") is not None else "paren"
+            else:
+                kind = "number"
+            matches.append(Value_Match(kind, values[0].span[0], m.end(), values))
+        return matches
+
+    def make_value(self, m, group, cell):
+        """Make the Free_Value for a number group of a match."""
+        text = m.group(group)
+        token = text.replace(" ", "")
+        # the tokenizer may include a leading space in a number, which is not part of its span
+        start = m.start(group) + len(text) - len(text.lstrip())
+        return Free_Value([token], cell, float(token), (start, m.end(group)))
@@ -1,5 +1,6 @@
 from .tree_table_extraction import print_tree_tables
 from .graph_framework import *
+from .tree_traversal import preorder
 import csv
 from os import path
 
@@ -10,6 +11,13 @@ stat_measure_constraint = Supertype_Constraint(IRI_Node("sco:StatisticalMeasure"
 # accept: table object (remember to loop thru and give ALL table objects)
 def set_text(table, input_file, indent=0):
     csv_rows = []
+    for subtable, depth in preorder(table):
+        csv_rows += set_row_text(subtable, input_file, indent+depth)
+    return csv_rows
+
+# set the text of the cells of a single table (row), without its subtables
+def set_row_text(table, input_file, indent=0):
+    csv_rows = []
     
     for colnum,cell in enumerate(table["fields"]):
         
@@ -27,17 +35,13 @@ def set_text(table, input_file, indent=0):
                     print(term+":")
                     for r in results:
                         #print(r)
-                        onto = r["annotatedClass"]["links"]["ontology"].rsplit('/', 1)[-1]
-                        #matches = r["annotations"][0]["text"]
-                        matches = r["match"]
-                        match_type = r["annotations"][0]["matchType"]
+                        onto = r.ontology
+                        matches = r.match
+                        match_type = r.match_type
                         if "WORDNET" in match_type:
-                            matches+=" ("+r["annotations"][0]["text"]+")"
-                        concept_id=r["annotatedClass"]["@id"]
-                        if 'prefLabel' not in r["annotatedClass"]:
-                            pref_label = ""
-                        else:
-                            pref_label= r["annotatedClass"]['prefLabel']
+                            matches+=" ("+r.text+")"
+                        concept_id=r.class_id
+                        pref_label=r.pref_label
                         print("  ("+onto+") "+concept_id+" : "+pref_label+" ["+matches+", "+match_type+"]")
                         
                         matches = matches.replace("`","'")+"`"+match_type #+"`"+pref_label
@@ -106,8 +110,6 @@ def set_text(table, input_file, indent=0):
                     if f.get_type() == FeatureType.INTERPRETER:
                         cell["text"]+=" "+str(f.to_string())
                 cell["text"]+="]"
-    for subtable in table["records"]:
-        csv_rows += set_text(subtable,indent+1)
     
     return csv_rows
 
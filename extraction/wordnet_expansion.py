@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Memoized WordNet lemma and synonym lookups for the NCBO_Token_Classifier.
+
+The WordNet lemmatizer and synsets are loaded lazily, on first use, which is slow in every worker
+process, and the same tokens are expanded thousands of times over a corpus. WordNet_Expander keeps
+the expansions of recently seen tokens in a bounded LRU, and can additionally be given a table of
+expansions precomputed offline, so that workers never need to load the WordNet corpus for the
+tokens in it:
+
+  python -m extraction.wordnet_expansion wordnet_table.json.gz input1.json input2.json ...
+
+  NCBO_Token_Classifier(expander=WordNet_Expander("wordnet_table.json.gz"))
+
+The table is gzipped json: {token: [[noun lemma, verb lemma, adjective lemma], [[synset lemma names], ...]]}.
+Tokens are taken from any text file (e.g. the extraction json files of a corpus).
+"""
+import argparse
+import gzip
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from nltk.stem.wordnet import WordNetLemmatizer
+from nltk.corpus import wordnet
+
+class WordNet_Expander:
+    """Looks up the WordNet lemmas and synset lemma names of tokens, with caching.
+
+    Lookups check the precomputed table first, then the LRU, and only then WordNet itself.
+
+    Attributes:
+      table (dict): Precomputed expansions (token -> (lemmas, synset lemma names)). Empty if no table file is given.
+      cache_size (int): Maximum number of tokens kept in the LRU
+      hits (int): Number of lookups answered by the table or the LRU
+      misses (int): Number of lookups that had to use WordNet
+      lock (threading.Lock): Held while the LRU is used (an expander can be shared between threads)
+
+    """
+
+    def __init__(self, table_file=None, cache_size=10000):
+        """Instantiate a WordNet_Expander.
+
+        Parameters:
+          table_file (string, optional): Path of a precomputed table (see build_table). None by default.
+          cache_size (int, optional): Maximum number of tokens kept in the LRU. 10000 by default.
+        """
+        self.table = load_table(table_file) if table_file is not None else {}
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lmtzr = None
+        self.lock = threading.Lock()
+
+    def lookup(self, token):
+        """Return the WordNet expansion of token.
+
+        Returns:
+          tuple: (list of the noun, verb and adjective lemmas of token, list of the lemma names of each of its synsets)
+        """
+        if token in self.table:
+            self.hits += 1
+            return self.table[token]
+
+        with self.lock:
+            if token in self.cache:
+                self.hits += 1
+                self.cache.move_to_end(token)
+                return self.cache[token]
+            self.misses += 1
+            if self.lmtzr is None:
+                self.lmtzr = WordNetLemmatizer()
+
+        expansion = expand(token, self.lmtzr)
+
+        with self.lock:
+            self.cache[token] = expansion
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return expansion
+
+    def lemmas(self, token):
+        """Return the noun, verb and adjective lemmas of token (as a new list)."""
+        return list(self.lookup(token)[0])
+
+    def synset_lemmas(self, token):
+        """Return the lemma names of each synset of token (a list of lists, not to be modified)."""
+        return self.lookup(token)[1]
+
+    def __getstate__(self):
+        # locks cannot be pickled (e.g. to send the expander to a worker process)
+        state = dict(self.__dict__)
+        del state["lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+def expand(token, lmtzr):
+    """Compute the WordNet expansion of token (see WordNet_Expander.lookup) using WordNet itself."""
+    lemmas = [lmtzr.lemmatize(token, pos ="n"),lmtzr.lemmatize(token, pos ="v"),lmtzr.lemmatize(token, pos ="a")]
+    synsets = [[lemma.name() for lemma in s.lemmas()] for s in wordnet.synsets(token)]
+    return lemmas, synsets
+
+def build_table(tokens):
+    """Precompute the WordNet expansions of tokens.
+
+    Parameters:
+      tokens (iterable): The tokens to expand (as they appear in the text, case included)
+
+    Returns:
+      dict: token -> (lemmas, synset lemma names)
+    """
+    lmtzr = WordNetLemmatizer()
+    return {token: expand(token, lmtzr) for token in tokens}
+
+def save_table(table, path):
+    """Save a table made by build_table to path (gzipped json)."""
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        json.dump(table, f, separators=(",", ":"))
+
+def load_table(path):
+    """Load a table saved with save_table.
+
+    Returns:
+      dict: token -> (lemmas, synset lemma names)
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return {token: tuple(expansion) for token, expansion in json.load(f).items()}
+
+def main():
+    """Build a WordNet expansion table for the tokens in the files given in sys.argv."""
+    parser = argparse.ArgumentParser(description="Precomputes the WordNet lemmas and synonyms of every token in the input files.")
+
+    parser.add_argument('table_file', help='Name of the table file to create (gzipped json)')
+    parser.add_argument('input_files', nargs='+', help='Files to take tokens from (e.g. extraction json files)')
+
+    args = parser.parse_args()
+
+    # the NCBO_Token_Classifier only expands tokens with some alphabetical character
+    tokens = set()
+    for input_file in args.input_files:
+        with open(input_file, encoding="utf-8", errors="ignore") as f:
+            tokens.update(t for t in re.findall(r'\w+', f.read()) if any(c.isalpha() for c in t))
+
+    table = build_table(sorted(tokens))
+    save_table(table, args.table_file)
+
+    print("Saved WordNet expansions of "+str(len(table))+" tokens to "+args.table_file+"\n")
+
+if __name__ == "__main__":
+
+    main()